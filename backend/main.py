@@ -1,20 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, BackgroundTasks, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, BackgroundTasks, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pathlib import Path
 import tempfile
-import zipfile
 from typing import List, Optional, Dict, Any
 import httpx
+import json
 import re
 import time
 from pydantic import BaseModel
 import subprocess
 import shutil
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from src.config import get_settings
-from src.s3_utils import upload_path, list_objects, upload_bytes, upload_file_to_key, create_presigned_url
-from src.runpod_client import submit_training_job, poll_job, create_training_pod
+from src.s3_utils import upload_path, list_objects, upload_bytes, upload_file_to_key, create_presigned_url, \
+    iter_object_chunks, list_object_summaries, list_keys_with_prefix, delete_keys
+from src.artifact_index import ArtifactIndex, ArtifactIndexCache
+from src.zip_stream import iter_stored_zip
+from src.runpod_client import submit_training_job, get_job_status, create_training_pod
+from src.job_registry import JobRegistry, TrackedJob
 
 # FastAPI 앱 생성
 app = FastAPI(title="Voice Blend API", version="1.0.0")
@@ -30,6 +37,31 @@ app.add_middleware(
 
 settings = get_settings()
 
+# 사용자별 모델 산출물 목록 캐시 (/models/indexes, /models/files, /models/archive 공용)
+artifact_index_cache = ArtifactIndexCache(list_object_summaries, ttl_sec=settings.artifact_index_ttl_sec)
+
+
+# 업로드 파일 변환(ffmpeg)과 S3 전송을 위한 스레드 풀
+# - 한글 주석: ffmpeg는 별도 프로세스이므로 스레드는 대기만 하며, 동시 ffmpeg 수는 CPU 수로 제한
+_transcode_executor = ThreadPoolExecutor(max_workers=max(1, settings.transcode_workers), thread_name_prefix="transcode")
+_upload_executor = ThreadPoolExecutor(max_workers=max(1, settings.upload_workers), thread_name_prefix="s3-upload")
+
+
+def _on_job_done(job: TrackedJob):
+    # 학습 완료 후 새 산출물이 보이도록 목록 캐시 무효화
+    uid = job.meta.get("uid")
+    if uid:
+        artifact_index_cache.invalidate(_models_prefix(uid))
+
+
+# Runpod 작업 상태 추적 (작업마다 백그라운드 폴링 1개, 재시작 시 파일에서 복원)
+job_registry = JobRegistry(get_job_status, state_file=settings.job_state_file, on_done=_on_job_done)
+
+
+@app.on_event("startup")
+async def _resume_job_tracking():
+    await job_registry.resume()
+
 
 def _sanitize_user_id(value: str) -> str:
     """영문자(a-zA-Z)만 허용. 그 외 문자는 제거. 빈 문자열이면 에러."""
@@ -40,6 +72,21 @@ def _sanitize_user_id(value: str) -> str:
     return sanitized
 
 
+def _models_prefix(uid: str) -> str:
+    return f"{settings.s3_models_prefix}{uid}/"
+
+
+async def _get_artifact_index(uid: str) -> ArtifactIndex:
+    # 한글 주석: 캐시가 비어 있으면 boto3 리스팅(블로킹)을 하므로 이벤트 루프 밖의 스레드에서 실행
+    return await run_in_threadpool(artifact_index_cache.get, _models_prefix(uid))
+
+
+def _not_modified(request: Request, index: ArtifactIndex) -> bool:
+    """클라이언트가 보낸 If-None-Match가 현재 목록의 ETag와 같으면 True."""
+    if_none_match = request.headers.get("if-none-match", "")
+    return index.etag in [t.strip() for t in if_none_match.split(",")]
+
+
 def _trigger_training_background(uid: str, run: Optional[str] = None, extra: Optional[Dict[str, Any]] = None):
     """Runpod 학습 작업을 백그라운드로 트리거."""
     try:
@@ -104,9 +151,29 @@ def _get_ffmpeg_exe() -> str:
         raise HTTPException(status_code=500, detail="ffmpeg 실행파일을 찾을 수 없습니다. ffmpeg를 설치하거나 imageio-ffmpeg를 추가하세요.")
 
 
-def _convert_to_wav_bytes(file_bytes: bytes, input_suffix: str) -> bytes:
-    """주어진 바이트(원본 확장자 참고)를 ffmpeg로 WAV 바이트로 변환.
-    - 항상 WAV로 변환하여 일관성 보장
+# loudnorm은 출력을 192kHz로 올리므로, 원본 샘플레이트 유지(AUDIO_SAMPLE_RATE=0) 설정이어도 이 값으로 되돌림
+LOUDNORM_FALLBACK_SAMPLE_RATE = 48000
+
+
+def _audio_filter_chain() -> List[str]:
+    """Settings에 따른 ffmpeg 오디오 필터 목록 (무음 제거 -> 음량 정규화 순)."""
+    filters: List[str] = []
+    if settings.audio_trim_silence:
+        # 한글 주석: 앞부분 무음을 자르고, 중간/끝의 1초 이상 무음 구간도 제거
+        th = settings.audio_silence_threshold_db
+        filters.append(
+            f"silenceremove=start_periods=1:start_threshold={th}dB:"
+            f"stop_periods=-1:stop_duration=1:stop_threshold={th}dB"
+        )
+    if settings.audio_loudnorm:
+        filters.append("loudnorm=I=-16:TP=-1.5:LRA=11")
+    return filters
+
+
+def _convert_to_wav_segments(file_bytes: bytes, input_suffix: str) -> List[bytes]:
+    """주어진 바이트(원본 확장자 참고)를 ffmpeg 한 번의 실행으로 학습용 WAV로 변환.
+    - 한글 주석: 리샘플링/모노 변환/무음 제거/음량 정규화/구간 분할을 모두 같은 패스에서 처리
+    - 한글 주석: AUDIO_SEGMENT_SEC > 0 이면 여러 WAV 조각을 순서대로 반환, 아니면 1개
     - ffmpeg 표준 출력 사용 대신 임시 파일로 안전하게 처리
     """
     ffmpeg_exe = _get_ffmpeg_exe()
@@ -114,17 +181,30 @@ def _convert_to_wav_bytes(file_bytes: bytes, input_suffix: str) -> bytes:
     with tempfile.NamedTemporaryFile(delete=False, suffix=input_suffix) as in_f:
         in_f.write(file_bytes)
         in_path = Path(in_f.name)
-    # 출력 임시 파일 경로
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as out_f:
-        out_path = Path(out_f.name)
+    # 출력 임시 디렉터리 (분할 시 조각 파일이 여러 개 생김)
+    out_dir = Path(tempfile.mkdtemp(prefix="transcode_"))
     try:
-        # 단순 변환 (채널/샘플레이트는 원본 유지). 필요 시 -ac/-ar 옵션으로 표준화 가능
-        proc = subprocess.run([
-            ffmpeg_exe, '-y', '-hide_banner', '-loglevel', 'error',
-            '-i', str(in_path), str(out_path)
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        wav_bytes = out_path.read_bytes()
-        return wav_bytes
+        cmd = [ffmpeg_exe, '-y', '-hide_banner', '-loglevel', 'error', '-i', str(in_path), '-vn']
+        filters = _audio_filter_chain()
+        if filters:
+            cmd += ['-af', ','.join(filters)]
+        if settings.audio_sample_rate > 0:
+            cmd += ['-ar', str(settings.audio_sample_rate)]
+        elif settings.audio_loudnorm:
+            cmd += ['-ar', str(LOUDNORM_FALLBACK_SAMPLE_RATE)]
+        if settings.audio_mono:
+            cmd += ['-ac', '1']
+        cmd += ['-c:a', 'pcm_s16le']
+        if settings.audio_segment_sec > 0:
+            cmd += ['-f', 'segment', '-segment_time', str(settings.audio_segment_sec), '-reset_timestamps', '1',
+                    str(out_dir / 'part_%04d.wav')]
+        else:
+            cmd += [str(out_dir / 'part_0000.wav')]
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        segments = [p.read_bytes() for p in sorted(out_dir.glob('part_*.wav'))]
+        if not segments:
+            raise HTTPException(status_code=400, detail="변환 결과가 비어 있습니다 (무음 파일일 수 있습니다).")
+        return segments
     except subprocess.CalledProcessError as e:
         err = e.stderr.decode('utf-8', errors='ignore') if e.stderr else str(e)
         raise HTTPException(status_code=500, detail=f"오디오 변환 실패: {err}")
@@ -134,10 +214,58 @@ def _convert_to_wav_bytes(file_bytes: bytes, input_suffix: str) -> bytes:
             in_path.unlink(missing_ok=True)
         except Exception:
             pass
-        try:
-            out_path.unlink(missing_ok=True)
-        except Exception:
-            pass
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def _key_stem(key: str) -> str:
+    return key[:-len(".wav")] if key.endswith(".wav") else key
+
+
+def _segment_keys(key: str, count: int) -> List[str]:
+    """조각이 여러 개면 {이름}_part001.wav 형태의 키를 생성."""
+    if count == 1:
+        return [key]
+    stem = _key_stem(key)
+    return [f"{stem}_part{i + 1:03d}.wav" for i in range(count)]
+
+
+def _delete_stale_segments(key: str, current_keys: List[str]) -> List[str]:
+    """같은 파일의 이전 업로드가 남긴 키({이름}.wav, {이름}_partNNN.wav) 중 이번에 쓰지 않은 것을 삭제.
+    - 한글 주석: 조각 수가 줄어든 재업로드에서 옛 조각이 학습에 섞이지 않도록 함
+    """
+    stem = _key_stem(key)
+    pattern = re.compile(re.escape(stem) + r"_part\d{3}\.wav")
+    current = set(current_keys)
+    stale = [k for k in list_keys_with_prefix(stem)
+             if k not in current and (k == key or pattern.fullmatch(k))]
+    return delete_keys(stale) if stale else []
+
+
+async def _transcode_and_upload(content: bytes, input_suffix: str, key: str) -> Dict[str, Any]:
+    """WAV 변환 후 S3 업로드. 각 단계는 풀에서 실행되어 이벤트 루프를 막지 않음.
+    - 반환: 업로드된 키 목록, 크기, 단계별 소요 시간(ms)
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    segments = await loop.run_in_executor(_transcode_executor, _convert_to_wav_segments, content, input_suffix)
+    transcoded = time.perf_counter()
+    keys = _segment_keys(key, len(segments))
+    uploaded_keys = await asyncio.gather(*[
+        loop.run_in_executor(_upload_executor, upload_bytes, data, k) for data, k in zip(segments, keys)
+    ])
+    # 한글 주석: 새 조각을 모두 올린 뒤에 지워서, 중간에 실패해도 이전 업로드가 통째로 사라지지 않게 함
+    await loop.run_in_executor(_upload_executor, _delete_stale_segments, key, list(uploaded_keys))
+    done = time.perf_counter()
+    return {
+        "s3_keys": list(uploaded_keys),
+        "input_bytes": len(content),
+        "output_bytes": sum(len(data) for data in segments),
+        "timing_ms": {
+            "transcode": round((transcoded - start) * 1000.0, 1),
+            "upload": round((done - transcoded) * 1000.0, 1),
+            "total": round((done - start) * 1000.0, 1),
+        },
+    }
 
 
 @app.get("/")
@@ -165,10 +293,13 @@ async def upload_audio(
     try:
         # 업로드 파일을 WAV로 변환
         content = await file.read()
-        wav_bytes = _convert_to_wav_bytes(content, input_suffix=file_ext)
-
         key = f"voice_blend/{user_id_clean}/uploads/{target}"
-        uploaded_key = upload_bytes(wav_bytes, key)
+        uploaded = await _transcode_and_upload(content, file_ext, key)
+        uploaded_keys = uploaded["s3_keys"]
+        uploaded_key = uploaded_keys[0]
+
+        # 새 학습으로 산출물이 바뀌므로 목록 캐시 무효화
+        artifact_index_cache.invalidate(_models_prefix(user_id_clean))
 
         # 업로드 직후 외부 학습 서버 트리거 (백그라운드)
         if background_tasks is not None:
@@ -180,7 +311,7 @@ async def upload_audio(
         return JSONResponse(status_code=200, content={
             "message": "업로드 성공",
             "file_name": target,
-            "s3_keys": [uploaded_key],
+            "s3_keys": uploaded_keys,
             "s3_prefix": f"voice_blend/{user_id_clean}/uploads/",
             "bucket": settings.s3_bucket,
             "user_id": user_id_clean,
@@ -206,6 +337,9 @@ async def upload_multiple_audio(
     try:
         s3_prefix = f"voice_blend/{user_id_clean}/uploads/"
         uploaded_keys_all: List[str] = []
+        started = time.perf_counter()
+        # 한글 주석: 파일별 변환/업로드를 동시에 시작하고, 끝난 파일부터 바로 업로드되도록 파이프라인 구성
+        pending = []
         for idx, file in enumerate(files):
             orig_name = Path(file.filename).name
             file_ext = Path(orig_name).suffix.lower()
@@ -216,29 +350,55 @@ async def upload_multiple_audio(
                     "message": f"지원하지 않는 파일 형식: {file_ext} (허용: mp3/m4a/wav)"
                 })
                 continue
-            # WAV로 변환 후 저장
             content = await file.read()
-            wav_bytes = _convert_to_wav_bytes(content, input_suffix=file_ext)
             target = f"{user_id_clean}.wav" if idx == 0 else f"{user_id_clean}_{idx+1}.wav"
-            key = s3_prefix + target
-            uploaded_key = upload_bytes(wav_bytes, key)
-            uploaded_keys_all.append(uploaded_key)
+            pending.append((target, _transcode_and_upload(content, file_ext, s3_prefix + target)))
+
+        outcomes = await asyncio.gather(*[coro for _, coro in pending], return_exceptions=True)
+        for (target, _), outcome in zip(pending, outcomes):
+            if isinstance(outcome, BaseException):
+                message = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+                uploaded_results.append({
+                    "file_name": target,
+                    "status": "error",
+                    "message": message,
+                })
+                continue
+            uploaded_keys_all.extend(outcome["s3_keys"])
             uploaded_results.append({
                 "file_name": target,
                 "status": "success",
-                "s3_keys": [uploaded_key]
+                "s3_keys": outcome["s3_keys"],
+                "input_bytes": outcome["input_bytes"],
+                "output_bytes": outcome["output_bytes"],
+                "timing_ms": outcome["timing_ms"],
             })
+        elapsed_ms = round((time.perf_counter() - started) * 1000.0, 1)
+        num_succeeded = sum(1 for r in uploaded_results if r["status"] == "success")
+
+        # 한글 주석: 하나도 올라가지 않았으면 캐시 무효화와 학습 트리거 없이 파일별 결과와 함께 실패 반환
+        if not uploaded_keys_all:
+            return JSONResponse(status_code=400, content={
+                "message": "업로드된 파일이 없습니다",
+                "results": uploaded_results,
+                "elapsed_ms": elapsed_ms,
+                "user_id": user_id_clean,
+            })
+
+        # 새 학습으로 산출물이 바뀌므로 목록 캐시 무효화
+        artifact_index_cache.invalidate(_models_prefix(user_id_clean))
 
         # 업로드 직후 외부 학습 서버 트리거 (백그라운드)
         if background_tasks is not None:
             background_tasks.add_task(_notify_external_train, user_id_clean)
 
-        debug_msg = f"[업로드 완료] uid:{user_id_clean} bucket:{settings.s3_bucket} count:{len(uploaded_keys_all)} first_key:{uploaded_keys_all[0] if uploaded_keys_all else '-'}"
+        debug_msg = f"[업로드 완료] uid:{user_id_clean} bucket:{settings.s3_bucket} count:{len(uploaded_keys_all)} first_key:{uploaded_keys_all[0] if uploaded_keys_all else '-'} elapsed_ms:{elapsed_ms}"
         print(debug_msg)
 
         return JSONResponse(status_code=200, content={
-            "message": f"{len(uploaded_results)}개 파일 업로드 완료",
+            "message": f"{num_succeeded}/{len(uploaded_results)}개 파일 업로드 완료",
             "results": uploaded_results,
+            "elapsed_ms": elapsed_ms,
             "s3_prefix": s3_prefix,
             "bucket": settings.s3_bucket,
             "user_id": user_id_clean,
@@ -283,14 +443,18 @@ async def start_training(req: TrainRequest):
 
     job_id = submit_training_job(endpoint, s3_input_prefix, s3_output_prefix, extra=payload_extra)
 
+    artifact_index_cache.invalidate(_models_prefix(uid))
+    job = job_registry.track(endpoint, job_id, uid=uid, s3_output_prefix=s3_output_prefix)
+
     if req.wait:
-        res = poll_job(endpoint, job_id)
+        # 한글 주석: 이벤트 루프를 막지 않고 레지스트리의 폴링 결과를 기다림
+        job = await job_registry.wait_until_done(job_id)
         return {
             "endpoint_id": endpoint,
             "job_id": job_id,
-            "status": res.status,
-            "output": res.output,
-            "error": res.error,
+            "status": job.status,
+            "output": job.output,
+            "error": job.error,
             "s3_input_prefix": s3_input_prefix,
             "s3_output_prefix": s3_output_prefix,
         }
@@ -309,32 +473,77 @@ async def start_training(req: TrainRequest):
     }
 
 
+def _get_tracked_job(job_id: str) -> TrackedJob:
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="추적 중인 작업이 없습니다.")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str,
+                  since: Optional[int] = Query(None, description="이 version 이후의 변경을 기다림 (롱 폴링)"),
+                  timeout: float = Query(30.0, ge=0, le=120, description="롱 폴링 최대 대기(초)")):
+    """작업 상태 조회.
+    - 한글 주석: since를 주면 상태가 바뀌거나 timeout이 지날 때까지 응답을 보류 (롱 폴링)
+    - 한글 주석: Runpod 조회는 백그라운드 태스크가 담당하므로 클라이언트 수와 무관
+    """
+    job = _get_tracked_job(job_id)
+    if since is not None:
+        job = await job_registry.wait_for_change(job_id, since, timeout)
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """작업 상태 변경을 Server-Sent Events로 전송. 작업이 끝나면 스트림 종료."""
+    _get_tracked_job(job_id)
+
+    async def event_stream():
+        async for job in job_registry.subscribe(job_id):
+            if job is None:
+                # 한글 주석: 프록시가 연결을 끊지 않도록 주기적으로 주석 라인 전송
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {job.version}\nevent: status\ndata: {json.dumps(job.to_dict(), ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.get("/models/indexes")
-async def list_user_indexes(user_id: str = Query(..., description="사용자 UID")):
+async def list_user_indexes(request: Request, response: Response, user_id: str = Query(..., description="사용자 UID")):
     user_id_clean = _sanitize_user_id(user_id)
     try:
-        prefix = f"{settings.s3_models_prefix}{user_id_clean}/"
-        keys = list_objects(prefix)
-        index_keys = [k for k in keys if k.lower().endswith('.index')]
-        return {"bucket": settings.s3_bucket, "prefix": prefix, "indexes": index_keys, "user_id": user_id_clean}
+        index = await _get_artifact_index(user_id_clean)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if _not_modified(request, index):
+        return Response(status_code=304, headers={"ETag": index.etag})
+    response.headers["ETag"] = index.etag
+    return {"bucket": settings.s3_bucket, "prefix": index.prefix, "indexes": index.index_keys, "user_id": user_id_clean}
 
 
 @app.get("/models/files")
-async def list_user_model_files(user_id: str = Query(..., description="사용자 UID")):
+async def list_user_model_files(request: Request, response: Response, user_id: str = Query(..., description="사용자 UID")):
     """사용자별 모델 산출물(.index, .pth) 조회.
     - 한글 주석: voice_blend/models/{uid}/ 하위에서 확장자별로 필터링
+    - 한글 주석: 목록은 캐시에서 제공하며 ETag/If-None-Match로 재검증 가능
     """
     user_id_clean = _sanitize_user_id(user_id)
     try:
-        prefix = f"{settings.s3_models_prefix}{user_id_clean}/"
-        keys = list_objects(prefix)
-        index_keys = [k for k in keys if k.lower().endswith('.index')]
-        pth_keys = [k for k in keys if k.lower().endswith('.pth')]
-        return {"bucket": settings.s3_bucket, "prefix": prefix, "indexes": index_keys, "pths": pth_keys, "user_id": user_id_clean}
+        index = await _get_artifact_index(user_id_clean)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if _not_modified(request, index):
+        return Response(status_code=304, headers={"ETag": index.etag})
+    response.headers["ETag"] = index.etag
+    return {"bucket": settings.s3_bucket, "prefix": index.prefix, "indexes": index.index_keys, "pths": index.pth_keys, "user_id": user_id_clean}
+
+
+@app.get("/models/cache-stats")
+async def artifact_index_cache_stats():
+    """산출물 목록 캐시의 적중률과 S3 리스팅 지연 시간."""
+    return artifact_index_cache.stats.to_dict()
 
 
 @app.get("/health")
@@ -351,12 +560,32 @@ async def health_check():
 
 try:
 	from src.model_blender.backend.logic import blend_voices as local_blend
+	from src.model_blender.backend.logic import blend_voice_models as local_blend_models
 except Exception:
 	local_blend = None
+	local_blend_models = None
+
+
+def _save_upload_to_temp(upload: UploadFile, suffix: str = ".pth") -> Path:
+	"""업로드 파일을 메모리에 모두 올리지 않고 임시 파일로 스트리밍 저장."""
+	with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+		shutil.copyfileobj(upload.file, f, length=1024 * 1024)
+		return Path(f.name)
+
+
+def _blend_result(msg: str, out_path: Optional[str]):
+	if not out_path:
+		raise HTTPException(status_code=400, detail=msg)
+	filename = Path(out_path).name
+	return {
+		"message": msg,
+		"filename": filename,
+		"download_url": f"/blend/download?filename={filename}",
+	}
 
 
 @app.post("/blend/local")
-async def blend_local(
+def blend_local(
 	name: str = Form(...),
 	ratio: float = Form(...),
 	model_a: UploadFile = File(...),
@@ -365,23 +594,39 @@ async def blend_local(
 	"""두 개의 .pth를 업로드 받아 로컬에서 블렌딩하고 파일명을 반환."""
 	if local_blend is None:
 		raise HTTPException(status_code=500, detail="model_blender 로직을 불러올 수 없습니다.")
-	# 임시 저장
-	with tempfile.NamedTemporaryFile(delete=False, suffix=".pth") as f1:
-		f1.write(await model_a.read())
-		p1 = Path(f1.name)
-	with tempfile.NamedTemporaryFile(delete=False, suffix=".pth") as f2:
-		f2.write(await model_b.read())
-		p2 = Path(f2.name)
-	# 로컬 블렌딩 실행
-	msg, out_path = local_blend(name=name, path1=str(p1), path2=str(p2), ratio=ratio)
-	if not out_path:
-		raise HTTPException(status_code=400, detail=msg)
-	filename = Path(out_path).name
-	return {
-		"message": msg,
-		"filename": filename,
-		"download_url": f"/blend/download?filename={filename}",
-	}
+	# 임시 저장 (스트리밍)
+	paths = [_save_upload_to_temp(model_a), _save_upload_to_temp(model_b)]
+	try:
+		# 로컬 블렌딩 실행
+		msg, out_path = local_blend(name=name, path1=str(paths[0]), path2=str(paths[1]), ratio=ratio)
+	finally:
+		for p in paths:
+			p.unlink(missing_ok=True)
+	return _blend_result(msg, out_path)
+
+
+@app.post("/blend/local-multi")
+def blend_local_multi(
+	name: str = Form(...),
+	weights: str = Form(..., description="쉼표로 구분한 모델별 가중치 (예: 0.5,0.3,0.2)"),
+	models: List[UploadFile] = File(...),
+):
+	"""N개의 .pth를 업로드 받아 가중치대로 한 번에 블렌딩하고 파일명을 반환."""
+	if local_blend_models is None:
+		raise HTTPException(status_code=500, detail="model_blender 로직을 불러올 수 없습니다.")
+	try:
+		weight_values = [float(w) for w in weights.split(",") if w.strip()]
+	except ValueError:
+		raise HTTPException(status_code=400, detail="가중치는 숫자여야 합니다")
+	if len(weight_values) != len(models):
+		raise HTTPException(status_code=400, detail="모델 수와 가중치 수가 같아야 합니다")
+	paths = [_save_upload_to_temp(m) for m in models]
+	try:
+		msg, out_path = local_blend_models(name=name, paths=[str(p) for p in paths], weights=weight_values)
+	finally:
+		for p in paths:
+			p.unlink(missing_ok=True)
+	return _blend_result(msg, out_path)
 
 
 @app.get("/blend/download")
@@ -435,30 +680,33 @@ async def presign_model_url(key: str = Query(..., description="S3 객체 키(.in
 async def download_models_archive(user_id: str = Query(..., description="사용자 UID")):
     """지정 사용자의 .pth와 .index를 모아 단일 ZIP으로 다운로드.
     - 한글 주석: 브라우저 자동 다운로드 제한을 우회하기 위해 하나의 파일로 묶어서 제공
+    - 한글 주석: S3 객체를 동시에 받아 오면서 무압축 ZIP 스트림으로 바로 전송 (임시 파일 없음)
     """
     uid = _sanitize_user_id(user_id)
-    prefix = f"{settings.s3_models_prefix}{uid}/"
-    keys = list_objects(prefix)
-    selected = [k for k in keys if k.lower().endswith('.pth') or k.lower().endswith('.index')]
+    selected = (await _get_artifact_index(uid)).keys_with_ext('.pth', '.index')
     if not selected:
         raise HTTPException(status_code=404, detail="다운로드할 모델 파일이 없습니다")
 
-    # 임시 디렉터리에 개별 파일 다운로드 후 ZIP 생성
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir_path = Path(tmpdir)
-        part_paths = []
-        for k in selected:
-            dst = tmpdir_path / Path(k).name
-            from src.s3_utils import download_object_to_path
-            download_object_to_path(k, dst)
-            part_paths.append(dst)
-
-        zip_path = tmpdir_path / f"{uid}_models.zip"
-        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            for p in part_paths:
-                zf.write(p, arcname=p.name)
-
-        return FileResponse(path=str(zip_path), media_type="application/zip", filename=zip_path.name)
+    # 같은 파일명이 여러 하위 폴더에 있으면 ZIP 안에서 겹치지 않도록 번호를 붙임
+    entries = []
+    used_names = set()
+    for k in selected:
+        name = Path(k).name
+        if name in used_names:
+            stem, suffix = Path(name).stem, Path(name).suffix
+            i = 1
+            while f"{stem}_{i}{suffix}" in used_names:
+                i += 1
+            name = f"{stem}_{i}{suffix}"
+        used_names.add(name)
+        entries.append((name, lambda key=k: iter_object_chunks(key)))
+
+    filename = f"{uid}_models.zip"
+    return StreamingResponse(
+        iter_stored_zip(entries, max_concurrency=4),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (키, ETag, 크기, 마지막 수정 시각 문자열)
+ObjectSummary = Tuple[str, str, int, str]
+
+
+@dataclass
+class ArtifactIndex:
+	"""사용자 한 명의 모델 산출물 목록 (S3 리스팅 1회 결과)."""
+	prefix: str
+	keys: List[str]
+	etag: str
+	listed_at: float
+
+	def keys_with_ext(self, *exts: str) -> List[str]:
+		exts_lower = tuple(e.lower() for e in exts)
+		return [k for k in self.keys if k.lower().endswith(exts_lower)]
+
+	@property
+	def index_keys(self) -> List[str]:
+		return self.keys_with_ext(".index")
+
+	@property
+	def pth_keys(self) -> List[str]:
+		return self.keys_with_ext(".pth")
+
+
+@dataclass
+class ArtifactIndexStats:
+	hits: int = 0
+	misses: int = 0
+	invalidations: int = 0
+	listing_count: int = 0
+	listing_total_sec: float = 0.0
+	listing_max_sec: float = 0.0
+	listing_last_sec: float = 0.0
+
+	def to_dict(self) -> Dict[str, float]:
+		lookups = self.hits + self.misses
+		mean_sec = self.listing_total_sec / self.listing_count if self.listing_count else 0.0
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits / lookups if lookups else 0.0,
+			"invalidations": self.invalidations,
+			"listing_count": self.listing_count,
+			"listing_mean_ms": mean_sec * 1000.0,
+			"listing_max_ms": self.listing_max_sec * 1000.0,
+			"listing_last_ms": self.listing_last_sec * 1000.0,
+			# 캐시 적중 1회마다 평균 리스팅 시간만큼 절약했다고 추정
+			"estimated_saved_ms": self.hits * mean_sec * 1000.0,
+		}
+
+
+def compute_listing_etag(summaries: List[ObjectSummary]) -> str:
+	"""객체 키/ETag/크기/수정 시각으로 목록 전체의 ETag를 계산 (목록이 바뀌면 값도 바뀜)."""
+	h = hashlib.sha1()
+	for key, etag, size, last_modified in sorted(summaries):
+		h.update(f"{key}\0{etag}\0{size}\0{last_modified}\n".encode("utf-8"))
+	return '"' + h.hexdigest() + '"'
+
+
+class ArtifactIndexCache:
+	"""
+	프리픽스별 산출물 목록을 프로세스 메모리에 TTL 동안 캐시.
+	- 업로드/학습 시작/학습 완료 시 invalidate()로 즉시 무효화
+	- 같은 프리픽스에 대한 동시 요청은 리스팅을 한 번만 수행
+	"""
+
+	def __init__(self, list_func: Callable[[str], List[ObjectSummary]], ttl_sec: float = 60.0):
+		self._list_func = list_func
+		self.ttl_sec = ttl_sec
+		self._entries: Dict[str, ArtifactIndex] = {}
+		self._prefix_locks: Dict[str, threading.Lock] = {}
+		self._lock = threading.Lock()
+		self.stats = ArtifactIndexStats()
+
+	def _get_prefix_lock(self, prefix: str) -> threading.Lock:
+		with self._lock:
+			lock = self._prefix_locks.get(prefix)
+			if lock is None:
+				lock = threading.Lock()
+				self._prefix_locks[prefix] = lock
+			return lock
+
+	def _get_fresh(self, prefix: str) -> Optional[ArtifactIndex]:
+		entry = self._entries.get(prefix)
+		if entry is not None and time.time() - entry.listed_at < self.ttl_sec:
+			return entry
+		return None
+
+	def get(self, prefix: str) -> ArtifactIndex:
+		with self._lock:
+			entry = self._get_fresh(prefix)
+			if entry is not None:
+				self.stats.hits += 1
+				return entry
+		with self._get_prefix_lock(prefix):
+			# 한글 주석: 락을 기다리는 동안 다른 요청이 이미 목록을 갱신했을 수 있음
+			with self._lock:
+				entry = self._get_fresh(prefix)
+				if entry is not None:
+					self.stats.hits += 1
+					return entry
+				self.stats.misses += 1
+			start = time.perf_counter()
+			summaries = self._list_func(prefix)
+			elapsed = time.perf_counter() - start
+			entry = ArtifactIndex(
+				prefix=prefix,
+				keys=[s[0] for s in summaries],
+				etag=compute_listing_etag(summaries),
+				listed_at=time.time(),
+			)
+			with self._lock:
+				self._entries[prefix] = entry
+				self.stats.listing_count += 1
+				self.stats.listing_total_sec += elapsed
+				self.stats.listing_max_sec = max(self.stats.listing_max_sec, elapsed)
+				self.stats.listing_last_sec = elapsed
+			return entry
+
+	def invalidate(self, prefix: Optional[str] = None):
+		"""prefix의 캐시를 제거. prefix가 None이면 전체 제거."""
+		with self._lock:
+			if prefix is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(prefix, None)
+			self.stats.invalidations += 1
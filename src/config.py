@@ -27,6 +27,20 @@ class Settings:
 	runpod_pod_image: str | None
 	# 외부 학습 트리거 URL (옵션)
 	external_train_url: str | None
+	# 사용자별 산출물 목록 캐시 유지 시간(초)
+	artifact_index_ttl_sec: float
+	# Runpod 작업 추적 상태 저장 파일
+	job_state_file: str
+	# 업로드 변환/전송 동시 실행 수
+	transcode_workers: int
+	upload_workers: int
+	# 업로드 오디오 전처리 (0/빈 값이면 해당 단계 생략)
+	audio_sample_rate: int
+	audio_mono: bool
+	audio_trim_silence: bool
+	audio_silence_threshold_db: float
+	audio_loudnorm: bool
+	audio_segment_sec: float
 
 	def s3_uri(self, prefix: str) -> str:
 		"""S3 프리픽스를 s3 URI 형태로 변환."""
@@ -54,6 +68,12 @@ def _parse_artifact_exts(raw: str | None) -> List[str]:
 	return exts or [".pth", ".index"]
 
 
+def _parse_bool(raw: str | None, default: bool) -> bool:
+	if raw is None or raw.strip() == "":
+		return default
+	return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
 def get_settings() -> Settings:
 	"""환경변수에서 설정을 읽어 Settings로 반환."""
 	return Settings(
@@ -69,4 +89,14 @@ def get_settings() -> Settings:
 		runpod_pod_template_id=os.getenv("RUNPOD_POD_TEMPLATE_ID"),
 		runpod_pod_image=os.getenv("RUNPOD_POD_IMAGE"),
 		external_train_url=os.getenv("EXTERNAL_TRAIN_URL", "https://n7f2zix4pkmdgk-8000.proxy.runpod.net/train"),
+		artifact_index_ttl_sec=float(os.getenv("ARTIFACT_INDEX_TTL_SEC", "60")),
+		job_state_file=os.getenv("JOB_STATE_FILE", "logs/runpod_jobs.json"),
+		transcode_workers=int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 2))),
+		upload_workers=int(os.getenv("UPLOAD_WORKERS", "8")),
+		audio_sample_rate=int(os.getenv("AUDIO_SAMPLE_RATE", "40000")),
+		audio_mono=_parse_bool(os.getenv("AUDIO_MONO"), True),
+		audio_trim_silence=_parse_bool(os.getenv("AUDIO_TRIM_SILENCE"), True),
+		audio_silence_threshold_db=float(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", "-50")),
+		audio_loudnorm=_parse_bool(os.getenv("AUDIO_LOUDNORM"), False),
+		audio_segment_sec=float(os.getenv("AUDIO_SEGMENT_SEC", "0")),
 	)
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT", "TIMEOUT"}
+
+# (endpoint_id, job_id) -> Runpod 응답 dict ({"status": ..., "output": ...})
+JobStatusFunc = Callable[[str, str], Dict[str, Any]]
+
+
+@dataclass
+class TrackedJob:
+	"""레지스트리가 추적하는 Runpod 작업 한 건의 상태."""
+	endpoint_id: str
+	job_id: str
+	status: str = "SUBMITTED"
+	output: Any = None
+	error: Optional[str] = None
+	submitted_at: float = field(default_factory=time.time)
+	updated_at: float = field(default_factory=time.time)
+	polls: int = 0
+	version: int = 0
+	meta: Dict[str, Any] = field(default_factory=dict)
+
+	@property
+	def done(self) -> bool:
+		return self.status in TERMINAL_STATUSES
+
+	def to_dict(self) -> Dict[str, Any]:
+		d = asdict(self)
+		d["done"] = self.done
+		return d
+
+
+class JobRegistry:
+	"""
+	Runpod 작업 상태를 백그라운드 asyncio 태스크로 폴링하고 여러 클라이언트에 공유.
+	- 작업마다 폴링 태스크는 하나뿐이며, 같은 작업을 여러 번 track()해도 중복 폴링하지 않음
+	- 폴링 간격은 상태가 바뀌지 않는 동안 지수적으로 늘어남 (바뀌면 다시 초기 간격)
+	- 동시에 나가는 상류(Runpod) 요청 수는 max_concurrent_polls로 제한
+	- 상태는 JSON 파일에 저장되어 서버 재시작 후 resume()으로 이어서 추적
+	"""
+
+	def __init__(
+		self,
+		status_func: JobStatusFunc,
+		state_file: Optional[str] = None,
+		initial_interval_sec: float = 5.0,
+		max_interval_sec: float = 60.0,
+		backoff: float = 2.0,
+		timeout_sec: float = 7200.0,
+		max_concurrent_polls: int = 4,
+		on_done: Optional[Callable[[TrackedJob], Any]] = None,
+	):
+		self._status_func = status_func
+		self._state_file = Path(state_file) if state_file else None
+		self.initial_interval_sec = initial_interval_sec
+		self.max_interval_sec = max_interval_sec
+		self.backoff = backoff
+		self.timeout_sec = timeout_sec
+		self._max_concurrent_polls = max_concurrent_polls
+		self._on_done = on_done
+
+		self._jobs: Dict[str, TrackedJob] = {}
+		self._tasks: Dict[str, asyncio.Task] = {}
+		self._semaphore: Optional[asyncio.Semaphore] = None
+		self._changed: Optional[asyncio.Condition] = None
+
+	def _get_semaphore(self) -> asyncio.Semaphore:
+		# 한글 주석: 이벤트 루프 안에서 처음 사용할 때 생성
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self._max_concurrent_polls)
+		return self._semaphore
+
+	def _get_condition(self) -> asyncio.Condition:
+		if self._changed is None:
+			self._changed = asyncio.Condition()
+		return self._changed
+
+	# ---------------- 저장/복원 ----------------
+
+	def _save(self):
+		if self._state_file is None:
+			return
+		try:
+			self._state_file.parent.mkdir(parents=True, exist_ok=True)
+			tmp = self._state_file.with_suffix(self._state_file.suffix + ".tmp")
+			data = {job_id: asdict(job) for job_id, job in self._jobs.items()}
+			tmp.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+			os.replace(tmp, self._state_file)
+		except Exception as e:
+			logging.warning(f"[작업 상태 저장 실패] {e}")
+
+	def _load(self):
+		if self._state_file is None or not self._state_file.exists():
+			return
+		try:
+			data = json.loads(self._state_file.read_text(encoding="utf-8"))
+		except Exception as e:
+			logging.warning(f"[작업 상태 로드 실패] {e}")
+			return
+		for job_id, d in data.items():
+			if job_id not in self._jobs:
+				self._jobs[job_id] = TrackedJob(**d)
+
+	async def resume(self):
+		"""저장된 상태를 불러와 끝나지 않은 작업의 폴링을 다시 시작 (앱 시작 시 호출)."""
+		self._load()
+		for job in list(self._jobs.values()):
+			if not job.done:
+				self._start_polling(job)
+
+	# ---------------- 추적 ----------------
+
+	def get(self, job_id: str) -> Optional[TrackedJob]:
+		return self._jobs.get(job_id)
+
+	def track(self, endpoint_id: str, job_id: str, **meta) -> TrackedJob:
+		"""작업 추적을 시작. 이미 추적 중이면 기존 항목을 그대로 반환."""
+		job = self._jobs.get(job_id)
+		if job is None:
+			job = TrackedJob(endpoint_id=endpoint_id, job_id=job_id, meta=dict(meta))
+			self._jobs[job_id] = job
+			self._save()
+		if not job.done:
+			self._start_polling(job)
+		return job
+
+	def _start_polling(self, job: TrackedJob):
+		task = self._tasks.get(job.job_id)
+		if task is not None and not task.done():
+			return
+		self._tasks[job.job_id] = asyncio.create_task(self._poll_loop(job))
+
+	async def _update(self, job: TrackedJob, status: str, output: Any = None, error: Optional[str] = None):
+		changed = status != job.status or output != job.output or error != job.error
+		job.status = status
+		job.output = output
+		job.error = error
+		job.updated_at = time.time()
+		if changed:
+			job.version += 1
+			self._save()
+			condition = self._get_condition()
+			async with condition:
+				condition.notify_all()
+		return changed
+
+	async def _poll_loop(self, job: TrackedJob):
+		interval = self.initial_interval_sec
+		deadline = job.submitted_at + self.timeout_sec
+		try:
+			while not job.done:
+				if time.time() >= deadline:
+					await self._update(job, "TIMEOUT", None, "timeout")
+					break
+				try:
+					async with self._get_semaphore():
+						info = await asyncio.to_thread(self._status_func, job.endpoint_id, job.job_id)
+					job.polls += 1
+					status = (info or {}).get("status", "UNKNOWN")
+					output = (info or {}).get("output")
+					error = None
+					if status in TERMINAL_STATUSES and status != "COMPLETED":
+						error = str(output)
+						output = None
+					changed = await self._update(job, status, output, error)
+				except Exception as e:
+					# 한글 주석: 일시적 오류는 기록만 하고 간격을 늘려 재시도
+					logging.warning(f"[작업 상태 조회 실패] job:{job.job_id} err:{e}")
+					changed = False
+				if job.done:
+					break
+				interval = self.initial_interval_sec if changed else min(interval * self.backoff, self.max_interval_sec)
+				await asyncio.sleep(interval)
+			if self._on_done is not None:
+				result = self._on_done(job)
+				if isinstance(result, Awaitable):
+					await result
+		finally:
+			self._tasks.pop(job.job_id, None)
+
+	# ---------------- 대기/구독 ----------------
+
+	async def wait_for_change(self, job_id: str, since_version: int, timeout_sec: float) -> Optional[TrackedJob]:
+		"""롱 폴링: version이 since_version보다 커지거나 작업이 끝나거나 시간이 다 될 때까지 대기."""
+		job = self._jobs.get(job_id)
+		if job is None:
+			return None
+		condition = self._get_condition()
+		try:
+			async with condition:
+				await asyncio.wait_for(
+					condition.wait_for(lambda: job.version > since_version or job.done),
+					timeout=timeout_sec,
+				)
+		except asyncio.TimeoutError:
+			pass
+		return job
+
+	async def wait_until_done(self, job_id: str, timeout_sec: Optional[float] = None) -> Optional[TrackedJob]:
+		job = self._jobs.get(job_id)
+		if job is None:
+			return None
+		condition = self._get_condition()
+		try:
+			async with condition:
+				await asyncio.wait_for(condition.wait_for(lambda: job.done), timeout=timeout_sec)
+		except asyncio.TimeoutError:
+			pass
+		return job
+
+	async def subscribe(self, job_id: str, heartbeat_sec: float = 15.0) -> AsyncIterator[Optional[TrackedJob]]:
+		"""상태가 바뀔 때마다 작업을 내보내고, 변화가 없으면 heartbeat_sec마다 None을 내보냄 (SSE용)."""
+		job = self._jobs.get(job_id)
+		if job is None:
+			return
+		version = -1
+		while True:
+			if job.version != version:
+				version = job.version
+				yield job
+				if job.done:
+					return
+			else:
+				yield None
+			await self.wait_for_change(job_id, version, heartbeat_sec)
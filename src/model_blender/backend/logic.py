@@ -1,6 +1,8 @@
 import os
 from collections import OrderedDict
 from pathlib import Path
+from typing import List
+
 import torch
 
 
@@ -40,78 +42,123 @@ def _get_sr_value(ckpt) -> str:
     return "48000"
 
 
-def blend_voices(name: str, path1: str, path2: str, ratio: float):
-    """두 개의 RVC .pth를 선형 보간으로 블렌딩.
-    - 한글 주석: Applio rvc/train/process/model_blender.py 로직을 반영
+def _load_checkpoint(path: str):
+    """체크포인트를 메모리 맵으로 로드.
+    - 한글 주석: 텐서는 실제로 읽힐 때만 페이지 단위로 올라오므로 여러 모델을 열어도 메모리를 거의 쓰지 않음
+    - 구형(zip이 아닌) 포맷은 mmap을 지원하지 않으므로 일반 로드로 폴백
     """
     try:
-        message = f"Model {path1} and {path2} are merged with alpha {ratio}."
-        ckpt1 = torch.load(path1, map_location="cpu", weights_only=True)
-        ckpt2 = torch.load(path2, map_location="cpu", weights_only=True)
-
-        sr1 = _get_sr_value(ckpt1)
-        sr2 = _get_sr_value(ckpt2)
-        if sr1 != sr2:
-            return f"샘플레이트 불일치: {sr1} vs {sr2}. 동일해야 블렌딩 가능합니다.", None
-
-        cfg = ckpt1.get("config", {})
-        cfg_f0 = ckpt1.get("f0", True)
-        cfg_version = ckpt1.get("version", "v2")
-        cfg_sr = sr1
-        vocoder = ckpt1.get("vocoder", "HiFi-GAN")
-
-        # 가중치 사전으로 정규화
-        if "model" in ckpt1:
-            ckpt1 = _extract(ckpt1)
-        if isinstance(ckpt1, dict) and "weight" in ckpt1:
-            ckpt1 = ckpt1["weight"]
-        if "model" in ckpt2:
-            ckpt2 = _extract(ckpt2)
-        if isinstance(ckpt2, dict) and "weight" in ckpt2:
-            ckpt2 = ckpt2["weight"]
-
-        if sorted(list(ckpt1.keys())) != sorted(list(ckpt2.keys())):
-            k1, k2 = set(ckpt1.keys()), set(ckpt2.keys())
-            only1 = list(k1 - k2)[:5]
-            only2 = list(k2 - k1)[:5]
-            return (
-                "Fail to merge the models. The model architectures are not the same.\n"
-                f"diff-only-in-A: {only1} (…){' ' if only1 else ''}"
-                f"diff-only-in-B: {only2} (…)",
-                None,
-            )
+        return torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    except (RuntimeError, TypeError):
+        return torch.load(path, map_location="cpu", weights_only=True)
+
+
+def _get_weights(ckpt):
+    """체크포인트를 가중치 사전으로 정규화."""
+    if "model" in ckpt:
+        ckpt = _extract(ckpt)
+    if isinstance(ckpt, dict) and "weight" in ckpt:
+        ckpt = ckpt["weight"]
+    return ckpt
+
+
+def _save_once(obj, out_path: Path, link_paths):
+    """결과를 한 번만 저장하고, 추가 위치에는 하드 링크를 만든다 (불가능하면 복사)."""
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, out_path)
+    for dst_path in link_paths:
+        try:
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            if dst_path.resolve() == out_path.resolve():
+                continue
+            if dst_path.exists():
+                dst_path.unlink()
+            try:
+                os.link(out_path, dst_path)
+            except OSError:
+                import shutil
+                shutil.copyfile(out_path, dst_path)
+        except Exception:
+            # 복사 실패는 치명적이지 않으므로 무시 (서버 경로에 있는 파일은 유지)
+            pass
+
+
+def blend_voice_models(name: str, paths: List[str], weights: List[float], copy_to_downloads: bool = True):
+    """N개의 RVC .pth를 가중 평균으로 한 번에 블렌딩.
+    - 한글 주석: 입력은 메모리 맵으로 열고, 텐서 하나씩 float32 누산기에 더한 뒤 바로 half로 변환
+    - 한글 주석: 최대 메모리는 결과 모델(half) 하나 + 가장 큰 텐서 하나(float32) 정도
+    - weights는 합이 1이 되도록 정규화
+    """
+    try:
+        if len(paths) < 2 or len(paths) != len(weights):
+            return "블렌딩하려면 2개 이상의 모델과 같은 수의 가중치가 필요합니다.", None
+        total_weight = float(sum(weights))
+        if total_weight == 0.0:
+            return "가중치의 합이 0입니다.", None
+        weights = [float(w) / total_weight for w in weights]
+        message = "Models " + ", ".join(paths) + " are merged with weights " \
+                  + ", ".join(f"{w:.4f}" for w in weights) + "."
+
+        ckpts = [_load_checkpoint(p) for p in paths]
+        srs = [_get_sr_value(c) for c in ckpts]
+        if len(set(srs)) != 1:
+            return f"샘플레이트 불일치: {' vs '.join(srs)}. 동일해야 블렌딩 가능합니다.", None
+
+        first = ckpts[0]
+        cfg = first.get("config", {})
+        cfg_f0 = first.get("f0", True)
+        cfg_version = first.get("version", "v2")
+        cfg_sr = srs[0]
+        vocoder = first.get("vocoder", "HiFi-GAN")
+
+        model_weights = [_get_weights(c) for c in ckpts]
+        keys = list(model_weights[0].keys())
+        for i, mw in enumerate(model_weights[1:], start=1):
+            if sorted(keys) != sorted(mw.keys()):
+                k1, k2 = set(keys), set(mw.keys())
+                only1 = list(k1 - k2)[:5]
+                only2 = list(k2 - k1)[:5]
+                return (
+                    "Fail to merge the models. The model architectures are not the same.\n"
+                    f"diff-only-in-model-0: {only1} (…){' ' if only1 else ''}"
+                    f"diff-only-in-model-{i}: {only2} (…)",
+                    None,
+                )
 
-        # 추가: 공통 키의 shape가 다른 경우 안내
         shape_mismatch = []
-        for key in set(ckpt1.keys()) & set(ckpt2.keys()):
-            try:
-                if hasattr(ckpt1[key], "shape") and hasattr(ckpt2[key], "shape"):
-                    if tuple(ckpt1[key].shape) != tuple(ckpt2[key].shape) and key != "emb_g.weight":
-                        shape_mismatch.append((key, tuple(ckpt1[key].shape), tuple(ckpt2[key].shape)))
-            except Exception:
-                pass
+        for key in keys:
+            shapes = [tuple(mw[key].shape) for mw in model_weights if hasattr(mw[key], "shape")]
+            if len(set(shapes)) > 1 and key != "emb_g.weight":
+                shape_mismatch.append((key, shapes))
         if shape_mismatch:
             sample = shape_mismatch[:5]
             return (
                 "Fail to merge the models. Tensor shapes differ.\n"
-                + "\n".join([f"{k}: {s1} vs {s2}" for k, s1, s2 in sample])
+                + "\n".join([f"{k}: {' vs '.join(str(s) for s in shapes)}" for k, shapes in sample])
                 + ("\n…" if len(shape_mismatch) > 5 else ""),
                 None,
             )
 
         opt = OrderedDict()
         opt["weight"] = {}
-        for key in ckpt1.keys():
-            if key == "emb_g.weight" and ckpt1[key].shape != ckpt2[key].shape:
-                min_shape0 = min(ckpt1[key].shape[0], ckpt2[key].shape[0])
-                opt["weight"][key] = (
-                    ratio * (ckpt1[key][:min_shape0].float())
-                    + (1 - ratio) * (ckpt2[key][:min_shape0].float())
-                ).half()
-            else:
-                opt["weight"][key] = (
-                    ratio * (ckpt1[key].float()) + (1 - ratio) * (ckpt2[key].float())
-                ).half()
+        with torch.no_grad():
+            for key in keys:
+                tensors = [mw[key] for mw in model_weights]
+                if key == "emb_g.weight":
+                    # 화자 수가 다르면 공통 화자까지만 블렌딩
+                    min_shape0 = min(t.shape[0] for t in tensors)
+                    tensors = [t[:min_shape0] for t in tensors]
+                if len(tensors) == 2:
+                    # 입력(mmap) 텐서를 건드리지 않도록 항상 새 float32 텐서를 만든다
+                    acc = tensors[1].to(torch.float32, copy=True)
+                    acc.lerp_(tensors[0].to(acc.dtype), weights[0])
+                else:
+                    acc = tensors[0].to(torch.float32, copy=True).mul_(weights[0])
+                    for t, w in zip(tensors[1:], weights[1:]):
+                        acc.add_(t, alpha=w)
+                opt["weight"][key] = acc.half()
+                del acc
 
         opt["config"] = cfg
         opt["sr"] = cfg_sr
@@ -123,22 +170,17 @@ def blend_voices(name: str, path1: str, path2: str, ratio: float):
         logs_dir = Path("logs")
         logs_dir.mkdir(parents=True, exist_ok=True)
         out_path = logs_dir / f"{name}.pth"
-        torch.save(opt, out_path)
-
-        # 한글 주석: 사용자 로컬 다운로드 폴더에도 복사 저장 (macOS/일반 환경)
-        try:
-            downloads_dir = Path.home() / "Downloads"
-            downloads_dir.mkdir(parents=True, exist_ok=True)
-            dst_path = downloads_dir / f"{name}.pth"
-            if str(dst_path) != str(out_path):
-                import shutil
-                shutil.copyfile(out_path, dst_path)
-        except Exception:
-            # 복사 실패는 치명적이지 않으므로 무시 (서버 경로에 있는 파일은 유지)
-            pass
+        # 한글 주석: 사용자 로컬 다운로드 폴더에는 다시 쓰지 않고 링크를 만든다 (macOS/일반 환경)
+        link_paths = [Path.home() / "Downloads" / f"{name}.pth"] if copy_to_downloads else []
+        _save_once(opt, out_path, link_paths)
 
         return message, str(out_path)
     except Exception as error:
         return f"An error occurred blending the models: {error}", None
 
 
+def blend_voices(name: str, path1: str, path2: str, ratio: float):
+    """두 개의 RVC .pth를 선형 보간으로 블렌딩.
+    - 한글 주석: Applio rvc/train/process/model_blender.py 로직을 반영
+    """
+    return blend_voice_models(name, [path1, path2], [ratio, 1.0 - ratio])
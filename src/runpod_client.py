@@ -40,11 +40,16 @@ def submit_training_job(endpoint_id: str, s3_input_prefix: str, s3_output_prefix
 	return res["id"]
 
 
+def get_job_status(endpoint_id: str, job_id: str) -> Dict[str, Any]:
+	"""작업 상태를 한 번 조회. 반환: Runpod 응답(dict, status/output 포함)"""
+	return runpod.endpoint.get_job(endpoint_id=endpoint_id, job_id=job_id) or {}
+
+
 def poll_job(endpoint_id: str, job_id: str, timeout_sec: int = 7200, poll_sec: int = 10) -> RunpodJobResult:
-	"""작업 완료까지 상태를 폴링하여 결과를 반환."""
+	"""작업 완료까지 상태를 폴링하여 결과를 반환 (블로킹, 스크립트용. API 서버는 JobRegistry 사용)."""
 	end = time.time() + timeout_sec
 	while time.time() < end:
-		info = runpod.endpoint.get_job(endpoint_id=endpoint_id, job_id=job_id)
+		info = get_job_status(endpoint_id, job_id)
 		status = (info or {}).get("status", "UNKNOWN")
 		if status in {"COMPLETED", "FAILED", "CANCELLED"}:
 			output = (info or {}).get("output")
@@ -3,7 +3,7 @@ from __future__ import annotations
 import os
 import time
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import boto3
 from botocore.client import Config
@@ -71,6 +71,34 @@ def list_objects(prefix: str) -> List[str]:
 	return keys
 
 
+def list_keys_with_prefix(prefix: str) -> List[str]:
+	"""키가 prefix로 시작하는 객체 키들을 반환 (list_objects와 달리 디렉터리 슬래시를 붙이지 않음)."""
+	return [obj.key for obj in _bucket.objects.filter(Prefix=prefix) if not obj.key.endswith("/")]
+
+
+def delete_keys(keys: Iterable[str]) -> List[str]:
+	"""지정 키들을 삭제하고 삭제한 키 목록을 반환 (요청당 최대 1000개)."""
+	keys = list(keys)
+	for start in range(0, len(keys), 1000):
+		batch = keys[start:start + 1000]
+		_client.delete_objects(
+			Bucket=_settings.s3_bucket,
+			Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+		)
+	return keys
+
+
+def list_object_summaries(prefix: str) -> List[Tuple[str, str, int, str]]:
+	"""지정 프리픽스 하위 객체의 (키, ETag, 크기, 마지막 수정 시각)을 한 번의 리스팅으로 반환."""
+	prefix = ensure_trailing_slash(prefix)
+	summaries: List[Tuple[str, str, int, str]] = []
+	for obj in _bucket.objects.filter(Prefix=prefix):
+		if obj.key.endswith("/"):
+			continue
+		summaries.append((obj.key, obj.e_tag, obj.size, obj.last_modified.isoformat()))
+	return summaries
+
+
 def wait_for_artifacts(prefix: str, exts: Iterable[str], timeout_sec: int = 7200, poll_sec: int = 15) -> List[str]:
 	"""
 	특정 프리픽스에서 주어진 확장자 파일(.pth, .index 등)이 생성될 때까지 대기.
@@ -113,6 +141,16 @@ def download_object_to_path(key: str, dst_path: str | Path) -> Path:
 	return dst
 
 
+def iter_object_chunks(key: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+	"""단일 S3 객체를 chunk_size 바이트씩 나누어 순서대로 반환 (디스크를 거치지 않음)."""
+	body = _client.get_object(Bucket=_settings.s3_bucket, Key=key)["Body"]
+	try:
+		for chunk in body.iter_chunks(chunk_size=chunk_size):
+			yield chunk
+	finally:
+		body.close()
+
+
 def object_exists(key: str) -> bool:
 	try:
 		_client.head_object(Bucket=_settings.s3_bucket, Key=key)
@@ -6,11 +6,20 @@ import math
 import numpy as np
 import os
 import glob
+import weakref
 from PIL import Image
 import json
 from collections import defaultdict, OrderedDict
 import cv2
 
+try:
+    from tha4.app.factorized_patches import FactorizedPatchSet
+    from tha4.app.patch_dedup import ALIAS_FILE_NAME, load_alias_paths
+except ImportError:
+    # 스크립트로 직접 실행될 때는 같은 폴더의 모듈 사용
+    from factorized_patches import FactorizedPatchSet
+    from patch_dedup import ALIAS_FILE_NAME, load_alias_paths
+
 
 class iFacialMocapReceiver:
     """iFacialMocap UDP 데이터 수신 클래스"""
@@ -150,6 +159,10 @@ class UnifiedImageManager:
         self.image_cache = OrderedDict()
         self.image_paths = {}
         self.max_cache_size = max_cache_size
+        # 분해 패치 세트 (기본 프레임 + 눈/입 영역 크롭을 실시간 합성)
+        self.factorized_set = None
+        # 별칭 표로 같은 파일을 가리키는 키들이 디코딩한 이미지를 공유하도록 경로별로 보관
+        self.decoded_images = weakref.WeakValueDictionary()
         
         self.fallback_search_enabled = True
         self.sensitivity = 0.5
@@ -182,9 +195,19 @@ class UnifiedImageManager:
                     image_dir = alt_dir
                     break
             else:
+                if self._index_factorized_patches():
+                    return
                 print(f"Images directory not found: {image_dir}")
                 return
         
+        # 중복 제거된 라이브러리(patch_dedup.py)는 PNG를 glob/파싱하지 않고 별칭 표만 읽음
+        if os.path.isfile(os.path.join(image_dir, ALIAS_FILE_NAME)):
+            self.image_paths = load_alias_paths(image_dir)
+            elapsed = time.time() - start_time
+            num_images = len(set(self.image_paths.values()))
+            print(f"Indexed {len(self.image_paths)} aliased keys ({num_images} unique images) in {elapsed:.2f}s")
+            return
+        
         patterns = ["eye_face_*.png", "opt_*.png"]
         
         files = []
@@ -215,6 +238,23 @@ class UnifiedImageManager:
         print(f"Indexed {indexed_count} images in {elapsed:.2f}s")
         print(f"Enhanced eye recognition system ready!")
         
+    def _index_factorized_patches(self):
+        """전체 조합 이미지가 없으면 분해 패치 세트(manifest.json)를 찾아 모든 조합 키를 등록"""
+        factorized_dirs = [
+            os.path.join(self.images_base_dir, "eye_face_factorized_patches"),
+            os.path.join(self.images_base_dir, "combined_parameters_factorized_patches"),
+        ]
+        for factorized_dir in factorized_dirs:
+            if FactorizedPatchSet.exists(factorized_dir):
+                start_time = time.time()
+                self.factorized_set = FactorizedPatchSet(factorized_dir)
+                for param_key in self.factorized_set.keys():
+                    self.image_paths[param_key] = None
+                elapsed = time.time() - start_time
+                print(f"Indexed {len(self.image_paths)} factorized combinations from {factorized_dir} in {elapsed:.2f}s")
+                return True
+        return False
+
     def _parse_filename(self, filename):
         if filename.startswith('eye_face_'):
             name_part = filename.replace('eye_face_', '').replace('.png', '')
@@ -542,7 +582,15 @@ class UnifiedImageManager:
         
         if param_key in self.image_paths:
             try:
-                img = Image.open(self.image_paths[param_key]).convert('RGBA')
+                if self.image_paths[param_key] is None:
+                    img = self.factorized_set.composite(param_key)
+                else:
+                    img = self.decoded_images.get(self.image_paths[param_key])
+                    if img is None:
+                        img = Image.open(self.image_paths[param_key]).convert('RGBA')
+                        self.decoded_images[self.image_paths[param_key]] = img
+                if img is None:
+                    return None
                 
                 self.image_cache[param_key] = img
                 self.image_cache.move_to_end(param_key)
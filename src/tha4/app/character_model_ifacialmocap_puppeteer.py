@@ -1,23 +1,28 @@
+import argparse
 import os
 import socket
 import sys
 import threading
 import time
-from typing import Optional
+from typing import Optional, List
 
 import PIL.Image
 
 from tha4.shion.base.image_util import torch_linear_to_srgb
-from tha4.image_util import convert_linear_to_srgb
+from tha4.image_postprocessor import DisplayImagePostprocessor
 from tha4.mocap.ifacialmocap_pose_converter_25 import create_ifacialmocap_pose_converter
+from tha4.mocap.pose_filter import create_pose_filter
 from tha4.app.full_manual_poser import resize_PIL_image
 from tha4.charmodel.character_model import CharacterModel
+from tha4.poser.pose_render_cache import PoseRenderCache
+from tha4.poser.render_quality import RENDER_QUALITIES, RENDER_QUALITY_FULL
 
 sys.path.append(os.getcwd())
 
 from tha4.mocap.ifacialmocap_pose import create_default_ifacialmocap_pose
 from tha4.mocap.ifacialmocap_v2 import IFACIALMOCAP_PORT, IFACIALMOCAP_START_STRING, parse_ifacialmocap_v2_pose
 
+import numpy
 import torch
 import wx
 
@@ -44,20 +49,37 @@ class FpsStatistics:
 
 class MainFrame(wx.Frame):
     IMAGE_SIZE = 512
-
-    def __init__(self, pose_converter: IFacialMocapPoseConverter, device: torch.device):
+    TARGET_FRAME_TIME = 1.0 / 30.0
+    # Indexed by the selection of output_background_choice.
+    BACKGROUND_COLORS = [
+        None,
+        (0.0, 1.0, 0.0),
+        (0.0, 0.0, 1.0),
+        (0.0, 0.0, 0.0),
+        (1.0, 1.0, 1.0),
+    ]
+
+    def __init__(self,
+                 pose_converter: IFacialMocapPoseConverter,
+                 device: torch.device,
+                 incremental_rendering: bool = False):
         super().__init__(None, wx.ID_ANY, "iFacialMocap Puppeteer (Fuji)")
         self.poser = None
         self.pose_converter = pose_converter
         self.device = device
+        self.incremental_rendering = incremental_rendering
 
         self.ifacialmocap_pose = create_default_ifacialmocap_pose()
+        self.ifacialmocap_pose_time = time.perf_counter()
+        self.pose_filter = create_pose_filter()
         self.source_image_bitmap = wx.Bitmap(MainFrame.IMAGE_SIZE, MainFrame.IMAGE_SIZE)
         self.result_image_bitmap = wx.Bitmap(MainFrame.IMAGE_SIZE, MainFrame.IMAGE_SIZE)
         self.wx_source_image = None
         self.torch_source_image = None
         self.last_pose = None
         self.fps_statistics = FpsStatistics()
+        self.pose_render_cache = None
+        self.postprocessor = None
         self.last_update_time = None
 
         self.create_receiving_socket()
@@ -118,6 +140,7 @@ class MainFrame(wx.Frame):
         if socket_bytes is not None:
             socket_string = socket_bytes.decode("utf-8")
             self.ifacialmocap_pose = parse_ifacialmocap_v2_pose(socket_string)
+            self.ifacialmocap_pose_time = time.perf_counter()
         return self.ifacialmocap_pose
 
     def on_erase_background(self, event: wx.Event):
@@ -188,9 +211,26 @@ class MainFrame(wx.Frame):
             separator = wx.StaticLine(self.animation_left_panel, -1, size=(256, 5))
             self.animation_left_panel_sizer.Add(separator, 0, wx.EXPAND)
 
+            render_quality_text = wx.StaticText(self.animation_left_panel, label="--- Render Quality ---",
+                                                style=wx.ALIGN_CENTER)
+            self.animation_left_panel_sizer.Add(render_quality_text, 0, wx.EXPAND)
+
+            self.render_quality_choice = wx.Choice(
+                self.animation_left_panel,
+                choices=["AUTO"] + [quality.name.upper() for quality in RENDER_QUALITIES])
+            self.render_quality_choice.SetSelection(1 + RENDER_QUALITIES.index(RENDER_QUALITY_FULL))
+            self.animation_left_panel_sizer.Add(self.render_quality_choice, 0, wx.EXPAND)
+            self.render_quality_choice.Bind(wx.EVT_CHOICE, self.on_render_quality_changed)
+
+            separator = wx.StaticLine(self.animation_left_panel, -1, size=(256, 5))
+            self.animation_left_panel_sizer.Add(separator, 0, wx.EXPAND)
+
             self.fps_text = wx.StaticText(self.animation_left_panel, label="")
             self.animation_left_panel_sizer.Add(self.fps_text, wx.SizerFlags().Border())
 
+            self.cache_stats_text = wx.StaticText(self.animation_left_panel, label="")
+            self.animation_left_panel_sizer.Add(self.cache_stats_text, wx.SizerFlags().Border())
+
             self.animation_left_panel_sizer.Fit(self.animation_left_panel)
 
         self.animation_panel_sizer.Fit(self.animation_panel)
@@ -308,6 +348,9 @@ class MainFrame(wx.Frame):
     def update_result_image_bitmap(self, event: Optional[wx.Event] = None):
         ifacialmocap_pose = self.read_ifacialmocap_pose()
         current_pose = self.pose_converter.convert(ifacialmocap_pose)
+        # The tracked channels are filtered once per received packet and extrapolated in between. Breathing and panel
+        # changes between packets come through on every tick.
+        current_pose = self.pose_filter.update(current_pose, self.ifacialmocap_pose_time, time.perf_counter())
         if self.last_pose is not None and self.last_pose == current_pose:
             return
         self.last_pose = current_pose
@@ -319,36 +362,16 @@ class MainFrame(wx.Frame):
             del dc
             return
 
-        pose = torch.tensor(current_pose, device=self.device, dtype=self.poser.get_dtype())
-
-        with torch.no_grad():
-            output_image = self.poser.pose(self.torch_source_image, pose)[0].float()
-            output_image = torch.clip((output_image + 1.0) / 2.0, 0.0, 1.0)
-            output_image = convert_linear_to_srgb(output_image)
-
-            background_choice = self.output_background_choice.GetSelection()
-            if background_choice == 0:
-                pass
-            else:
-                background = torch.zeros(4, output_image.shape[1], output_image.shape[2], device=self.device)
-                background[3, :, :] = 1.0
-                if background_choice == 1:
-                    background[1, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-                elif background_choice == 2:
-                    background[2, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-                elif background_choice == 3:
-                    output_image = self.blend_with_background(output_image, background)
-                else:
-                    background[0:3, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-
-            c, h, w = output_image.shape
-            output_image = 255.0 * torch.transpose(output_image.reshape(c, h * w), 0, 1).reshape(h, w, c)
-            output_image = output_image.byte()
-
-        numpy_image = output_image.detach().cpu().numpy()
+        background_choice = self.output_background_choice.GetSelection()
+        numpy_image = self.pose_render_cache.get_or_render(
+            current_pose,
+            lambda pose: self.render_numpy_image(pose, background_choice),
+            extra_key=(background_choice, self.poser.get_render_quality().name))
+        stats_string = self.pose_render_cache.get_stats_string()
+        incremental_rendering_stats = self.character_model.get_incremental_rendering_stats()
+        if incremental_rendering_stats is not None:
+            stats_string += "\n" + incremental_rendering_stats.get_stats_string()
+        self.cache_stats_text.SetLabelText(stats_string)
         wx_image = wx.ImageFromBuffer(numpy_image.shape[0],
                                       numpy_image.shape[1],
                                       numpy_image[:, :, 0:3].tobytes(),
@@ -374,11 +397,27 @@ class MainFrame(wx.Frame):
 
         self.Refresh()
 
-    def blend_with_background(self, numpy_image, background):
-        alpha = numpy_image[3:4, :, :]
-        color = numpy_image[0:3, :, :]
-        new_color = color * alpha + (1.0 - alpha) * background[0:3, :, :]
-        return torch.cat([new_color, background[3:4, :, :]], dim=0)
+    def render_numpy_image(self, current_pose: List[float], background_choice: int) -> numpy.ndarray:
+        pose = torch.tensor(current_pose, device=self.device, dtype=self.poser.get_dtype())
+
+        with torch.no_grad():
+            output_image = self.poser.pose(self.torch_source_image, pose)[0]
+
+        # The postprocessor reuses its output buffer, and the cache keeps the frame, so it has to be copied.
+        return self.postprocessor.process(output_image, MainFrame.BACKGROUND_COLORS[background_choice]).copy()
+
+    def on_render_quality_changed(self, event: wx.Event):
+        self.apply_render_quality()
+        self.last_pose = None
+
+    def apply_render_quality(self):
+        if self.poser is None:
+            return
+        selection = self.render_quality_choice.GetSelection()
+        if selection == 0:
+            self.poser.set_target_frame_time(MainFrame.TARGET_FRAME_TIME)
+        else:
+            self.poser.set_render_quality(RENDER_QUALITIES[selection - 1])
 
     def load_model(self, event: wx.Event):
         dir_name = "data/character_models"
@@ -394,7 +433,11 @@ class MainFrame(wx.Frame):
                 w, h = pil_image.size
                 self.wx_source_image = wx.Bitmap.FromBufferRGBA(w, h, pil_image.convert("RGBA").tobytes())
                 self.update_source_image_bitmap()
-                self.poser = self.character_model.get_poser(self.device)
+                self.poser = self.character_model.get_poser(
+                    self.device, incremental_rendering=self.incremental_rendering)
+                self.pose_render_cache = PoseRenderCache(self.poser.get_pose_parameter_groups())
+                self.postprocessor = DisplayImagePostprocessor(self.device)
+                self.apply_render_quality()
             except Exception:
                 message_dialog = wx.MessageDialog(
                     self, "Could not load character model " + character_model_json_file_name, "Poser", wx.OK)
@@ -405,12 +448,17 @@ class MainFrame(wx.Frame):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Puppeteer a character model with iFacialMocap.')
+    parser.add_argument("--incremental_rendering", action="store_true",
+                        help="Rerun only the face morpher when the pose changes mostly in the face.")
+    args = parser.parse_args()
+
     device = torch.device('cuda:0')
 
     pose_converter = create_ifacialmocap_pose_converter()
 
     app = wx.App()
-    main_frame = MainFrame(pose_converter, device)
+    main_frame = MainFrame(pose_converter, device, args.incremental_rendering)
     main_frame.Show(True)
     main_frame.capture_timer.Start(10)
     main_frame.animation_timer.Start(10)
@@ -5,6 +5,7 @@ import time
 from typing import List
 
 from tha4.charmodel.character_model import CharacterModel
+from tha4.image_postprocessor import DisplayImagePostprocessor
 from tha4.image_util import resize_PIL_image, convert_output_image_from_torch_to_numpy
 from tha4.poser.modes.mode_14 import get_pose_parameters
 
@@ -143,6 +144,7 @@ class MainFrame(wx.Frame):
         super().__init__(None, wx.ID_ANY, "Poser")
         self.poser = None
         self.device = device
+        self.postprocessor = DisplayImagePostprocessor(device)
 
         self.wx_source_image = None
         self.torch_source_image = None
@@ -272,6 +274,13 @@ class MainFrame(wx.Frame):
         right_panel_sizer.Add(self.save_image_button, 1, wx.EXPAND)
         self.save_image_button.Bind(wx.EVT_BUTTON, self.on_save_image)
 
+        self.latency_text = wx.StaticText(self.right_panel, label="")
+        right_panel_sizer.Add(self.latency_text, 0, wx.EXPAND)
+
+        self.save_latency_trace_button = wx.Button(self.right_panel, wx.ID_ANY, "Save Latency Trace")
+        right_panel_sizer.Add(self.save_latency_trace_button, 0, wx.EXPAND)
+        self.save_latency_trace_button.Bind(wx.EVT_BUTTON, self.on_save_latency_trace)
+
         right_panel_sizer.Fit(self.right_panel)
         self.main_sizer.Add(self.right_panel, 0, wx.FIXED_MINSIZE)
 
@@ -299,6 +308,7 @@ class MainFrame(wx.Frame):
                 w, h = pil_image.size
                 self.wx_source_image = wx.Bitmap.FromBufferRGBA(w, h, pil_image.convert("RGBA").tobytes())
                 self.poser = self.character_model.get_poser(self.device)
+                self.poser.enable_latency_profiling()
                 self.source_image_dirty = True
                 self.Refresh()
                 self.Update()
@@ -363,20 +373,17 @@ class MainFrame(wx.Frame):
         pose = torch.tensor(current_pose, device=self.device)
         output_index = self.output_index_choice.GetSelection()
         with torch.no_grad():
-            start_cuda_event = torch.cuda.Event(enable_timing=True)
-            end_cuda_event = torch.cuda.Event(enable_timing=True)
-            start_cuda_event.record()
-            start_time = time.time()
-
-            output_image = self.poser.pose(self.torch_source_image, pose, output_index)[0].detach().cpu()
-
-            end_time = time.time()
-            end_cuda_event.record()
-            torch.cuda.synchronize()
-            print("cuda time (ms):", start_cuda_event.elapsed_time(end_cuda_event))
-            print("elapsed time (ms):", (end_time - start_time) * 1000.0)
+            output_image = self.poser.pose(self.torch_source_image, pose, output_index)[0].detach()
 
-        numpy_image = convert_output_image_from_torch_to_numpy(output_image)
+        start_time = time.perf_counter()
+        if output_image.shape[0] == 4:
+            numpy_image = self.postprocessor.process(output_image)
+        else:
+            numpy_image = convert_output_image_from_torch_to_numpy(output_image.cpu())
+        profiler = self.poser.get_latency_profiler()
+        if profiler is not None:
+            profiler.add("postprocess", start_time, time.perf_counter() - start_time)
+            self.latency_text.SetLabelText(profiler.get_summary_string())
         self.last_output_numpy_image = numpy_image
         wx_image = wx.ImageFromBuffer(
             numpy_image.shape[0],
@@ -422,6 +429,23 @@ class MainFrame(wx.Frame):
                 message_dialog.Destroy()
         file_dialog.Destroy()
 
+    def on_save_latency_trace(self, event: wx.Event):
+        if self.poser is None or self.poser.get_latency_profiler() is None:
+            logging.info("There is no latency data to save!!!")
+            return
+
+        dir_name = "data/traces"
+        file_dialog = wx.FileDialog(self, "Choose a trace file", dir_name, "", "*.json", wx.FD_SAVE)
+        if file_dialog.ShowModal() == wx.ID_OK:
+            trace_file_name = os.path.join(file_dialog.GetDirectory(), file_dialog.GetFilename())
+            try:
+                self.poser.get_latency_profiler().save_chrome_trace(trace_file_name)
+            except:
+                message_dialog = wx.MessageDialog(self, f"Could not save {trace_file_name}", "Manual Poser", wx.OK)
+                message_dialog.ShowModal()
+                message_dialog.Destroy()
+        file_dialog.Destroy()
+
     def save_last_numpy_image(self, image_file_name):
         numpy_image = self.last_output_numpy_image
         pil_image = PIL.Image.fromarray(numpy_image, mode='RGBA')
@@ -1,23 +1,29 @@
+import argparse
 import os
 import sys
 import threading
 import time
-from typing import Optional
+from typing import Optional, List
 import PIL.Image
 
 import cv2
 import mediapipe
-from scipy.spatial.transform import Rotation
 
 from tha4.shion.base.image_util import resize_PIL_image
 from tha4.charmodel.character_model import CharacterModel
-from tha4.image_util import convert_linear_to_srgb
+from tha4.poser.pose_render_cache import PoseRenderCache
+from tha4.poser.render_quality import RENDER_QUALITIES, RENDER_QUALITY_FULL
+from tha4.image_postprocessor import DisplayImagePostprocessor
 from tha4.mocap.mediapipe_constants import HEAD_ROTATIONS, HEAD_X, HEAD_Y, HEAD_Z
 from tha4.mocap.mediapipe_face_pose import MediaPipeFacePose
 from tha4.mocap.mediapipe_face_pose_converter_00 import MediaPoseFacePoseConverter00
+from tha4.mocap.mediapipe_pipeline import MediaPipeCaptureDetectPipeline, CameraVideoSource, FileVideoSource, \
+    FaceDetection
+from tha4.mocap.pose_filter import create_pose_filter
 
 sys.path.append(os.getcwd())
 
+import numpy
 import torch
 import wx
 
@@ -41,17 +47,26 @@ class FpsStatistics:
 
 class MainFrame(wx.Frame):
     IMAGE_SIZE = 512
+    TARGET_FRAME_TIME = 1.0 / 30.0
+    # Indexed by the selection of output_background_choice.
+    BACKGROUND_COLORS = [
+        None,
+        (0.0, 1.0, 0.0),
+        (0.0, 0.0, 1.0),
+        (0.0, 0.0, 0.0),
+        (1.0, 1.0, 1.0),
+    ]
 
     def __init__(self,
                  pose_converter: MediaPoseFacePoseConverter00,
-                 video_capture,
-                 face_landmarker,
-                 device: torch.device):
+                 capture_detect_pipeline: MediaPipeCaptureDetectPipeline,
+                 device: torch.device,
+                 incremental_rendering: bool = False):
         super().__init__(None, wx.ID_ANY, "THA4 Character Model MediaPipe Puppeteer")
-        self.face_landmarker = face_landmarker
-        self.video_capture = video_capture
+        self.capture_detect_pipeline = capture_detect_pipeline
         self.pose_converter = pose_converter
         self.device = device
+        self.incremental_rendering = incremental_rendering
 
         self.source_image_bitmap = wx.Bitmap(MainFrame.IMAGE_SIZE, MainFrame.IMAGE_SIZE)
         self.result_image_bitmap = wx.Bitmap(MainFrame.IMAGE_SIZE, MainFrame.IMAGE_SIZE)
@@ -60,7 +75,11 @@ class MainFrame(wx.Frame):
         self.torch_source_image = None
         self.last_pose = None
         self.mediapipe_face_pose = None
+        self.mediapipe_face_pose_time = None
+        self.pose_filter = create_pose_filter()
         self.fps_statistics = FpsStatistics()
+        self.pose_render_cache = None
+        self.postprocessor = None
         self.last_update_time = None
         self.character_model = None
         self.poser = None
@@ -83,6 +102,9 @@ class MainFrame(wx.Frame):
         self.animation_timer.Stop()
         self.capture_timer.Stop()
 
+        # Stop the capture and detection threads
+        self.capture_detect_pipeline.stop()
+
         # Destroy the windows
         self.Destroy()
         event.Skip()
@@ -158,9 +180,26 @@ class MainFrame(wx.Frame):
             separator = wx.StaticLine(self.animation_left_panel, -1, size=(256, 5))
             self.animation_left_panel_sizer.Add(separator, 0, wx.EXPAND)
 
+            render_quality_text = wx.StaticText(self.animation_left_panel, label="--- Render Quality ---",
+                                                style=wx.ALIGN_CENTER)
+            self.animation_left_panel_sizer.Add(render_quality_text, 0, wx.EXPAND)
+
+            self.render_quality_choice = wx.Choice(
+                self.animation_left_panel,
+                choices=["AUTO"] + [quality.name.upper() for quality in RENDER_QUALITIES])
+            self.render_quality_choice.SetSelection(1 + RENDER_QUALITIES.index(RENDER_QUALITY_FULL))
+            self.animation_left_panel_sizer.Add(self.render_quality_choice, 0, wx.EXPAND)
+            self.render_quality_choice.Bind(wx.EVT_CHOICE, self.on_render_quality_changed)
+
+            separator = wx.StaticLine(self.animation_left_panel, -1, size=(256, 5))
+            self.animation_left_panel_sizer.Add(separator, 0, wx.EXPAND)
+
             self.fps_text = wx.StaticText(self.animation_left_panel, label="")
             self.animation_left_panel_sizer.Add(self.fps_text, wx.SizerFlags().Border())
 
+            self.cache_stats_text = wx.StaticText(self.animation_left_panel, label="")
+            self.animation_left_panel_sizer.Add(self.cache_stats_text, wx.SizerFlags().Border())
+
             self.animation_left_panel_sizer.Fit(self.animation_left_panel)
 
         self.animation_panel_sizer.Fit(self.animation_panel)
@@ -223,16 +262,16 @@ class MainFrame(wx.Frame):
         return column_panel
 
     def update_capture_panel(self, event: wx.Event):
-        there_is_frame, frame = self.video_capture.read()
-        if not there_is_frame:
+        # Capture and detection run on the pipeline's threads; this only picks up their newest results.
+        latest_frame = self.capture_detect_pipeline.latest_frame
+        if latest_frame is None:
             dc = wx.MemoryDC()
             dc.SelectObject(self.webcam_capture_bitmap)
             self.draw_nothing_yet_string(dc)
             del dc
             return
 
-        rgb_frame = cv2.flip(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), 1)
-        resized_frame = cv2.resize(rgb_frame, (256, 192))
+        resized_frame = cv2.resize(latest_frame.rgb_frame, (256, 192))
         wx_image = wx.ImageFromBuffer(256, 192, resized_frame.tobytes())
         wx_bitmap = wx_image.ConvertToBitmap()
 
@@ -244,23 +283,15 @@ class MainFrame(wx.Frame):
 
         self.webcam_capture_panel.Refresh()
 
-        time_ms = int(time.time() * 1000)
-        mediapipe_image = mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=rgb_frame)
-        detection_result = self.face_landmarker.detect_for_video(mediapipe_image, time_ms)
-        self.update_mediapipe_face_pose(detection_result)
+        detection = self.capture_detect_pipeline.poll()
+        if detection is not None:
+            self.update_mediapipe_face_pose(detection)
 
-    def update_mediapipe_face_pose(self, detection_result):
-        if len(detection_result.facial_transformation_matrixes) == 0:
+    def update_mediapipe_face_pose(self, detection: FaceDetection):
+        if detection.face_pose is None:
             return
 
-        xform_matrix = detection_result.facial_transformation_matrixes[0]
-        blendshape_params = {}
-        for item in detection_result.face_blendshapes[0]:
-            blendshape_params[item.category_name] = item.score
-        M = xform_matrix[0:3, 0:3]
-        rot = Rotation.from_matrix(M)
-        euler_angles = rot.as_euler('xyz', degrees=True)
-
+        euler_angles = detection.euler_angles
         self.rotation_value_labels[HEAD_X].SetValue("%0.2f" % euler_angles[0])
         self.rotation_value_labels[HEAD_X].Refresh()
         self.rotation_value_labels[HEAD_Y].SetValue("%0.2f" % euler_angles[1])
@@ -268,7 +299,8 @@ class MainFrame(wx.Frame):
         self.rotation_value_labels[HEAD_Z].SetValue("%0.2f" % euler_angles[2])
         self.rotation_value_labels[HEAD_Z].Refresh()
 
-        self.mediapipe_face_pose = MediaPipeFacePose(blendshape_params, xform_matrix)
+        self.mediapipe_face_pose = detection.face_pose
+        self.mediapipe_face_pose_time = detection.frame.capture_time
 
     @staticmethod
     def convert_to_100(x):
@@ -306,6 +338,9 @@ class MainFrame(wx.Frame):
             return
 
         current_pose = self.pose_converter.convert(self.mediapipe_face_pose)
+        # The tracked channels are filtered once per detection. Predicting to now makes up for the time the frame spent
+        # in capture and detection. Breathing and panel changes between detections come through on every tick.
+        current_pose = self.pose_filter.update(current_pose, self.mediapipe_face_pose_time, time.perf_counter())
         if self.last_pose is not None and self.last_pose == current_pose:
             return
         self.last_pose = current_pose
@@ -317,36 +352,16 @@ class MainFrame(wx.Frame):
             del dc
             return
 
-        pose = torch.tensor(current_pose, device=self.device, dtype=self.poser.get_dtype())
-
-        with torch.no_grad():
-            output_image = self.poser.pose(self.torch_source_image, pose)[0].float()
-            output_image = torch.clip((output_image + 1.0) / 2.0, 0.0, 1.0)
-            output_image = convert_linear_to_srgb(output_image)
-
-            background_choice = self.output_background_choice.GetSelection()
-            if background_choice == 0:
-                pass
-            else:
-                background = torch.zeros(4, output_image.shape[1], output_image.shape[2], device=self.device)
-                background[3, :, :] = 1.0
-                if background_choice == 1:
-                    background[1, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-                elif background_choice == 2:
-                    background[2, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-                elif background_choice == 3:
-                    output_image = self.blend_with_background(output_image, background)
-                else:
-                    background[0:3, :, :] = 1.0
-                    output_image = self.blend_with_background(output_image, background)
-
-            c, h, w = output_image.shape
-            output_image = 255.0 * torch.transpose(output_image.reshape(c, h * w), 0, 1).reshape(h, w, c)
-            output_image = output_image.byte()
-
-        numpy_image = output_image.detach().cpu().numpy()
+        background_choice = self.output_background_choice.GetSelection()
+        numpy_image = self.pose_render_cache.get_or_render(
+            current_pose,
+            lambda pose: self.render_numpy_image(pose, background_choice),
+            extra_key=(background_choice, self.poser.get_render_quality().name))
+        stats_string = self.pose_render_cache.get_stats_string()
+        incremental_rendering_stats = self.character_model.get_incremental_rendering_stats()
+        if incremental_rendering_stats is not None:
+            stats_string += "\n" + incremental_rendering_stats.get_stats_string()
+        self.cache_stats_text.SetLabelText(stats_string)
         wx_image = wx.ImageFromBuffer(numpy_image.shape[0],
                                       numpy_image.shape[1],
                                       numpy_image[:, :, 0:3].tobytes(),
@@ -372,11 +387,27 @@ class MainFrame(wx.Frame):
 
         self.Refresh()
 
-    def blend_with_background(self, numpy_image, background):
-        alpha = numpy_image[3:4, :, :]
-        color = numpy_image[0:3, :, :]
-        new_color = color * alpha + (1.0 - alpha) * background[0:3, :, :]
-        return torch.cat([new_color, background[3:4, :, :]], dim=0)
+    def render_numpy_image(self, current_pose: List[float], background_choice: int) -> numpy.ndarray:
+        pose = torch.tensor(current_pose, device=self.device, dtype=self.poser.get_dtype())
+
+        with torch.no_grad():
+            output_image = self.poser.pose(self.torch_source_image, pose)[0]
+
+        # The postprocessor reuses its output buffer, and the cache keeps the frame, so it has to be copied.
+        return self.postprocessor.process(output_image, MainFrame.BACKGROUND_COLORS[background_choice]).copy()
+
+    def on_render_quality_changed(self, event: wx.Event):
+        self.apply_render_quality()
+        self.last_pose = None
+
+    def apply_render_quality(self):
+        if self.poser is None:
+            return
+        selection = self.render_quality_choice.GetSelection()
+        if selection == 0:
+            self.poser.set_target_frame_time(MainFrame.TARGET_FRAME_TIME)
+        else:
+            self.poser.set_render_quality(RENDER_QUALITIES[selection - 1])
 
     def load_model(self, event: wx.Event):
         dir_name = "data/character_models"
@@ -392,7 +423,11 @@ class MainFrame(wx.Frame):
                 w, h = pil_image.size
                 self.wx_source_image = wx.Bitmap.FromBufferRGBA(w, h, pil_image.convert("RGBA").tobytes())
                 self.update_source_image_bitmap()
-                self.poser = self.character_model.get_poser(self.device)
+                self.poser = self.character_model.get_poser(
+                    self.device, incremental_rendering=self.incremental_rendering)
+                self.pose_render_cache = PoseRenderCache(self.poser.get_pose_parameter_groups())
+                self.postprocessor = DisplayImagePostprocessor(self.device)
+                self.apply_render_quality()
             except Exception:
                 message_dialog = wx.MessageDialog(
                     self, "Could not load character model " + character_model_json_file_name, "Poser", wx.OK)
@@ -403,6 +438,15 @@ class MainFrame(wx.Frame):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Puppeteer a character model with MediaPipe face tracking.')
+    parser.add_argument("--video_file", type=str, default=None,
+                        help="Drive the puppeteer from a video file instead of the webcam.")
+    parser.add_argument("--latency_budget_ms", type=float, default=20.0,
+                        help="The face detection time above which frames are downscaled before detection.")
+    parser.add_argument("--incremental_rendering", action="store_true",
+                        help="Rerun only the face morpher when the pose changes mostly in the face.")
+    args = parser.parse_args()
+
     device = torch.device("cuda:0")
 
     pose_converter = MediaPoseFacePoseConverter00()
@@ -417,10 +461,16 @@ if __name__ == "__main__":
         num_faces=1)
     face_landmarker = mediapipe.tasks.vision.FaceLandmarker.create_from_options(options)
 
-    video_capture = cv2.VideoCapture(0)
+    if args.video_file is not None:
+        video_source = FileVideoSource(args.video_file, realtime=True, loop=True)
+    else:
+        video_source = CameraVideoSource(0)
+    capture_detect_pipeline = MediaPipeCaptureDetectPipeline(
+        video_source, face_landmarker, latency_budget_ms=args.latency_budget_ms)
+    capture_detect_pipeline.start()
 
     app = wx.App()
-    main_frame = MainFrame(pose_converter, video_capture, face_landmarker, device)
+    main_frame = MainFrame(pose_converter, capture_detect_pipeline, device, args.incremental_rendering)
     main_frame.Show(True)
     main_frame.capture_timer.Start(30)
     main_frame.animation_timer.Start(30)
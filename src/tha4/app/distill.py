@@ -2,10 +2,11 @@ import argparse
 import logging
 
 from tha4.distiller.distiller_config import DistillerConfig
+from tha4.pytasuku.parallel_runner import ContentHashDatabase, DEFAULT_HASH_DATABASE_FILE_NAME
 from tha4.pytasuku.workspace import Workspace
 
 
-def run_config(config_file_name: str):
+def run_config(config_file_name: str, num_workers: int = 1, use_content_hashes: bool = False):
     config = DistillerConfig.load(config_file_name)
 
     logging.basicConfig(level=logging.INFO, force=True)
@@ -13,7 +14,13 @@ def run_config(config_file_name: str):
     config.define_tasks(workspace)
 
     workspace.start_session()
-    workspace.run(f"{config.prefix}/all")
+    if use_content_hashes:
+        hash_database = ContentHashDatabase(f"{config.prefix}/{DEFAULT_HASH_DATABASE_FILE_NAME}")
+        workspace.run_parallel(f"{config.prefix}/all", num_workers, hash_database)
+    elif num_workers > 1:
+        workspace.run_parallel(f"{config.prefix}/all", num_workers)
+    else:
+        workspace.run(f"{config.prefix}/all")
     workspace.end_session()
 
 
@@ -21,5 +28,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Training script.')
     parser.add_argument("--config_file", type=str, required=True,
                         help="The name of the config file for the distillation process.")
+    parser.add_argument("--num_workers", type=int, default=1,
+                        help="The number of tasks that may run at the same time. The training steps share the GPUs, "
+                             "so more than one is only useful for the lighter steps.")
+    parser.add_argument("--use_content_hashes", action="store_true",
+                        help="Decide which steps are out of date by the content of their input files instead of by "
+                             "file modification times. Changes to the code or the parameters of a step are not "
+                             "detected in this mode, so delete the step's output after making them.")
     args = parser.parse_args()
-    run_config(args.config_file)
+    run_config(args.config_file, args.num_workers, args.use_content_hashes)
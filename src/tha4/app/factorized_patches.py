@@ -0,0 +1,373 @@
+"""
+얼굴 영역 분해(factorized) 패치 세트
+
+fmpm/fmpm2의 조합 패치는 눈썹·눈·입·머리·몸 단계의 데카르트 곱을 모두 렌더링한다.
+하지만 왼쪽 눈(눈썹 포함), 오른쪽 눈, 입은 서로 겹치지 않는 작은 영역만 바꾸므로
+머리/몸 단계(HX, HY, NZ)마다
+  - 기본 프레임 1장 (얼굴 단계는 모두 0)
+  - 영역별 변형의 크롭 (왼쪽: LEB×LEW, 오른쪽: REB×REW, 입: MAA)
+만 렌더링하고, 재생 시 기본 프레임 위에 영역 크롭을 붙여 임의의 조합을 만든다.
+머리 단계당 렌더 수가 곱(LEB·REB·LEW·REW·MAA)에서 합(LEB·LEW + REB·REW + MAA)으로 줄어든다.
+
+키 순서는 오버레이의 UnifiedImageManager와 같다:
+  (LEB, REB, LEW, REW, MAA, HX, HY, NZ)  ==  (EBL, EBR, EWL, EWR, JO, HX, HY, BL)
+
+이 모듈은 numpy와 PIL만 사용하므로 overlay_window.py / absolute.py에서도 불러올 수 있다.
+"""
+
+import itertools
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+from PIL import Image
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+# 영역 이름과 그 영역을 바꾸는 키 위치 (키의 0~4번이 얼굴 단계)
+FACE_REGION_SLOTS = [
+    ("left", (0, 2)),    # LEB, LEW
+    ("right", (1, 3)),   # REB, REW
+    ("mouth", (4,)),     # MAA
+]
+SLOT_LABELS = ["LEB", "REB", "LEW", "REW", "MAA"]
+NUM_FACE_SLOTS = 5
+
+Key = Tuple[int, ...]
+Box = Tuple[int, int, int, int]
+
+
+def get_step_values(steps_config: Sequence[int]) -> List[List[float]]:
+    """단계 수 -> 알파 값 목록 (fmpm과 같은 규칙: 1단계는 중간값 0.5)."""
+    step_values = []
+    for steps in steps_config:
+        if steps == 1:
+            step_values.append([0.5])
+        else:
+            step_values.append([float(v) for v in numpy.linspace(0, 1, steps)])
+    return step_values
+
+
+def head_key_name(head_key: Key) -> str:
+    return f"HX{head_key[0]:02d}_HY{head_key[1]:02d}_NZ{head_key[2]:02d}"
+
+
+def region_file_name(slot_name: str, slot_positions: Sequence[int], face_indices: Sequence[int], head_key: Key) -> str:
+    parts = [f"{SLOT_LABELS[p]}{face_indices[p]}" for p in slot_positions]
+    return f"{slot_name}_{head_key_name(head_key)}_{'_'.join(parts)}.png"
+
+
+def base_file_name(head_key: Key) -> str:
+    return f"base_{head_key_name(head_key)}.png"
+
+
+def compute_changed_box(base: numpy.ndarray,
+                        variants: List[numpy.ndarray],
+                        threshold: int,
+                        margin: int) -> Optional[Box]:
+    """기본 프레임과 변형들의 차이가 threshold를 넘는 픽셀을 모두 덮는 상자 (x0, y0, x1, y1)."""
+    changed = numpy.zeros(base.shape[:2], dtype=bool)
+    base_int = base.astype(numpy.int16)
+    for variant in variants:
+        changed |= (numpy.abs(variant.astype(numpy.int16) - base_int).max(axis=2) > threshold)
+    ys, xs = numpy.nonzero(changed)
+    if len(ys) == 0:
+        return None
+    height, width = base.shape[:2]
+    return (max(0, int(xs.min()) - margin), max(0, int(ys.min()) - margin),
+            min(width, int(xs.max()) + 1 + margin), min(height, int(ys.max()) + 1 + margin))
+
+
+def create_feather_mask(width: int, height: int, feather: int) -> numpy.ndarray:
+    """가장자리에서 0, 안쪽 feather 픽셀부터 1이 되는 (H, W, 1) 가중치."""
+    if feather <= 0:
+        return numpy.ones((height, width, 1), dtype=numpy.float32)
+    xs = numpy.arange(width, dtype=numpy.float32)
+    ys = numpy.arange(height, dtype=numpy.float32)
+    dx = numpy.minimum(xs + 0.5, width - xs - 0.5)
+    dy = numpy.minimum(ys + 0.5, height - ys - 0.5)
+    mask = numpy.minimum(dy[:, None], dx[None, :]) / feather
+    return numpy.clip(mask, 0.0, 1.0)[:, :, None]
+
+
+def save_png(image: numpy.ndarray, file_path: str):
+    mode = 'RGBA' if image.shape[2] == 4 else 'RGB'
+    Image.fromarray(numpy.ascontiguousarray(image), mode=mode).save(file_path, compress_level=1, optimize=False)
+
+
+class FactorizedPatchGenerator:
+    """
+    분해 패치 세트를 생성.
+    - render_func: 키(8개 인덱스) 목록 -> HWC uint8 이미지 목록 (poser 배치 렌더링은 호출자가 담당)
+    - 생성 통계(렌더 수, 디스크 크기, 소요 시간)와 평가 결과는 manifest.json에 기록
+    """
+
+    def __init__(self,
+                 out_dir: str,
+                 steps_config: Sequence[int],
+                 render_func: Callable[[List[Key]], List[numpy.ndarray]],
+                 batch_size: int = 32,
+                 change_threshold: int = 2,
+                 margin: int = 8,
+                 num_save_threads: int = 4):
+        assert len(steps_config) == 8
+        self.out_dir = out_dir
+        self.steps_config = list(steps_config)
+        self.render_func = render_func
+        self.batch_size = batch_size
+        self.change_threshold = change_threshold
+        self.margin = margin
+        self.num_save_threads = num_save_threads
+
+    def get_head_keys(self) -> List[Key]:
+        return list(itertools.product(*[range(n) for n in self.steps_config[5:8]]))
+
+    def get_slot_variants(self, slot_positions: Sequence[int]) -> List[Tuple[int, ...]]:
+        """영역의 모든 얼굴 인덱스 조합 중 기본(모두 0)을 제외한 것."""
+        variants = []
+        for values in itertools.product(*[range(self.steps_config[p]) for p in slot_positions]):
+            if any(v != 0 for v in values):
+                face = [0] * NUM_FACE_SLOTS
+                for p, v in zip(slot_positions, values):
+                    face[p] = v
+                variants.append(tuple(face))
+        return variants
+
+    def get_num_full_renders(self) -> int:
+        return int(numpy.prod(self.steps_config))
+
+    def get_num_factorized_renders(self) -> int:
+        per_head = 1 + sum(len(self.get_slot_variants(positions)) for _, positions in FACE_REGION_SLOTS)
+        return per_head * len(self.get_head_keys())
+
+    def render(self, keys: List[Key]) -> List[numpy.ndarray]:
+        images = []
+        for start in range(0, len(keys), self.batch_size):
+            images.extend(self.render_func(keys[start:start + self.batch_size]))
+        return images
+
+    def generate(self, progress_func: Optional[Callable[[int, int], bool]] = None) -> Dict:
+        """
+        모든 머리 단계에 대해 기본 프레임과 영역 크롭을 렌더링/저장.
+        progress_func(완료 렌더 수, 전체 렌더 수)가 False를 반환하면 중단.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        start_time = time.time()
+        total = self.get_num_factorized_renders()
+        done = 0
+        cancelled = False
+        regions = {}
+        image_size = None
+
+        slot_variants = [(name, positions, self.get_slot_variants(positions)) for name, positions in FACE_REGION_SLOTS]
+        executor = ThreadPoolExecutor(max_workers=self.num_save_threads)
+        try:
+            for head_key in self.get_head_keys():
+                keys = [(0,) * NUM_FACE_SLOTS + head_key]
+                for _, _, variants in slot_variants:
+                    keys.extend(face + head_key for face in variants)
+                images = self.render(keys)
+                base = images[0]
+                image_size = [base.shape[1], base.shape[0]]
+                executor.submit(save_png, base, os.path.join(self.out_dir, base_file_name(head_key)))
+
+                head_regions = {}
+                offset = 1
+                for name, positions, variants in slot_variants:
+                    variant_images = images[offset:offset + len(variants)]
+                    offset += len(variants)
+                    box = compute_changed_box(base, variant_images, self.change_threshold, self.margin)
+                    if box is None:
+                        continue
+                    head_regions[name] = list(box)
+                    x0, y0, x1, y1 = box
+                    for face, image in zip(variants, variant_images):
+                        file_name = region_file_name(name, positions, face, head_key)
+                        executor.submit(save_png, image[y0:y1, x0:x1].copy(), os.path.join(self.out_dir, file_name))
+                regions[head_key_name(head_key)] = head_regions
+
+                done += len(keys)
+                if progress_func is not None and not progress_func(done, total):
+                    cancelled = True
+                    break
+        finally:
+            executor.shutdown(wait=True)
+
+        elapsed = time.time() - start_time
+        base_bytes = []
+        total_bytes = 0
+        for file_name in os.listdir(self.out_dir):
+            if not file_name.endswith(".png"):
+                continue
+            size = os.path.getsize(os.path.join(self.out_dir, file_name))
+            total_bytes += size
+            if file_name.startswith("base_"):
+                base_bytes.append(size)
+
+        stats = {
+            "full_renders": self.get_num_full_renders(),
+            "factorized_renders": done,
+            "factorized_bytes": total_bytes,
+            # 전체 조합 프레임 하나의 크기는 기본 프레임 크기와 비슷하다고 가정한 추정치
+            "estimated_full_bytes": int(numpy.mean(base_bytes) * self.get_num_full_renders()) if base_bytes else 0,
+            "generation_sec": elapsed,
+            "cancelled": cancelled,
+        }
+        manifest = {
+            "version": 1,
+            "steps_config": self.steps_config,
+            "image_size": image_size,
+            "regions": regions,
+            "stats": stats,
+        }
+        write_manifest(self.out_dir, manifest)
+        return stats
+
+    def evaluate(self, patch_set: 'FactorizedPatchSet', num_samples: int = 32, seed: int = 0) -> Dict:
+        """
+        분해 세트로 합성한 이미지와 실제 전체 렌더를 무작위 조합(두 개 이상의 영역이 바뀐 조합)에서 비교.
+        결과(평균/최대 절대 오차, PSNR)는 manifest.json에 추가.
+        생성이 중간에 중단된 세트는 렌더된 머리 단계의 조합만 비교한다.
+        """
+        rng = random.Random(seed)
+        candidates = [key for key in patch_set.keys()
+                      if sum(any(key[p] != 0 for p in positions) for _, positions in FACE_REGION_SLOTS) >= 2]
+        if len(candidates) == 0:
+            return {}
+        keys = rng.sample(candidates, min(num_samples, len(candidates)))
+        renders = self.render(keys)
+        abs_errors = []
+        squared_errors = []
+        max_error = 0
+        for key, render in zip(keys, renders):
+            composite = patch_set.composite_array(key)
+            if composite is None:
+                continue
+            if render.shape[2] == 3:
+                render = numpy.concatenate([render, numpy.full(render.shape[:2] + (1,), 255, numpy.uint8)], axis=2)
+            diff = numpy.abs(composite.astype(numpy.float32) - render.astype(numpy.float32))
+            abs_errors.append(float(diff.mean()))
+            squared_errors.append(float((diff ** 2).mean()))
+            max_error = max(max_error, int(diff.max()))
+        if len(abs_errors) == 0:
+            return {}
+        mse = float(numpy.mean(squared_errors))
+        evaluation = {
+            "num_samples": len(abs_errors),
+            "mean_abs_error": float(numpy.mean(abs_errors)),
+            "max_abs_error": max_error,
+            "psnr_db": float(10 * numpy.log10(255.0 ** 2 / mse)) if mse > 0 else float("inf"),
+        }
+        manifest = read_manifest(self.out_dir)
+        manifest["evaluation"] = evaluation
+        write_manifest(self.out_dir, manifest)
+        return evaluation
+
+
+def read_manifest(patch_dir: str) -> Dict:
+    with open(os.path.join(patch_dir, MANIFEST_FILE_NAME), "rt", encoding="utf-8") as fin:
+        return json.load(fin)
+
+
+def write_manifest(patch_dir: str, manifest: Dict):
+    with open(os.path.join(patch_dir, MANIFEST_FILE_NAME), "wt", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=2)
+
+
+def format_report(stats: Dict, evaluation: Optional[Dict] = None) -> str:
+    lines = [
+        f"Renders: {stats['factorized_renders']:,} (full grid: {stats['full_renders']:,}, "
+        f"{stats['full_renders'] / max(1, stats['factorized_renders']):.1f}x fewer)",
+        f"Disk: {stats['factorized_bytes'] / (1024 * 1024):.1f} MB "
+        f"(full grid est.: {stats['estimated_full_bytes'] / (1024 * 1024):.1f} MB)",
+        f"Generation time: {stats['generation_sec']:.1f} s",
+    ]
+    if evaluation:
+        lines.append(f"Error vs. full renders ({evaluation['num_samples']} samples): "
+                     f"mean {evaluation['mean_abs_error']:.3f}, max {evaluation['max_abs_error']}, "
+                     f"PSNR {evaluation['psnr_db']:.1f} dB")
+    return "\n".join(lines)
+
+
+class FactorizedPatchSet:
+    """분해 패치 세트를 읽어 임의의 키에 해당하는 프레임을 합성 (기본 프레임 + 영역 크롭)."""
+
+    def __init__(self, patch_dir: str, max_cached_parts: int = 512, feather: int = 4):
+        self.patch_dir = patch_dir
+        manifest = read_manifest(patch_dir)
+        self.steps_config = manifest["steps_config"]
+        self.image_size = manifest.get("image_size")
+        self.regions = manifest["regions"]
+        self.feather = feather
+        self.max_cached_parts = max_cached_parts
+        self.part_cache = OrderedDict()
+        self.mask_cache = {}
+
+    @staticmethod
+    def exists(patch_dir: str) -> bool:
+        return os.path.isfile(os.path.join(patch_dir, MANIFEST_FILE_NAME))
+
+    def keys(self) -> List[Key]:
+        available_heads = set(self.regions.keys())
+        return [key for key in itertools.product(*[range(n) for n in self.steps_config])
+                if head_key_name(key[5:8]) in available_heads]
+
+    def has_key(self, key: Key) -> bool:
+        return len(key) == 8 \
+            and all(0 <= k < n for k, n in zip(key, self.steps_config)) \
+            and head_key_name(tuple(key[5:8])) in self.regions
+
+    def load_part(self, file_name: str) -> Optional[numpy.ndarray]:
+        if file_name in self.part_cache:
+            self.part_cache.move_to_end(file_name)
+            return self.part_cache[file_name]
+        file_path = os.path.join(self.patch_dir, file_name)
+        if not os.path.isfile(file_path):
+            return None
+        part = numpy.asarray(Image.open(file_path).convert('RGBA'))
+        self.part_cache[file_name] = part
+        while len(self.part_cache) > self.max_cached_parts:
+            self.part_cache.popitem(last=False)
+        return part
+
+    def get_mask(self, width: int, height: int) -> numpy.ndarray:
+        if (width, height) not in self.mask_cache:
+            self.mask_cache[(width, height)] = create_feather_mask(width, height, self.feather)
+        return self.mask_cache[(width, height)]
+
+    def composite_array(self, key: Key) -> Optional[numpy.ndarray]:
+        key = tuple(key)
+        if not self.has_key(key):
+            return None
+        head_key = key[5:8]
+        base = self.load_part(base_file_name(head_key))
+        if base is None:
+            return None
+        head_regions = self.regions[head_key_name(head_key)]
+        output = None
+        for name, positions in FACE_REGION_SLOTS:
+            if all(key[p] == 0 for p in positions) or name not in head_regions:
+                continue
+            crop = self.load_part(region_file_name(name, positions, key, head_key))
+            if crop is None:
+                continue
+            if output is None:
+                output = base.astype(numpy.float32)
+            x0, y0, x1, y1 = head_regions[name]
+            mask = self.get_mask(x1 - x0, y1 - y0)
+            region = output[y0:y1, x0:x1]
+            output[y0:y1, x0:x1] = region + (crop.astype(numpy.float32) - region) * mask
+        if output is None:
+            return base
+        return numpy.rint(output).astype(numpy.uint8)
+
+    def composite(self, key: Key) -> Optional[Image.Image]:
+        array = self.composite_array(key)
+        if array is None:
+            return None
+        return Image.fromarray(array, mode='RGBA')
@@ -19,6 +19,7 @@ import torch
 import wx
 
 from tha4.poser.poser import Poser, PoseParameterCategory, PoseParameterGroup
+from tha4.app.factorized_patches import FactorizedPatchGenerator, FactorizedPatchSet, format_report, get_step_values
 
 
 class MorphCategoryControlPanel(wx.Panel):
@@ -475,6 +476,8 @@ class MainFrame(wx.Frame):
                 "Large (4,096 combinations: 4×4×4×4×4×4×4×1)",
                 "Custom Eye-Face Config (13,310 combinations: 1×1×5×5×4×11×11×11)",
                 "Full (65,536 combinations: 4×4×4×4×4×4×4×4)",
+                "Factorized Eye-Face Config (1×1×5×5×4×11×11×11, 15,972 renders)",
+                "Factorized Full (4×4×4×4×4×4×4×4, 2,176 renders)",
                 "Custom batch size..."
             ]
         )
@@ -502,6 +505,10 @@ class MainFrame(wx.Frame):
         elif selection == 4:  # Full
             steps_config = [4, 4, 4, 4, 4, 4, 4, 4]
             total_combinations = 4 * 4 * 4 * 4 * 4 * 4 * 4 * 4  # 65,536
+        elif selection == 5:  # Factorized Eye-Face Config
+            return self.generate_factorized_patches([1, 1, 5, 5, 4, 11, 11, 11], "eye_face_factorized")
+        elif selection == 6:  # Factorized Full
+            return self.generate_factorized_patches([4, 4, 4, 4, 4, 4, 4, 4], "combined_parameters_factorized")
         else:  # Custom
             batch_dialog = wx.NumberEntryDialog(
                 self, "Enter batch size (1-10000):", "Batch Size", "Custom Batch", 1000, 1, 10000
@@ -661,6 +668,79 @@ class MainFrame(wx.Frame):
         finally:
             self.close_progress_dialog_safely(dialog)
 
+    def render_patch_keys(self, params, base_pose, step_values, keys):
+        """단계 인덱스 키 목록을 렌더링해 numpy 이미지 목록으로 반환"""
+        images = []
+        with torch.no_grad():
+            source_image = self.torch_source_image.unsqueeze(0)
+            for key in keys:
+                alphas = [step_values[i][k] for i, k in enumerate(key)]
+                current_pose = self.create_pose_from_alphas(base_pose, params, alphas)
+                pose_tensor = torch.tensor(current_pose, device=self.device, dtype=self.dtype)
+                output = self.poser.pose(source_image, pose_tensor, 0)[0]
+                numpy_image = convert_output_image_from_torch_to_numpy(output.detach().cpu())
+                # save_patch와 같이 위쪽 절반만 사용
+                images.append(numpy_image[:numpy_image.shape[0] // 2])
+        return images
+
+    def generate_factorized_patches(self, steps_config, folder_name):
+        """분해 패치 생성 - 머리 단계마다 기본 프레임 1장 + 눈/입 영역 크롭만 렌더링 (factorized_patches.py 참고)"""
+        params = self.find_required_parameters()
+        if not params:
+            return
+
+        base_pose = self.get_current_pose()
+        step_values = get_step_values(steps_config)
+        generator = FactorizedPatchGenerator(
+            f"data/{folder_name}_patches",
+            steps_config,
+            lambda keys: self.render_patch_keys(params, base_pose, step_values, keys),
+            batch_size=self.batch_size)
+        total_renders = generator.get_num_factorized_renders()
+        print(f"Factorized generation: {total_renders:,} renders instead of {generator.get_num_full_renders():,}")
+
+        dialog = wx.ProgressDialog(
+            "Generating Factorized Patches",
+            f"Rendering {total_renders:,} base frames and face regions...",
+            total_renders,
+            self,
+            wx.PD_CAN_ABORT | wx.PD_AUTO_HIDE
+        )
+
+        try:
+            def update_progress(done, total):
+                keep_going = dialog.Update(min(done, total), f"Rendered {done:,}/{total:,}")[0]
+                wx.GetApp().Yield()
+                return keep_going
+
+            stats = generator.generate(update_progress)
+            if stats["cancelled"]:
+                # 중단된 경우 비교용 전체 렌더는 하지 않음
+                evaluation = None
+            else:
+                dialog.Update(total_renders, "Comparing with full renders...")
+                evaluation = generator.evaluate(FactorizedPatchSet(generator.out_dir))
+            report = format_report(stats, evaluation)
+            print(report)
+
+            self.close_progress_dialog_safely(dialog)
+            status = "cancelled (partial set saved)" if stats["cancelled"] else "completed"
+            success_msg = (f"Factorized generation {status}!\n"
+                           f"{report}\n"
+                           f"Check {generator.out_dir}/ folder.")
+            wx.CallAfter(lambda: wx.MessageBox(success_msg, "Success", wx.OK | wx.ICON_INFORMATION))
+
+        except Exception as e:
+            print(f"Error in factorized generation: {str(e)}")
+            import traceback
+            traceback.print_exc()
+
+            error_msg = str(e)
+            wx.CallAfter(lambda msg=error_msg: wx.MessageBox(f"Error: {msg}", "Error", wx.OK | wx.ICON_ERROR))
+
+        finally:
+            self.close_progress_dialog_safely(dialog)
+
     def generate_random_samples(self, sample_count):
         """랜덤 샘플링으로 지정된 수만큼만 생성 - 빠른 저장"""
         params = self.find_required_parameters()
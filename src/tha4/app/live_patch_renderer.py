@@ -0,0 +1,243 @@
+"""
+오버레이용 실시간 패치 렌더러
+
+UnifiedImageManager가 정확한 키의 패치를 찾지 못하면 가장 가까운 패치를 보여주는데,
+이 렌더러는 그동안 백그라운드 스레드에서 캐릭터 모델(mode_14 GeneralPoser02, 기본 CPU)로
+빠진 키를 렌더링해 돌려준다. 결과는 UI 스레드가 타이머에서 poll_results()로 가져가
+메모리 캐시에 넣고, save_dir이 주어지면 전체 조합 패치와 같은 파일명으로 디스크에도 저장한다.
+
+UI 스레드에서 호출하는 request()/poll_results()는 짧은 잠금만 잡으므로 렌더링 중에도 막히지 않는다.
+요청 큐는 최신 요청 우선(LIFO)이며 가득 차면 가장 오래된 요청을 버린다.
+steps_config 범위를 벗어난 키는 렌더링하지 않는다 (다른 단계 값으로 렌더링된 이미지가 그 키로 저장되지 않도록).
+image_size가 주어지면 렌더링 결과를 패치 라이브러리와 같은 크기로 자른다 (fmpm2는 위쪽 절반만 저장).
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+try:
+    from tha4.app.factorized_patches import get_step_values
+except ImportError:
+    # 스크립트로 직접 실행될 때는 같은 폴더의 모듈 사용
+    from factorized_patches import get_step_values
+
+# 키 위치별 (파라미터 그룹 이름, 그룹 내 성분). fmpm의 find_required_parameters/create_pose_from_alphas가
+# mode_07/mode_14 공통 파라미터(pose_parameters.py)에 대해 고르는 것과 같다.
+PATCH_KEY_PARAMETERS = [
+    ("eyebrow_troubled", 1),  # LEB
+    ("eyebrow_troubled", 0),  # REB
+    ("eye_wink", 1),          # LEW
+    ("eye_wink", 0),          # REW
+    ("mouth_aaa", 0),         # MAA
+    ("head_x", 0),            # HX
+    ("head_y", 0),            # HY
+    ("neck_z", 0),            # NZ
+]
+
+# UnifiedImageManager._convert_mocap_to_params가 만드는 키의 범위
+DEFAULT_STEPS_CONFIG = [4, 4, 4, 4, 4, 11, 11, 11]
+
+Key = Tuple[int, ...]
+
+
+def patch_key_file_name(key: Key) -> str:
+    """전체 조합 패치(eye_face_*.png)와 같은 형식의 파일명."""
+    return (f"eye_face_LEB{key[0]}_REB{key[1]}_LEW{key[2]}_REW{key[3]}_"
+            f"MAA{key[4]}_HX{key[5]:02d}_HY{key[6]:02d}_NZ{key[7]:02d}.png")
+
+
+def is_valid_patch_key(key: Key, steps_config: Sequence[int]) -> bool:
+    return len(key) == len(steps_config) and all(0 <= k < n for k, n in zip(key, steps_config))
+
+
+def crop_to_patch_size(image: Image.Image, image_size: Optional[Tuple[int, int]]) -> Image.Image:
+    """(너비, 높이)에 맞게 위쪽부터, 가로는 가운데를 기준으로 자른다 (fmpm2 save_patch와 같은 방식)."""
+    if image_size is None or tuple(image_size) == image.size:
+        return image
+    width = min(image_size[0], image.size[0])
+    height = min(image_size[1], image.size[1])
+    left = (image.size[0] - width) // 2
+    return image.crop((left, 0, left + width, height))
+
+
+def create_pose_from_patch_key(pose_parameter_groups, key: Key, steps_config: Sequence[int]) -> List[float]:
+    """단계 인덱스 키 -> 포즈 벡터. 나머지 파라미터는 fmpm 슬라이더 초기값과 같이 0."""
+    if not is_valid_patch_key(key, steps_config):
+        raise ValueError(f"Patch key {key} is outside the steps config {list(steps_config)}")
+    num_parameters = sum(group.get_arity() for group in pose_parameter_groups)
+    pose = [0.0 for _ in range(num_parameters)]
+    groups_by_name = {group.get_group_name(): group for group in pose_parameter_groups}
+    step_values = get_step_values(steps_config)
+    for position, (group_name, component) in enumerate(PATCH_KEY_PARAMETERS):
+        group = groups_by_name[group_name]
+        values = step_values[position]
+        alpha = values[key[position]]
+        low, high = group.get_range()
+        pose[group.get_parameter_index() + component] = low + (high - low) * alpha
+    return pose
+
+
+class LivePatchRenderer:
+    def __init__(self,
+                 character_model_file_name: str,
+                 steps_config: Optional[Sequence[int]] = None,
+                 save_dir: Optional[str] = None,
+                 device_name: str = "cpu",
+                 max_pending: int = 4,
+                 image_size: Optional[Tuple[int, int]] = None,
+                 max_attempts: int = 3):
+        self.character_model_file_name = character_model_file_name
+        self.image_size = tuple(image_size) if image_size is not None else None
+        self.steps_config = list(steps_config) if steps_config is not None else list(DEFAULT_STEPS_CONFIG)
+        self.save_dir = save_dir
+        self.device_name = device_name
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+
+        self.condition = threading.Condition()
+        self.requests = deque()
+        self.pending = set()
+        self.finished = set()
+        self.failure_counts = {}
+        self.results = deque()
+
+        self.num_requested = 0
+        self.num_rendered = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self.num_abandoned = 0
+        self.num_out_of_range = 0
+        self.render_times = deque(maxlen=256)
+
+        self.ready = False
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+            self.thread = None
+
+    def request(self, key: Key) -> bool:
+        """빠진 키의 렌더링을 요청 (UI 스레드용, 막히지 않음). 새로 큐에 넣었으면 True."""
+        key = tuple(key)
+        with self.condition:
+            if not is_valid_patch_key(key, self.steps_config):
+                self.num_out_of_range += 1
+                return False
+            if not self.running or key in self.pending or key in self.finished:
+                return False
+            if len(self.requests) >= self.max_pending:
+                dropped = self.requests.pop()
+                self.pending.discard(dropped)
+                self.num_dropped += 1
+            self.requests.appendleft(key)
+            self.pending.add(key)
+            self.num_requested += 1
+            self.condition.notify()
+        return True
+
+    def poll_results(self) -> List[Tuple[Key, Image.Image, Optional[str]]]:
+        """렌더링이 끝난 (키, 이미지, 저장 경로) 목록 (UI 스레드용, 막히지 않음)."""
+        results = []
+        while True:
+            try:
+                results.append(self.results.popleft())
+            except IndexError:
+                return results
+
+    def _run(self):
+        try:
+            # torch와 모델은 워커 스레드에서만 불러 오버레이 시작 시간에 영향을 주지 않음
+            import torch
+            from tha4.charmodel.character_model import CharacterModel
+            from tha4.image_postprocessor import DisplayImagePostprocessor
+
+            device = torch.device(self.device_name)
+            character_model = CharacterModel.load(self.character_model_file_name)
+            poser = character_model.get_poser(device)
+            character_image = character_model.get_character_image(device)
+            postprocessor = DisplayImagePostprocessor(device)
+            pose_parameter_groups = poser.get_pose_parameter_groups()
+            if self.save_dir is not None:
+                os.makedirs(self.save_dir, exist_ok=True)
+            self.ready = True
+            print(f"Live patch renderer ready ({self.device_name})")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Live patch renderer failed to start: {e}")
+            return
+
+        while True:
+            with self.condition:
+                while self.running and len(self.requests) == 0:
+                    self.condition.wait(0.5)
+                if not self.running:
+                    return
+                key = self.requests.popleft()
+
+            start_time = time.perf_counter()
+            try:
+                pose = create_pose_from_patch_key(pose_parameter_groups, key, self.steps_config)
+                pose_tensor = torch.tensor(pose, device=device, dtype=poser.get_dtype())
+                with torch.no_grad():
+                    output_image = poser.pose(character_image, pose_tensor)[0]
+                image = Image.fromarray(postprocessor.process(output_image).copy(), mode='RGBA')
+                image = crop_to_patch_size(image, self.image_size)
+                file_path = None
+                if self.save_dir is not None:
+                    file_path = os.path.join(self.save_dir, patch_key_file_name(key))
+                    image.save(file_path, compress_level=1)
+                self.results.append((key, image, file_path))
+                self.num_rendered += 1
+                self.render_times.append(time.perf_counter() - start_time)
+                with self.condition:
+                    self.pending.discard(key)
+                    self.finished.add(key)
+                    self.failure_counts.pop(key, None)
+            except Exception as e:
+                # 일시적인 실패일 수 있으므로 다음 요청 때 다시 시도하고, max_attempts번 실패한 키만 포기
+                with self.condition:
+                    self.pending.discard(key)
+                    self.num_failed += 1
+                    self.failure_counts[key] = self.failure_counts.get(key, 0) + 1
+                    if self.failure_counts[key] >= self.max_attempts:
+                        self.finished.add(key)
+                        self.num_abandoned += 1
+                print(f"Live patch rendering failed for {key} "
+                      f"(attempt {self.failure_counts[key]}/{self.max_attempts}): {e}")
+
+    def get_stats(self) -> Dict:
+        render_times = sorted(self.render_times)
+        if len(render_times) > 0:
+            p50 = render_times[int(0.5 * (len(render_times) - 1))] * 1000.0
+            p99 = render_times[int(0.99 * (len(render_times) - 1))] * 1000.0
+        else:
+            p50 = p99 = 0.0
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "requested": self.num_requested,
+            "rendered": self.num_rendered,
+            "dropped": self.num_dropped,
+            "failed": self.num_failed,
+            "abandoned": self.num_abandoned,
+            "out_of_range": self.num_out_of_range,
+            "pending": len(self.pending),
+            "render_ms_p50": p50,
+            "render_ms_p99": p99,
+        }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+녹화된 모캡 세션을 오버레이의 16ms 타이머와 같은 간격으로 UnifiedImageManager에 재생하여
+정확한 패치 적중률(EXACT MATCH 비율)과 프레임 처리 시간(p50/p99/max)을 측정한다.
+
+세션 녹화: VTUBER_RECORD_MOCAP=session.jsonl python overlay_window.py
+재생:     python overlay_replay_benchmark.py session.jsonl [--character_model character.yaml]
+
+--character_model을 주면 같은 세션을 실시간 렌더러 없이 한 번, 켜고 한 번 재생해 비교한다.
+"""
+
+import argparse
+import json
+import time
+
+try:
+    from tha4.app.overlay_window import UnifiedImageManager
+    from tha4.app.live_patch_renderer import LivePatchRenderer
+except ImportError:
+    # 스크립트로 직접 실행될 때는 같은 폴더의 모듈 사용
+    from overlay_window import UnifiedImageManager
+    from live_patch_renderer import LivePatchRenderer
+
+
+def load_session(file_name):
+    records = []
+    with open(file_name, 'r', encoding='utf-8') as fin:
+        for line in fin:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records.append((record['t'], record['data']))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(q * (len(sorted_values) - 1))]
+
+
+def replay_session(records, image_manager, tick_sec=0.016, speed=1.0):
+    """타이머 틱마다 그 시점의 최신 모캡 데이터로 이미지를 고르고, 호출 시간을 기록."""
+    frame_times = []
+    session_start = records[0][0]
+    session_length = records[-1][0] - session_start
+    record_index = 0
+    wall_start = time.perf_counter()
+    next_tick = wall_start
+    while True:
+        session_time = (next_tick - wall_start) * speed
+        if session_time > session_length:
+            break
+        while record_index + 1 < len(records) and records[record_index + 1][0] - session_start <= session_time:
+            record_index += 1
+
+        start = time.perf_counter()
+        image_manager.get_best_avatar_image(records[record_index][1])
+        frame_times.append(time.perf_counter() - start)
+
+        next_tick += tick_sec
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return sorted(frame_times)
+
+
+def print_report(label, image_manager, frame_times, tick_sec):
+    total = sum(image_manager.match_counts.values())
+    print(f"[{label}] {total} frames")
+    for method, count in sorted(image_manager.match_counts.items()):
+        print(f"  {method or 'NONE':18s} {count:7d} ({count / max(total, 1) * 100:5.1f}%)")
+    print(f"  hit rate           {image_manager.get_hit_rate() * 100:5.1f}%")
+    print(f"  frame time         p50 {percentile(frame_times, 0.5) * 1000:.2f}ms"
+          f"  p99 {percentile(frame_times, 0.99) * 1000:.2f}ms"
+          f"  max {percentile(frame_times, 1.0) * 1000:.2f}ms")
+    over_budget = sum(1 for t in frame_times if t > tick_sec)
+    print(f"  over {tick_sec * 1000:.0f}ms budget   {over_budget}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded mocap session through the overlay image manager.')
+    parser.add_argument('session', type=str, help='A JSON lines file recorded with VTUBER_RECORD_MOCAP.')
+    parser.add_argument('--data_path', type=str, default=None, help='The data directory (defaults to VTUBER_DATA_PATH).')
+    parser.add_argument('--character_model', type=str, default=None,
+                        help='A character model YAML file. When given, the session is also replayed with live rendering.')
+    parser.add_argument('--device', type=str, default='cpu', help='The device of the live renderer.')
+    parser.add_argument('--tick_ms', type=float, default=16.0, help='The overlay timer interval.')
+    parser.add_argument('--speed', type=float, default=1.0, help='The replay speed relative to the recording.')
+    args = parser.parse_args()
+
+    records = load_session(args.session)
+    if len(records) < 2:
+        print("The session has too few records.")
+        return
+    tick_sec = args.tick_ms / 1000.0
+    print(f"Session: {len(records)} records, {records[-1][0] - records[0][0]:.1f}s")
+
+    image_manager = UnifiedImageManager(args.data_path)
+    frame_times = replay_session(records, image_manager, tick_sec, args.speed)
+    print_report("patches only", image_manager, frame_times, tick_sec)
+
+    if args.character_model:
+        image_manager = UnifiedImageManager(args.data_path)
+        live_renderer = LivePatchRenderer(args.character_model,
+                                          steps_config=image_manager.infer_steps_config(),
+                                          device_name=args.device,
+                                          image_size=image_manager.infer_image_size())
+        live_renderer.start()
+        image_manager.enable_live_rendering(live_renderer)
+        # 모델 로딩이 끝난 뒤에 재생을 시작해야 렌더링 대기 시간만 측정됨
+        while not live_renderer.ready and live_renderer.error is None:
+            time.sleep(0.1)
+        frame_times = replay_session(records, image_manager, tick_sec, args.speed)
+        live_renderer.stop()
+        print_report("live rendering", image_manager, frame_times, tick_sec)
+        print(f"  renderer           {live_renderer.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
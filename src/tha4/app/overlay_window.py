@@ -11,21 +11,95 @@ import time
 import math
 import os
 import glob
+import bisect
+import weakref
+import json
+import sys
 from PIL import Image
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, deque
+
+try:
+    from tha4.app.factorized_patches import FactorizedPatchSet
+    from tha4.app.patch_dedup import ALIAS_FILE_NAME, load_alias_paths
+    from tha4.app.live_patch_renderer import LivePatchRenderer, DEFAULT_STEPS_CONFIG
+except ImportError:
+    # 스크립트로 직접 실행될 때는 같은 폴더의 모듈 사용
+    from factorized_patches import FactorizedPatchSet
+    from patch_dedup import ALIAS_FILE_NAME, load_alias_paths
+    from live_patch_renderer import LivePatchRenderer, DEFAULT_STEPS_CONFIG
+    # 필터 뱅크는 퍼펫티어와 공유하는 tha4.mocap에 있으므로 src 폴더를 경로에 추가
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from tha4.mocap.pose_filter import NamedOneEuroFilter
+
+# iFacialMocap 값에 대한 One-Euro 필터 설정. 블렌드셰이프(0~1)는 깜빡임과 말하기를 따라가도록 기본 컷오프를 높게,
+# 머리/눈 회전(라디안)은 패치 키를 흔드는 떨림이 가장 잘 보이므로 낮게 둔다.
+MOCAP_FILTER_MIN_CUTOFF = 3.0
+MOCAP_FILTER_BETA = 1.0
+MOCAP_ROTATION_FILTER_SETTINGS = {'min_cutoff': 1.0, 'beta': 0.5, 'lower_bound': None, 'upper_bound': None}
+MOCAP_ROTATION_NAMES = ['head_rx', 'head_ry', 'head_rz',
+                        'rightEye_rx', 'rightEye_ry', 'rightEye_rz',
+                        'leftEye_rx', 'leftEye_ry', 'leftEye_rz']
+
+
+class MovingAverageMocapFilter:
+    """이전 방식: 값마다 최근 history_size개 샘플의 평균"""
+
+    def __init__(self, history_size=3):
+        self.history_size = history_size
+        self.data_history = defaultdict(list)
+        self.latest_data = {}
+
+    def filter(self, raw_data, timestamp):
+        for key, value in raw_data.items():
+            self.data_history[key].append(value)
+            if len(self.data_history[key]) > self.history_size:
+                self.data_history[key].pop(0)
+
+            if len(self.data_history[key]) >= 2:
+                self.latest_data[key] = sum(self.data_history[key]) / len(self.data_history[key])
+            else:
+                self.latest_data[key] = value
+        return dict(self.latest_data)
+
+    def predict(self, timestamp):
+        return dict(self.latest_data)
+
+
+def create_mocap_filter(method='one_euro', min_cutoff_scale=1.0, beta_scale=1.0):
+    """method: 'one_euro' (기본), 'average' (이전 3샘플 평균), 'none'"""
+    if method == 'average':
+        return MovingAverageMocapFilter()
+    if method == 'none':
+        return MovingAverageMocapFilter(history_size=1)
+    rotation_settings = dict(MOCAP_ROTATION_FILTER_SETTINGS)
+    rotation_settings['min_cutoff'] *= min_cutoff_scale
+    rotation_settings['beta'] *= beta_scale
+    return NamedOneEuroFilter(min_cutoff=MOCAP_FILTER_MIN_CUTOFF * min_cutoff_scale,
+                              beta=MOCAP_FILTER_BETA * beta_scale,
+                              lower_bound=0.0,
+                              upper_bound=1.0,
+                              channel_settings={name: rotation_settings for name in MOCAP_ROTATION_NAMES})
 
 class iFacialMocapReceiver:
     """iFacialMocap UDP 데이터 수신"""
     
-    def __init__(self, port=49983):
+    def __init__(self, port=49983, record_path=None, filter_method='one_euro', prediction_time=0.016):
         self.port = port
         self.socket = None
         self.running = False
         self.latest_data = {}
         self.thread = None
         
-        self.data_history = defaultdict(list)
-        self.history_size = 3
+        # 세션 녹화 (overlay_replay_benchmark.py, pose_filter_benchmark.py로 재생)
+        self.record_path = record_path
+        self.record_file = None
+        
+        # 수신 스레드가 필터를 갱신하고 타이머가 예측값을 읽으므로 잠금으로 보호
+        self.mocap_filter = create_mocap_filter(filter_method)
+        self.filter_lock = threading.Lock()
+        # get_latest_data는 마지막 샘플 이후 경과 시간 + prediction_time만큼 앞을 예측 (화면 표시 지연 보정)
+        self.prediction_time = prediction_time
         
         self.last_log_time = 0
         self.log_interval = 2.0
@@ -37,6 +111,9 @@ class iFacialMocapReceiver:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.socket.bind(('', self.port))
             self.socket.settimeout(0.1)
+            if self.record_path:
+                self.record_file = open(self.record_path, 'a', encoding='utf-8')
+                print(f"Recording mocap session to {self.record_path}")
             self.running = True
             self.thread = threading.Thread(target=self._receive_loop)
             self.thread.daemon = True
@@ -53,6 +130,9 @@ class iFacialMocapReceiver:
             self.socket.close()
         if self.thread:
             self.thread.join()
+        if self.record_file:
+            self.record_file.close()
+            self.record_file = None
     
     def _receive_loop(self):
         while self.running:
@@ -100,16 +180,12 @@ class iFacialMocapReceiver:
                 self.last_log_time = current_time
     
     def _smooth_data(self, raw_data):
-        for key, value in raw_data.items():
-            self.data_history[key].append(value)
-            if len(self.data_history[key]) > self.history_size:
-                self.data_history[key].pop(0)
-            
-            if len(self.data_history[key]) >= 2:
-                smoothed = sum(self.data_history[key]) / len(self.data_history[key])
-                self.latest_data[key] = smoothed
-            else:
-                self.latest_data[key] = value
+        with self.filter_lock:
+            self.latest_data = self.mocap_filter.filter(raw_data, time.perf_counter())
+        
+        if self.record_file:
+            # 필터를 다시 평가할 수 있도록 원본 값도 기록
+            self.record_file.write(json.dumps({'t': time.time(), 'data': self.latest_data, 'raw': raw_data}) + '\n')
     
     def _parse_head_eye_data(self, data_part, raw_data):
         try:
@@ -140,7 +216,8 @@ class iFacialMocapReceiver:
             pass
     
     def get_latest_data(self):
-        return self.latest_data.copy()
+        with self.filter_lock:
+            return self.mocap_filter.predict(time.perf_counter() + self.prediction_time)
 
 
 class UnifiedImageManager:
@@ -161,6 +238,13 @@ class UnifiedImageManager:
         self.image_cache = OrderedDict()
         self.image_paths = {}
         self.max_cache_size = max_cache_size
+        # 분해 패치 세트 (기본 프레임 + 눈/입 영역 크롭을 실시간 합성)
+        self.factorized_set = None
+        # 별칭 표로 같은 파일을 가리키는 키들이 디코딩한 이미지를 공유하도록 경로별로 보관
+        self.decoded_images = weakref.WeakValueDictionary()
+        # 빠진 키를 백그라운드에서 렌더링하는 포저 (enable_live_rendering으로 설정)
+        self.live_renderer = None
+        self.match_counts = defaultdict(int)
         
         self.fallback_search_enabled = True
         self.sensitivity = 0.5
@@ -194,9 +278,19 @@ class UnifiedImageManager:
                     image_dir = alt_dir
                     break
             else:
+                if self._index_factorized_patches():
+                    return
                 print(f"Images directory not found: {image_dir}")
                 return
         
+        # 중복 제거된 라이브러리(patch_dedup.py)는 PNG를 glob/파싱하지 않고 별칭 표만 읽음
+        if os.path.isfile(os.path.join(image_dir, ALIAS_FILE_NAME)):
+            self.image_paths = load_alias_paths(image_dir)
+            elapsed = time.time() - start_time
+            num_images = len(set(self.image_paths.values()))
+            print(f"Indexed {len(self.image_paths)} aliased keys ({num_images} unique images) in {elapsed:.2f}s")
+            return
+        
         patterns = ["eye_face_*.png", "opt_*.png"]
         
         files = []
@@ -227,6 +321,23 @@ class UnifiedImageManager:
         print(f"Indexed {indexed_count} images in {elapsed:.2f}s")
         print(f"Enhanced eye recognition system ready!")
         
+    def _index_factorized_patches(self):
+        """전체 조합 이미지가 없으면 분해 패치 세트(manifest.json)를 찾아 모든 조합 키를 등록"""
+        factorized_dirs = [
+            os.path.join(self.images_base_dir, "eye_face_factorized_patches"),
+            os.path.join(self.images_base_dir, "combined_parameters_factorized_patches"),
+        ]
+        for factorized_dir in factorized_dirs:
+            if FactorizedPatchSet.exists(factorized_dir):
+                start_time = time.time()
+                self.factorized_set = FactorizedPatchSet(factorized_dir)
+                for param_key in self.factorized_set.keys():
+                    self.image_paths[param_key] = None
+                elapsed = time.time() - start_time
+                print(f"Indexed {len(self.image_paths)} factorized combinations from {factorized_dir} in {elapsed:.2f}s")
+                return True
+        return False
+
     def _parse_filename(self, filename):
         if filename.startswith('eye_face_'):
             name_part = filename.replace('eye_face_', '').replace('.png', '')
@@ -263,8 +374,57 @@ class UnifiedImageManager:
     def _create_sorted_keys(self):
         self.sorted_keys = sorted(list(self.image_paths.keys()))
         print(f"Created sorted key index with {len(self.sorted_keys)} entries")
+    
+    def infer_steps_config(self):
+        """패치 세트의 키별 단계 수 (실시간 렌더링을 기존 패치와 같은 값으로 맞추기 위함)"""
+        if self.factorized_set is not None:
+            return list(self.factorized_set.steps_config)
+        if not self.image_paths:
+            return list(DEFAULT_STEPS_CONFIG)
+        return [max(key[i] for key in self.image_paths) + 1 for i in range(len(DEFAULT_STEPS_CONFIG))]
+    
+    def infer_image_size(self):
+        """패치 이미지의 (너비, 높이). 알 수 없으면 None (실시간 렌더링 결과를 자르지 않음)."""
+        if self.factorized_set is not None and self.factorized_set.image_size:
+            return tuple(self.factorized_set.image_size)
+        for file_path in self.image_paths.values():
+            if file_path is None:
+                continue
+            try:
+                with Image.open(file_path) as img:
+                    return img.size
+            except OSError:
+                continue
+        return None
+    
+    def enable_live_rendering(self, live_renderer):
+        self.live_renderer = live_renderer
+    
+    def _collect_live_results(self):
+        """실시간 렌더링이 끝난 이미지를 캐시와 키 인덱스에 추가"""
+        for param_key, img, file_path in self.live_renderer.poll_results():
+            self.image_cache[param_key] = img
+            self.image_cache.move_to_end(param_key)
+            while len(self.image_cache) > self.max_cache_size:
+                oldest_key = next(iter(self.image_cache))
+                del self.image_cache[oldest_key]
+            # 디스크에 저장된 경우에만 인덱스에 등록 (캐시에서 밀려나도 다시 불러올 수 있도록)
+            if file_path is not None and param_key not in self.image_paths:
+                self.image_paths[param_key] = file_path
+                bisect.insort(self.sorted_keys, param_key)
+    
+    def get_hit_rate(self):
+        total = sum(self.match_counts.values())
+        return self.match_counts["EXACT MATCH"] / total if total > 0 else 0.0
         
     def get_best_avatar_image(self, mocap_data):
+        if self.live_renderer is not None:
+            self._collect_live_results()
+        img = self._get_best_avatar_image(mocap_data)
+        self.match_counts[self.last_search_method] += 1
+        return img
+        
+    def _get_best_avatar_image(self, mocap_data):
         head_rx = abs(mocap_data.get('head_rx', 0))
         head_ry = abs(mocap_data.get('head_ry', 0))
         head_rz = abs(mocap_data.get('head_rz', 0))
@@ -286,6 +446,10 @@ class UnifiedImageManager:
             self.last_avatar_image = img
             return img
         
+        # 정확한 패치가 없으면 렌더링을 요청하고, 끝날 때까지는 가장 가까운 패치를 보여줌
+        if self.live_renderer is not None:
+            self.live_renderer.request(param_key)
+        
         if self.fallback_search_enabled:
             best_match = self._find_sequential_best_match(param_key)
             if best_match:
@@ -532,7 +696,15 @@ class UnifiedImageManager:
         
         if param_key in self.image_paths:
             try:
-                img = Image.open(self.image_paths[param_key]).convert('RGBA')
+                if self.image_paths[param_key] is None:
+                    img = self.factorized_set.composite(param_key)
+                else:
+                    img = self.decoded_images.get(self.image_paths[param_key])
+                    if img is None:
+                        img = Image.open(self.image_paths[param_key]).convert('RGBA')
+                        self.decoded_images[self.image_paths[param_key]] = img
+                if img is None:
+                    return None
                 
                 self.image_cache[param_key] = img
                 self.image_cache.move_to_end(param_key)
@@ -570,11 +742,29 @@ class FixedOverlay(wx.Frame):
         self.frame_count = 0
         self.last_fps_time = time.time()
         self.fps = 0
+        # 타이머 콜백 처리 시간 (p99 표시용)
+        self.frame_times = deque(maxlen=600)
         
         # 데이터 수신 초기화
-        self.mocap_receiver = iFacialMocapReceiver()
+        self.mocap_receiver = iFacialMocapReceiver(
+            record_path=os.environ.get('VTUBER_RECORD_MOCAP'),
+            filter_method=os.environ.get('VTUBER_MOCAP_FILTER', 'one_euro'),
+            prediction_time=float(os.environ.get('VTUBER_MOCAP_PREDICTION_MS', '16')) / 1000.0)
         self.image_manager = UnifiedImageManager()
         
+        # 캐릭터 모델이 지정되면 빠진 키를 실시간 렌더링
+        self.live_renderer = None
+        character_model_path = os.environ.get('VTUBER_CHARACTER_MODEL')
+        if character_model_path:
+            self.live_renderer = LivePatchRenderer(
+                character_model_path,
+                steps_config=self.image_manager.infer_steps_config(),
+                save_dir=os.environ.get('VTUBER_LIVE_PATCH_DIR'),
+                device_name=os.environ.get('VTUBER_LIVE_DEVICE', 'cpu'),
+                image_size=self.image_manager.infer_image_size())
+            self.live_renderer.start()
+            self.image_manager.enable_live_rendering(self.live_renderer)
+        
         self.init_ui()
         
         # iFacialMocap 시작
@@ -669,6 +859,7 @@ class FixedOverlay(wx.Frame):
             self.Raise()
     
     def on_update_timer(self, event):
+        frame_start = time.perf_counter()
         # 모캡 데이터 받아서 아바타 업데이트
         mocap_data = self.mocap_receiver.get_latest_data()
         
@@ -679,6 +870,8 @@ class FixedOverlay(wx.Frame):
                 self.current_bitmap = None
                 self.avatar_panel.Refresh()
         
+        self.frame_times.append(time.perf_counter() - frame_start)
+        
         # FPS 계산
         self.frame_count += 1
         current_time = time.time()
@@ -688,7 +881,12 @@ class FixedOverlay(wx.Frame):
             self.last_fps_time = current_time
             
             # 상태 라벨 업데이트
-            self.status_label.SetLabel(f"VTuber Overlay - FPS: {self.fps:.1f}")
+            frame_times = sorted(self.frame_times)
+            p99_ms = frame_times[int(0.99 * (len(frame_times) - 1))] * 1000.0 if frame_times else 0.0
+            label = f"VTuber Overlay - FPS: {self.fps:.1f} | p99 {p99_ms:.1f}ms"
+            if self.live_renderer is not None:
+                label += f" | hit {self.image_manager.get_hit_rate() * 100:.0f}%"
+            self.status_label.SetLabel(label)
             self.status_label.Refresh()
     
     def on_paint_avatar(self, event):
@@ -760,6 +958,8 @@ class FixedOverlay(wx.Frame):
         self.update_timer.Stop()
         self.stay_top_timer.Stop()
         self.mocap_receiver.stop()
+        if self.live_renderer is not None:
+            self.live_renderer.stop()
         self.Destroy()
         
         # 앱 완전 종료
@@ -0,0 +1,240 @@
+"""
+생성된 패치 라이브러리의 중복 제거
+
+fmpm 그리드에는 눈에 보이는 결과가 같은 조합이 많다 (작은 값의 호흡, 머리카락에 가려진 눈썹 단계,
+눈을 감았을 때의 입 벌림 등). 이 모듈은 패치 폴더의 PNG를 디코딩한 RGBA로
+  1) 정확한 해시(sha256)로 같은 이미지를 묶고
+  2) 지각 해시(축소 이미지를 양자화한 값)가 같은 후보 중 모든 픽셀 차이가 tolerance 이하인 이미지를 묶어
+고유 이미지만 남기고, 파라미터 키 -> 이미지 파일의 별칭 표(aliases.json)를 쓴다.
+지각 해시는 비교 후보를 고르는 데만 쓰고 병합 여부는 항상 전체 픽셀로 판단하므로 오차는 tolerance를 넘지 않는다.
+
+오버레이(UnifiedImageManager)는 패치 폴더에 aliases.json이 있으면 PNG를 glob/파싱하지 않고 표를 읽으며,
+같은 파일을 가리키는 키들은 디코딩한 이미지 하나를 공유한다.
+
+사용법: python patch_dedup.py data/eye_face_optimized_patches [--tolerance 2] [--keep_duplicates]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+from PIL import Image
+
+ALIAS_FILE_NAME = "aliases.json"
+PATCH_FILE_PATTERNS = ["eye_face_*.png", "opt_*.png"]
+
+# 파일명의 파라미터 이름 -> 키 위치 (오버레이 _parse_filename과 같은 규칙)
+KEY_LABEL_POSITIONS = {
+    "LEB": 0, "EBL": 0,
+    "REB": 1, "EBR": 1,
+    "LEW": 2, "EWL": 2,
+    "REW": 3, "EWR": 3,
+    "MAA": 4, "JO": 4,
+    "HX": 5,
+    "HY": 6,
+    "NZ": 7, "BL": 7,
+}
+KEY_PART_PATTERN = re.compile(r"^([A-Z]+)(\d+)$")
+
+Key = Tuple[int, ...]
+
+
+def parse_patch_key(file_name: str) -> Optional[Key]:
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    for prefix in ("eye_face_", "opt_"):
+        if stem.startswith(prefix):
+            stem = stem[len(prefix):]
+    key = [None] * 8
+    for part in stem.split("_"):
+        match = KEY_PART_PATTERN.match(part)
+        if match is not None and match.group(1) in KEY_LABEL_POSITIONS:
+            key[KEY_LABEL_POSITIONS[match.group(1)]] = int(match.group(2))
+    if any(value is None for value in key):
+        return None
+    return tuple(key)
+
+
+def list_patch_files(patch_dir: str) -> List[str]:
+    files = []
+    for pattern in PATCH_FILE_PATTERNS:
+        files.extend(glob.glob(os.path.join(patch_dir, pattern)))
+    return sorted(files)
+
+
+def load_rgba(file_path: str) -> numpy.ndarray:
+    with Image.open(file_path) as image:
+        return numpy.asarray(image.convert("RGBA"))
+
+
+def perceptual_hash(image: numpy.ndarray, size: int = 16, quantum: int = 16) -> bytes:
+    """이미지를 size x size 블록 평균으로 줄이고 quantum 단위로 양자화 (RGBA 4채널)."""
+    height, width = image.shape[:2]
+    ys = numpy.linspace(0, height, size + 1).astype(numpy.int64)
+    xs = numpy.linspace(0, width, size + 1).astype(numpy.int64)
+    summed = numpy.add.reduceat(numpy.add.reduceat(image.astype(numpy.int64), ys[:-1], axis=0), xs[:-1], axis=1)
+    counts = numpy.outer(numpy.diff(ys), numpy.diff(xs))[:, :, None]
+    return (summed // counts // quantum).astype(numpy.uint8).tobytes() + bytes(str(image.shape), "ascii")
+
+
+def read_alias_table(patch_dir: str) -> Dict:
+    with open(os.path.join(patch_dir, ALIAS_FILE_NAME), "rt") as fin:
+        return json.load(fin)
+
+
+def write_alias_table(patch_dir: str, table: Dict):
+    file_path = os.path.join(patch_dir, ALIAS_FILE_NAME)
+    with open(file_path + ".tmp", "wt") as fout:
+        json.dump(table, fout)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def load_alias_paths(patch_dir: str) -> Dict[Key, str]:
+    """별칭 표 -> {키: 이미지 경로}. 오버레이가 glob 대신 사용."""
+    table = read_alias_table(patch_dir)
+    blob_paths = [os.path.join(patch_dir, name) for name in table["blobs"]]
+    return {tuple(entry[:8]): blob_paths[entry[8]] for entry in table["aliases"]}
+
+
+class PatchDeduplicator:
+    def __init__(self, patch_dir: str, tolerance: int = 2, num_threads: int = 8, max_cached_blobs: int = 64):
+        self.patch_dir = patch_dir
+        self.tolerance = tolerance
+        self.num_threads = num_threads
+        self.max_cached_blobs = max_cached_blobs
+        self.blob_cache = OrderedDict()
+
+    def _load_blob(self, file_path: str) -> numpy.ndarray:
+        if file_path in self.blob_cache:
+            self.blob_cache.move_to_end(file_path)
+            return self.blob_cache[file_path]
+        image = load_rgba(file_path)
+        self.blob_cache[file_path] = image
+        while len(self.blob_cache) > self.max_cached_blobs:
+            self.blob_cache.popitem(last=False)
+        return image
+
+    def _hash_file(self, file_path: str):
+        image = load_rgba(file_path)
+        exact_hash = hashlib.sha256(image.tobytes() + bytes(str(image.shape), "ascii")).hexdigest()
+        return exact_hash, perceptual_hash(image), image.nbytes
+
+    def deduplicate(self, remove_duplicates: bool = True, progress_func=None) -> Dict:
+        if os.path.isfile(os.path.join(self.patch_dir, ALIAS_FILE_NAME)):
+            # 이미 중복 파일을 지운 폴더를 다시 처리하면 지워진 키의 별칭이 사라짐
+            raise RuntimeError(f"{self.patch_dir} already has an alias table")
+        start_time = time.time()
+        index_start = time.time()
+        files = list_patch_files(self.patch_dir)
+        keyed_files = [(parse_patch_key(file_path), file_path) for file_path in files]
+        keyed_files = [(key, file_path) for key, file_path in keyed_files if key is not None]
+        glob_index_sec = time.time() - index_start
+
+        blobs: List[str] = []
+        blob_by_exact_hash: Dict[str, int] = {}
+        blobs_by_perceptual_hash: Dict[bytes, List[int]] = {}
+        aliases = []
+        num_exact = 0
+        num_perceptual = 0
+        image_bytes = 0
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            hashes = executor.map(self._hash_file, [file_path for _, file_path in keyed_files])
+            for index, ((key, file_path), (exact_hash, p_hash, nbytes)) in enumerate(zip(keyed_files, hashes)):
+                image_bytes = nbytes
+                blob_index = blob_by_exact_hash.get(exact_hash)
+                if blob_index is not None:
+                    num_exact += 1
+                elif self.tolerance > 0:
+                    image = None
+                    for candidate in blobs_by_perceptual_hash.get(p_hash, []):
+                        if image is None:
+                            image = self._load_blob(file_path)
+                        candidate_image = self._load_blob(os.path.join(self.patch_dir, blobs[candidate]))
+                        diff = numpy.abs(image.astype(numpy.int16) - candidate_image.astype(numpy.int16))
+                        if int(diff.max()) <= self.tolerance:
+                            blob_index = candidate
+                            blob_by_exact_hash[exact_hash] = candidate
+                            num_perceptual += 1
+                            break
+                if blob_index is None:
+                    blob_index = len(blobs)
+                    blobs.append(os.path.basename(file_path))
+                    blob_by_exact_hash[exact_hash] = blob_index
+                    blobs_by_perceptual_hash.setdefault(p_hash, []).append(blob_index)
+                aliases.append(list(key) + [blob_index])
+                if progress_func is not None:
+                    progress_func(index + 1, len(keyed_files))
+
+        write_alias_table(self.patch_dir, {
+            "version": 1,
+            "tolerance": self.tolerance,
+            "blobs": blobs,
+            "aliases": aliases,
+        })
+
+        num_removed = 0
+        if remove_duplicates:
+            blob_names = set(blobs)
+            for _, file_path in keyed_files:
+                if os.path.basename(file_path) not in blob_names:
+                    os.remove(file_path)
+                    num_removed += 1
+
+        alias_start = time.time()
+        load_alias_paths(self.patch_dir)
+        alias_index_sec = time.time() - alias_start
+
+        return {
+            "num_keys": len(aliases),
+            "num_blobs": len(blobs),
+            "num_exact_duplicates": num_exact,
+            "num_perceptual_duplicates": num_perceptual,
+            "num_removed_files": num_removed,
+            "dedup_ratio": len(aliases) / max(len(blobs), 1),
+            "glob_index_sec": glob_index_sec,
+            "alias_index_sec": alias_index_sec,
+            "decoded_bytes_all_keys": image_bytes * len(aliases),
+            "decoded_bytes_unique": image_bytes * len(blobs),
+            "elapsed_sec": time.time() - start_time,
+        }
+
+
+def format_report(stats: Dict) -> str:
+    mb = 1024 * 1024
+    return "\n".join([
+        f"Keys: {stats['num_keys']}  unique images: {stats['num_blobs']}  "
+        f"(exact duplicates {stats['num_exact_duplicates']}, perceptual {stats['num_perceptual_duplicates']})",
+        f"Dedup ratio: {stats['dedup_ratio']:.2f}x  removed files: {stats['num_removed_files']}",
+        f"Startup indexing: glob+parse {stats['glob_index_sec'] * 1000:.1f}ms -> "
+        f"alias table {stats['alias_index_sec'] * 1000:.1f}ms",
+        f"Decoded memory with every key resident: {stats['decoded_bytes_all_keys'] / mb:.0f}MB -> "
+        f"{stats['decoded_bytes_unique'] / mb:.0f}MB",
+        f"Elapsed: {stats['elapsed_sec']:.1f}s",
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicate a generated patch library and write an alias table.")
+    parser.add_argument("patch_dir", type=str, help="The folder with eye_face_*.png or opt_*.png patches.")
+    parser.add_argument("--tolerance", type=int, default=2,
+                        help="The largest per-channel difference (0-255) for two images to be merged. 0 merges only "
+                             "identical images.")
+    parser.add_argument("--num_threads", type=int, default=8, help="The number of decoding threads.")
+    parser.add_argument("--keep_duplicates", action="store_true",
+                        help="Write the alias table but keep the duplicate PNG files.")
+    args = parser.parse_args()
+
+    def print_progress(done, total):
+        if done % 500 == 0 or done == total:
+            print(f"  {done}/{total}")
+
+    deduplicator = PatchDeduplicator(args.patch_dir, args.tolerance, args.num_threads)
+    print(format_report(deduplicator.deduplicate(not args.keep_duplicates, print_progress)))
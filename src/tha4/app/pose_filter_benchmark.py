@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+녹화된 모캡 세션의 원본 값을 여러 필터로 다시 걸러 오버레이의 16ms 타이머 간격으로 샘플링하고,
+  - 떨림: 양자화된 패치 키가 초당 몇 번 바뀌는지 (전체 / 머리 HX·HY·NZ)
+  - 추가 지연: 필터 출력과 원본 값의 차이가 가장 작아지는 시간 이동 (채널별 중앙값, 음수면 예측이 앞섬)
+  - 필터 비용: filter() 호출당 시간
+을 비교한다. 기준은 필터 없음, 이전 방식(3샘플 평균), One-Euro(예측 없음/있음, 컷오프 배율별)이다.
+
+세션 녹화: VTUBER_RECORD_MOCAP=session.jsonl python overlay_window.py  (원본 값은 'raw' 항목에 기록됨)
+평가:     python pose_filter_benchmark.py session.jsonl
+"""
+
+import argparse
+import json
+import time
+
+import numpy
+
+try:
+    from tha4.app.overlay_window import UnifiedImageManager, create_mocap_filter
+except ImportError:
+    # 스크립트로 직접 실행될 때는 같은 폴더의 모듈 사용
+    from overlay_window import UnifiedImageManager, create_mocap_filter
+
+HEAD_KEY_POSITIONS = [5, 6, 7]
+MAX_LAG_TICKS = 15
+
+
+def load_raw_session(file_name):
+    records = []
+    num_without_raw = 0
+    with open(file_name, 'r', encoding='utf-8') as fin:
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'raw' in record:
+                records.append((record['t'], record['raw']))
+            else:
+                num_without_raw += 1
+                records.append((record['t'], record['data']))
+    records.sort(key=lambda record: record[0])
+    if num_without_raw > 0:
+        print(f"Warning: {num_without_raw} records have no raw values; their already smoothed values are used.")
+    return records
+
+
+def run_filter(records, mocap_filter, tick_sec, prediction_time):
+    """타이머 틱마다 그때까지 도착한 샘플을 필터에 넣고 틱 시각 + prediction_time의 예측값을 기록."""
+    session_start = records[0][0]
+    session_length = records[-1][0] - session_start
+    outputs = []
+    filter_times = []
+    record_index = 0
+    tick_time = 0.0
+    while tick_time <= session_length:
+        while record_index < len(records) and records[record_index][0] - session_start <= tick_time:
+            timestamp, raw_data = records[record_index]
+            start = time.perf_counter()
+            mocap_filter.filter(raw_data, timestamp - session_start)
+            filter_times.append(time.perf_counter() - start)
+            record_index += 1
+        outputs.append(mocap_filter.predict(tick_time + prediction_time))
+        tick_time += tick_sec
+    return outputs, filter_times
+
+
+def count_key_changes(keys, positions):
+    changes = 0
+    for previous, current in zip(keys, keys[1:]):
+        if any(previous[i] != current[i] for i in positions):
+            changes += 1
+    return changes
+
+
+def estimate_lag_ticks(reference, filtered):
+    """filtered[t]와 reference[t - lag]의 평균 제곱 오차가 가장 작은 lag (틱 단위)"""
+    best_lag = 0
+    best_error = None
+    for lag in range(-MAX_LAG_TICKS, MAX_LAG_TICKS + 1):
+        if lag >= 0:
+            a, b = filtered[lag:], reference[:len(reference) - lag]
+        else:
+            a, b = filtered[:lag], reference[-lag:]
+        if len(a) == 0:
+            continue
+        error = float(numpy.mean((a - b) ** 2))
+        if best_error is None or error < best_error:
+            best_error = error
+            best_lag = lag
+    return best_lag
+
+
+def evaluate(label, records, mocap_filter, image_manager, tick_sec, prediction_time, reference_outputs):
+    outputs, filter_times = run_filter(records, mocap_filter, tick_sec, prediction_time)
+    keys = [image_manager._convert_mocap_to_params(output) for output in outputs]
+    duration = len(outputs) * tick_sec
+
+    lags = []
+    for name in reference_outputs[-1].keys():
+        reference = numpy.array([output.get(name, 0.0) for output in reference_outputs])
+        if reference.std() < 1e-3:
+            continue
+        filtered = numpy.array([output.get(name, 0.0) for output in outputs])
+        lags.append(estimate_lag_ticks(reference, filtered))
+
+    key_changes = count_key_changes(keys, range(8)) / duration
+    head_changes = count_key_changes(keys, HEAD_KEY_POSITIONS) / duration
+    lag_ms = float(numpy.median(lags)) * tick_sec * 1000 if lags else 0.0
+    filter_us = float(numpy.mean(filter_times)) * 1e6 if filter_times else 0.0
+    print(f"{label:28s}{key_changes:9.2f}{head_changes:9.2f}{lag_ms:10.1f}{filter_us:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare mocap filters on a recorded session by patch key jitter '
+                                                 'and added latency.')
+    parser.add_argument('session', type=str, help='A JSON lines file recorded with VTUBER_RECORD_MOCAP.')
+    parser.add_argument('--data_path', type=str, default=None, help='The data directory (defaults to VTUBER_DATA_PATH).')
+    parser.add_argument('--tick_ms', type=float, default=16.0, help='The overlay timer interval.')
+    parser.add_argument('--prediction_ms', type=float, default=16.0,
+                        help='How far ahead the predicting One-Euro configuration extrapolates.')
+    args = parser.parse_args()
+
+    records = load_raw_session(args.session)
+    if len(records) < 2:
+        print("The session has too few records.")
+        return
+    tick_sec = args.tick_ms / 1000.0
+    prediction_time = args.prediction_ms / 1000.0
+    print(f"Session: {len(records)} records, {records[-1][0] - records[0][0]:.1f}s")
+
+    image_manager = UnifiedImageManager(args.data_path)
+    reference_outputs, _ = run_filter(records, create_mocap_filter('none'), tick_sec, 0.0)
+
+    print(f"{'':28s}{'key/s':>9s}{'head/s':>9s}{'lag ms':>10s}{'filter us':>10s}")
+    evaluate("none", records, create_mocap_filter('none'), image_manager, tick_sec, 0.0, reference_outputs)
+    evaluate("average (3 samples)", records, create_mocap_filter('average'), image_manager, tick_sec, 0.0,
+             reference_outputs)
+    for min_cutoff_scale in [0.5, 1.0, 2.0]:
+        evaluate(f"one-euro x{min_cutoff_scale}", records, create_mocap_filter('one_euro', min_cutoff_scale),
+                 image_manager, tick_sec, 0.0, reference_outputs)
+        evaluate(f"one-euro x{min_cutoff_scale} +{args.prediction_ms:.0f}ms", records,
+                 create_mocap_filter('one_euro', min_cutoff_scale), image_manager, tick_sec, prediction_time,
+                 reference_outputs)
+
+
+if __name__ == "__main__":
+    main()
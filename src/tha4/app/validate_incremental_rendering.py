@@ -0,0 +1,130 @@
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.getcwd())
+
+import torch
+
+from tha4.charmodel.character_model import CharacterModel
+from tha4.image_util import compute_image_difference_metrics
+from tha4.poser.modes.mode_14 import create_poser, KEY_FACE_MORPHER, KEY_BODY_MORPHER, \
+    IncrementalTwoStepPoserComputationProtocol, FACE_MORPHER_CATEGORIES
+from tha4.poser.modes.pose_parameters import get_pose_parameters
+
+
+def create_pose_sequence(num_frames: int,
+                         face_step: float,
+                         head_move_interval: int,
+                         head_step: float,
+                         seed: int) -> List[torch.Tensor]:
+    generator = torch.Generator().manual_seed(seed)
+    groups = get_pose_parameters().get_pose_parameter_groups()
+    num_parameters = sum(group.get_arity() for group in groups)
+
+    lower = torch.zeros(num_parameters)
+    upper = torch.zeros(num_parameters)
+    is_face = torch.zeros(num_parameters, dtype=torch.bool)
+    pose = torch.zeros(num_parameters)
+    for group in groups:
+        start = group.get_parameter_index()
+        end = start + group.get_arity()
+        lower[start:end] = group.get_range()[0]
+        upper[start:end] = group.get_range()[1]
+        is_face[start:end] = group.get_category() in FACE_MORPHER_CATEGORIES
+        pose[start:end] = group.get_default_value()
+
+    poses = []
+    for frame_index in range(num_frames):
+        step = (torch.rand(num_parameters, generator=generator) * 2.0 - 1.0)
+        if frame_index > 0 and frame_index % head_move_interval == 0:
+            pose = pose + torch.where(is_face, step * face_step, step * head_step)
+        else:
+            pose = pose + torch.where(is_face, step * face_step, torch.zeros_like(step))
+        pose = torch.maximum(torch.minimum(pose, upper), lower)
+        poses.append(pose.clone())
+    return poses
+
+
+def validate(character_model_file_name: str,
+             device: torch.device,
+             num_frames: int,
+             face_change_threshold: float,
+             face_step: float,
+             head_move_interval: int,
+             head_step: float,
+             seed: int):
+    character_model = CharacterModel.load(character_model_file_name)
+    module_file_names = {
+        KEY_FACE_MORPHER: character_model.face_morpher_file_name,
+        KEY_BODY_MORPHER: character_model.body_morpher_file_name,
+    }
+    full_poser = create_poser(device, dict(module_file_names))
+    protocol = IncrementalTwoStepPoserComputationProtocol(get_pose_parameters(), face_change_threshold)
+    incremental_poser = create_poser(device, dict(module_file_names), computation_protocol=protocol)
+    image = character_model.get_character_image(device)
+
+    def timed_pose(poser, pose):
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = poser.pose(image, pose)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        return output, time.perf_counter() - start
+
+    poses = create_pose_sequence(num_frames, face_step, head_move_interval, head_step, seed)
+    full_time = 0.0
+    incremental_time = 0.0
+    metrics = []
+    for pose in poses:
+        pose = pose.to(device)
+        expected, elapsed = timed_pose(full_poser, pose)
+        full_time += elapsed
+        actual, elapsed = timed_pose(incremental_poser, pose)
+        incremental_time += elapsed
+        metrics.append(compute_image_difference_metrics(expected, actual))
+
+    print(f"Frames: {num_frames}")
+    print(f"Full renders: {protocol.stats.num_full_renders}, "
+          f"face-only renders: {protocol.stats.num_face_only_renders} "
+          f"({protocol.stats.get_face_only_fraction() * 100.0:.1f}%)")
+    print(f"Average frame time: full = {full_time / num_frames * 1000.0:.2f} ms, "
+          f"incremental = {incremental_time / num_frames * 1000.0:.2f} ms")
+    for key in ["max_abs_error", "mean_abs_error", "changed_pixel_fraction"]:
+        values = [m[key] for m in metrics]
+        print(f"{key}: mean = {sum(values) / len(values):.5f}, max = {max(values):.5f}")
+    finite_psnr = [m["psnr"] for m in metrics if m["psnr"] != float("inf")]
+    if len(finite_psnr) > 0:
+        print(f"psnr (frames that differ): mean = {sum(finite_psnr) / len(finite_psnr):.2f} dB, "
+              f"min = {min(finite_psnr):.2f} dB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare incremental rendering against full rendering on a synthetic pose sequence.')
+    parser.add_argument("--character_model", type=str,
+                        default="data/character_models/lambda_00/character_model.yaml",
+                        help="The character model YAML file.")
+    parser.add_argument("--device", type=str, default="cpu", help="The device to render on.")
+    parser.add_argument("--num_frames", type=int, default=200, help="The number of frames to render.")
+    parser.add_argument("--face_change_threshold", type=float, default=0.1,
+                        help="The largest face parameter change that is rendered incrementally.")
+    parser.add_argument("--face_step", type=float, default=0.02,
+                        help="The largest per-frame change of a face parameter.")
+    parser.add_argument("--head_move_interval", type=int, default=30,
+                        help="The head, body and breathing parameters change once every this many frames.")
+    parser.add_argument("--head_step", type=float, default=0.1,
+                        help="The largest change of a head, body or breathing parameter.")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed of the pose sequence.")
+    args = parser.parse_args()
+    validate(
+        args.character_model,
+        torch.device(args.device),
+        args.num_frames,
+        args.face_change_threshold,
+        args.face_step,
+        args.head_move_interval,
+        args.head_step,
+        args.seed)
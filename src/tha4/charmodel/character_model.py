@@ -1,12 +1,15 @@
 import json
 import os.path
+from typing import Optional
 
 import PIL.Image
 import torch
 from omegaconf import OmegaConf
 
 from tha4.shion.base.image_util import extract_pytorch_image_from_PIL_image
-from tha4.poser.modes.mode_14 import create_poser, KEY_FACE_MORPHER, KEY_BODY_MORPHER
+from tha4.poser.modes.mode_14 import create_poser, KEY_FACE_MORPHER, KEY_BODY_MORPHER, \
+    IncrementalTwoStepPoserComputationProtocol, IncrementalRenderingStats
+from tha4.poser.modes.pose_parameters import get_pose_parameters
 
 
 class CharacterModel:
@@ -18,20 +21,39 @@ class CharacterModel:
         self.face_morpher_file_name = face_morpher_file_name
         self.character_image_file_name = character_image_file_name
         self.poser = None
+        self.computation_protocol = None
         self.character_image = None
 
-    def get_poser(self, device: torch.device):
+    def get_poser(self,
+                  device: torch.device,
+                  use_fused_siren: bool = False,
+                  compile_siren: bool = False,
+                  incremental_rendering: bool = False):
         if self.poser is not None:
             self.poser.to(device)
         else:
+            if incremental_rendering:
+                computation_protocol = IncrementalTwoStepPoserComputationProtocol(get_pose_parameters())
+            else:
+                computation_protocol = None
+            self.computation_protocol = computation_protocol
             self.poser = create_poser(
                 device,
                 module_file_names={
                     KEY_FACE_MORPHER: self.face_morpher_file_name,
                     KEY_BODY_MORPHER: self.body_morpher_file_name
-                })
+                },
+                use_fused_siren=use_fused_siren,
+                compile_siren=compile_siren,
+                computation_protocol=computation_protocol)
         return self.poser
 
+    def get_incremental_rendering_stats(self) -> Optional[IncrementalRenderingStats]:
+        if isinstance(self.computation_protocol, IncrementalTwoStepPoserComputationProtocol):
+            return self.computation_protocol.stats
+        else:
+            return None
+
     def get_character_image(self, device: torch.device):
         if self.character_image is None:
             pil_image = PIL.Image.open(self.character_image_file_name)
@@ -0,0 +1,260 @@
+import argparse
+import functools
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+from torch import Tensor
+from torch.nn import Module
+from torch.optim import Optimizer
+from torch.utils.data import Dataset
+
+from tha4.nn.siren.vanilla.siren import Siren, SirenArgs
+from tha4.shion.base.loss.l2_loss import L2Loss
+from tha4.shion.base.optimizer_factories import AdamOptimizerFactory
+from tha4.shion.core.cached_computation import ComputationState
+from tha4.shion.core.loss import Loss
+from tha4.shion.core.module_factory import ModuleFactory
+from tha4.shion.core.training.swarm.cpu_sweep_scheduler import CpuSweepScheduler, SweepTrial, \
+    QuantileStoppingRule, SweepTrialResult, TRIAL_FINISHED, TRIAL_STOPPED
+from tha4.shion.core.training.swarm.swarm_unit_trainer import SwarmUnitTrainer
+from tha4.shion.core.training.training_protocol import AbstractTrainingProtocol
+from tha4.shion.core.training.validation_protocol import AbstractValidationProtocol
+
+KEY_MODULE = "module"
+
+
+class SyntheticPoseImageDataset(Dataset):
+    # Pairs of a random pose vector and a small image that depends smoothly on it, standing in for the poser outputs
+    # that the real distillation trains on.
+    def __init__(self, num_examples: int, pose_size: int, image_size: int, seed: int):
+        generator = torch.Generator().manual_seed(seed)
+        target_generator = torch.Generator().manual_seed(0)
+        self.poses = torch.rand(num_examples, pose_size, generator=generator) * 2 - 1
+        frequencies = torch.randn(4, pose_size + 2, generator=target_generator) * 2
+        coordinates = get_coordinate_grid(image_size).reshape(2, -1)
+        pose_terms = self.poses @ frequencies[:, :pose_size].t()
+        coordinate_terms = frequencies[:, pose_size:] @ coordinates
+        self.images = torch.sin(pose_terms.unsqueeze(2) + coordinate_terms.unsqueeze(0)) \
+            .reshape(num_examples, 4, image_size, image_size)
+
+    def __len__(self):
+        return self.poses.shape[0]
+
+    def __getitem__(self, index: int):
+        return [self.poses[index], self.images[index]]
+
+
+def get_coordinate_grid(image_size: int) -> Tensor:
+    ticks = torch.linspace(-1.0, 1.0, image_size)
+    y, x = torch.meshgrid(ticks, ticks, indexing="ij")
+    return torch.stack([x, y], dim=0)
+
+
+class PoseImageSiren(Module):
+    # A SIREN that maps a pose and the pixel coordinates to the pixel's color, like the SIREN morpher levels.
+    def __init__(self, pose_size: int, image_size: int, intermediate_channels: int, num_sine_layers: int):
+        super().__init__()
+        self.image_size = image_size
+        self.siren = Siren(SirenArgs(
+            in_channels=pose_size + 2,
+            out_channels=4,
+            intermediate_channels=intermediate_channels,
+            num_sine_layers=num_sine_layers))
+        self.register_buffer("coordinates", get_coordinate_grid(image_size).unsqueeze(0), persistent=False)
+
+    def forward(self, pose: Tensor) -> Tensor:
+        n = pose.shape[0]
+        pose_image = pose.reshape(n, -1, 1, 1).expand(-1, -1, self.image_size, self.image_size)
+        return self.siren(torch.cat([pose_image, self.coordinates.expand(n, -1, -1, -1)], dim=1))
+
+
+class PoseImageSirenFactory(ModuleFactory):
+    def __init__(self, pose_size: int, image_size: int, intermediate_channels: int, num_sine_layers: int):
+        self.num_sine_layers = num_sine_layers
+        self.intermediate_channels = intermediate_channels
+        self.image_size = image_size
+        self.pose_size = pose_size
+
+    def create(self) -> Module:
+        return PoseImageSiren(self.pose_size, self.image_size, self.intermediate_channels, self.num_sine_layers)
+
+
+def create_computation_state(modules: Dict[str, Module], batch: List[Tensor]) -> ComputationState:
+    return ComputationState(modules=modules, accumulated_modules={}, batch=batch)
+
+
+def get_expected_image(state: ComputationState) -> Tensor:
+    return state.batch[1]
+
+
+def get_predicted_image(state: ComputationState) -> Tensor:
+    if "predicted_image" not in state.outputs:
+        state.outputs["predicted_image"] = state.modules[KEY_MODULE](state.batch[0])
+    return state.outputs["predicted_image"]
+
+
+class SirenRegressionTrainingProtocol(AbstractTrainingProtocol):
+    def run_training_iteration(
+            self,
+            batch: Any,
+            examples_seen_so_far: int,
+            modules: Dict[str, Module],
+            accumulated_modules: Dict[str, Module],
+            optimizers: Dict[str, Optimizer],
+            losses: Dict[str, Loss],
+            create_log_func: Optional[Callable[[str, int], Callable[[str, float], None]]],
+            device: torch.device):
+        module = modules[KEY_MODULE]
+        module.train(True)
+        optimizers[KEY_MODULE].zero_grad(set_to_none=True)
+        log_func = create_log_func("training", examples_seen_so_far) if create_log_func is not None else None
+        loss = losses[KEY_MODULE].compute(create_computation_state(modules, batch), log_func)
+        loss.backward()
+        optimizers[KEY_MODULE].step()
+
+
+class SirenRegressionValidationProtocol(AbstractValidationProtocol):
+    def run_validation_iteration(
+            self,
+            batch: Any,
+            examples_seen_so_far: int,
+            modules: Dict[str, Module],
+            accumulated_modules: Dict[str, Module],
+            losses: Dict[str, Loss],
+            create_log_func: Callable[[str, int], Callable[[str, float], None]],
+            device: torch.device):
+        module = modules[KEY_MODULE]
+        module.train(False)
+        log_func = create_log_func("validation", examples_seen_so_far) if create_log_func is not None else None
+        with torch.no_grad():
+            losses[KEY_MODULE].compute(create_computation_state(modules, batch), log_func)
+
+
+class ConstantLearningRate:
+    def __init__(self, learning_rate: float):
+        self.learning_rate = learning_rate
+
+    def __call__(self, examples_seen_so_far: int) -> Dict[str, float]:
+        return {KEY_MODULE: self.learning_rate}
+
+
+def create_trial_trainer(prefix: str,
+                         learning_rate: float,
+                         intermediate_channels: int,
+                         num_sine_layers: int,
+                         num_checkpoints: int,
+                         examples_per_checkpoint: int,
+                         batch_size: int = 8,
+                         pose_size: int = 8,
+                         image_size: int = 32) -> SwarmUnitTrainer:
+    return SwarmUnitTrainer(
+        prefix=prefix,
+        module_factories={
+            KEY_MODULE: PoseImageSirenFactory(pose_size, image_size, intermediate_channels, num_sine_layers),
+        },
+        accumulators={},
+        losses={
+            KEY_MODULE: L2Loss(expected_func=get_expected_image, actual_func=get_predicted_image),
+        },
+        training_dataset=SyntheticPoseImageDataset(4096, pose_size, image_size, seed=1),
+        validation_dataset=SyntheticPoseImageDataset(512, pose_size, image_size, seed=2),
+        training_protocol=SirenRegressionTrainingProtocol(
+            check_point_examples=[examples_per_checkpoint * (i + 1) for i in range(num_checkpoints)],
+            batch_size=batch_size,
+            learning_rate=ConstantLearningRate(learning_rate),
+            optimizer_factories={KEY_MODULE: AdamOptimizerFactory(betas=(0.9, 0.999))},
+            random_seed=2965603729),
+        validation_protocol=SirenRegressionValidationProtocol(
+            example_per_validation_iteration=examples_per_checkpoint // 4,
+            batch_size=64),
+        sample_output_protocol=None,
+        pretrained_module_file_names={},
+        example_per_snapshot=examples_per_checkpoint,
+        num_data_loader_workers=0)
+
+
+def create_trials(output_dir: str, num_checkpoints: int, examples_per_checkpoint: int) -> List[SweepTrial]:
+    trials = []
+    for learning_rate in [1e-5, 1e-4, 1e-3, 1e-2]:
+        for intermediate_channels in [16, 32]:
+            for num_sine_layers in [2, 3]:
+                name = f"lr{learning_rate:g}_c{intermediate_channels}_l{num_sine_layers}"
+                trials.append(SweepTrial(name, functools.partial(
+                    create_trial_trainer,
+                    os.path.join(output_dir, name),
+                    learning_rate,
+                    intermediate_channels,
+                    num_sine_layers,
+                    num_checkpoints,
+                    examples_per_checkpoint)))
+    return trials
+
+
+def print_report(label: str, results: List[SweepTrialResult], elapsed_time: float):
+    num_finished = sum(1 for result in results if result.status == TRIAL_FINISHED)
+    num_stopped = sum(1 for result in results if result.status == TRIAL_STOPPED)
+    num_failed = len(results) - num_finished - num_stopped
+    completed = [result for result in results if result.status == TRIAL_FINISHED]
+    print(f"[{label}] {elapsed_time:.1f} s, {num_finished / elapsed_time * 3600:.0f} completed trials/hour, "
+          f"{(num_finished + num_stopped) / elapsed_time * 3600:.0f} completed or stopped trials/hour "
+          f"({num_finished} finished, {num_stopped} stopped early, {num_failed} failed)")
+    if len(completed) > 0:
+        best = min(completed, key=lambda result: result.get_last_loss() or math.inf)
+        print(f"  best: {best.name}, validation loss {best.get_last_loss():.6f}")
+    for result in results:
+        if result.error is not None:
+            print(f"  {result.name} failed: {result.error}")
+
+
+def run_sweep(label: str,
+              num_checkpoints: int,
+              examples_per_checkpoint: int,
+              total_threads: int,
+              threads_per_trial: int,
+              stopping_rule: Optional[QuantileStoppingRule]):
+    output_dir = tempfile.mkdtemp(prefix="cpu_sweep_")
+    try:
+        scheduler = CpuSweepScheduler(
+            create_trials(output_dir, num_checkpoints, examples_per_checkpoint),
+            total_threads=total_threads,
+            threads_per_trial=threads_per_trial,
+            stopping_rule=stopping_rule)
+        start_time = time.time()
+        results = scheduler.run()
+        print_report(label, results, time.time() - start_time)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run a sweep of tiny SIREN trials on a synthetic dataset one by one and with the CPU sweep '
+                    'scheduler, and report trials finished per hour.')
+    parser.add_argument("--total_threads", type=int, default=os.cpu_count(), help="The number of threads to use.")
+    parser.add_argument("--threads_per_trial", type=int, default=1, help="The thread budget of each packed trial.")
+    parser.add_argument("--num_checkpoints", type=int, default=4, help="The number of checkpoints of each trial.")
+    parser.add_argument("--examples_per_checkpoint", type=int, default=2048,
+                        help="The number of training examples between checkpoints.")
+    parser.add_argument("--quantile", type=float, default=0.5,
+                        help="Trials whose validation loss is above this quantile at a checkpoint are stopped.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    run_sweep("one by one", args.num_checkpoints, args.examples_per_checkpoint,
+              total_threads=args.total_threads,
+              threads_per_trial=args.total_threads,
+              stopping_rule=None)
+    run_sweep("packed", args.num_checkpoints, args.examples_per_checkpoint,
+              total_threads=args.total_threads,
+              threads_per_trial=args.threads_per_trial,
+              stopping_rule=None)
+    run_sweep("packed + early stopping", args.num_checkpoints, args.examples_per_checkpoint,
+              total_threads=args.total_threads,
+              threads_per_trial=args.threads_per_trial,
+              stopping_rule=QuantileStoppingRule(quantile=args.quantile))
@@ -8,12 +8,22 @@ from omegaconf import OmegaConf
 from tha4.charmodel.character_model import CharacterModel
 from tha4.pytasuku.workspace import Workspace, file_task
 from tha4.distiller.config_based_training_tasks import define_standalone_config_based_training_tasks
+from tha4.nn.siren.face_morpher.face_mask_cache import load_face_mask_array, load_or_create_face_mask_cache
 from tha4.nn.siren.face_morpher.siren_face_morpher_00_trainer import SirenFaceMorpher00TrainerArgs
 from tha4.nn.siren.morpher.siren_morpher_03_trainer import SirenMorpher03TrainerArgs, TrainingPhases, TrainingPhase, \
     LossWeights, LossTerm
+from tha4.shion.base.dataset.mmap_tensor_dataset import convert_torch_file_to_mmap_tensor_file
 from tha4.shion.base.image_util import pil_image_has_transparency
 
 POSE_DATASET_FILE_NAME = 'data/pose_dataset.pt'
+POSE_DATASET_MMAP_FILE_NAME = 'data/pose_dataset.mmap'
+
+
+def get_pose_dataset_file_name():
+    if os.path.isfile(POSE_DATASET_MMAP_FILE_NAME):
+        return POSE_DATASET_MMAP_FILE_NAME
+    else:
+        return POSE_DATASET_FILE_NAME
 
 
 def copy_file(source_file_name: str, dest_file_name):
@@ -40,10 +50,13 @@ class DistillerConfig:
     num_cpu_workers: int = 1
     num_gpus: int = 1
 
+    render_sample_outputs_in_background: bool = False
+
     def check(self):
         DistillerConfig.check_prefix(self.prefix)
         DistillerConfig.check_character_image_file_name(self.character_image_file_name)
-        DistillerConfig.check_face_mask_image_file_name(self.face_mask_image_file_name)
+        DistillerConfig.check_face_mask_image_file_name(
+            self.face_mask_image_file_name, self.face_mask_cache_file_name())
 
         DistillerConfig.check_num_cpu_workers(self.num_cpu_workers)
         DistillerConfig.check_num_gpus(self.num_gpus)
@@ -80,22 +93,17 @@ class DistillerConfig:
         image.close()
 
     @staticmethod
-    def check_face_mask_image_file_name(file_name):
+    def check_face_mask_image_file_name(file_name, cache_file_name: Optional[str] = None):
         _, ext = os.path.splitext(file_name)
         assert os.path.isfile(file_name), \
             f"The specified face mask image file name, {file_name}, does not point to a file."
         assert ext.lower() == ".png", "The face mask image file name must have extension '.png'."
 
-        image = PIL.Image.open(file_name)
-        assert image.width == 512 and image.height == 512, "The face mask image must be 512x512."
-        assert image.mode == "RGB", "The face mask image must be an RGB image."
-        for x in range(512):
-            for y in range(512):
-                r, g, b = image.getpixel((x, y))
-                assert (r == 0) or (r == 255), "The R channel of the face mask image must be 0 or 255"
-                assert (g == 0) or (g == 255), "The G channel of the face mask image must be 0 or 255"
-                assert (b == 0) or (b == 255), "The B channel of the face mask image must be 0 or 255"
-        image.close()
+        if cache_file_name is None:
+            load_face_mask_array(file_name)
+        else:
+            # Validating the mask also produces the cached crop, which is reused until the mask file changes.
+            load_or_create_face_mask_cache(file_name, cache_file_name)
 
     @staticmethod
     def check_batch_size(value, field_name: str):
@@ -142,6 +150,9 @@ class DistillerConfig:
         args.check()
         return args
 
+    def face_mask_cache_file_name(self):
+        return f"{self.prefix}/face_mask_cache.pt"
+
     def face_morpher_prefix(self):
         return f"{self.prefix}/face_morpher"
 
@@ -151,12 +162,14 @@ class DistillerConfig:
         args = SirenFaceMorpher00TrainerArgs(
             character_file_name=self.character_image_file_name,
             face_mask_file_name=self.face_mask_image_file_name,
-            pose_dataset_file_name=POSE_DATASET_FILE_NAME,
+            face_mask_cache_file_name=self.face_mask_cache_file_name(),
+            pose_dataset_file_name=get_pose_dataset_file_name(),
             total_worker=self.num_cpu_workers,
             num_training_examples_per_sample_output=self.face_morpher_num_training_examples_per_sample_output,
             total_batch_size=self.face_morpher_batch_size,
             training_random_seed=self.face_morpher_random_seed_0,
-            sample_output_random_seed=self.face_morpher_random_seed_1)
+            sample_output_random_seed=self.face_morpher_random_seed_1,
+            render_sample_outputs_in_background=self.render_sample_outputs_in_background)
         return args.create_trainer(self.face_morpher_prefix(), world_size, backend)
 
     def body_morpher_prefix(self):
@@ -167,13 +180,14 @@ class DistillerConfig:
             world_size = self.num_gpus
         args = SirenMorpher03TrainerArgs(
             character_file_name=self.character_image_file_name,
-            pose_dataset_file_name=POSE_DATASET_FILE_NAME,
+            pose_dataset_file_name=get_pose_dataset_file_name(),
             total_worker=self.num_cpu_workers,
             num_training_examples_per_sample_output=self.body_morpher_num_training_examples_per_sample_output,
             training_random_seed=self.body_morpher_random_seed_0,
             sample_output_random_seed=self.body_morpher_random_seed_1,
             total_batch_size=self.body_morpher_batch_size,
             sample_output_batch_size=1,
+            render_sample_outputs_in_background=self.render_sample_outputs_in_background,
             training_phases=TrainingPhases([
                 TrainingPhase(
                     num_examples_upper_bound=200_000,
@@ -250,6 +264,12 @@ class DistillerConfig:
     def define_tasks(self, workspace: Workspace):
         workspace.create_file_task(self.config_yaml_file_name(), [], self.create_config_yaml_file)
 
+        # The training scripts are separate processes that pick the memory-mapped pose dataset up once it exists.
+        # It is deliberately not a dependency of the checkpoint files so that converting it does not retrigger training.
+        @file_task(workspace, POSE_DATASET_MMAP_FILE_NAME, [POSE_DATASET_FILE_NAME])
+        def create_pose_dataset_mmap_file():
+            convert_torch_file_to_mmap_tensor_file(POSE_DATASET_FILE_NAME, POSE_DATASET_MMAP_FILE_NAME)
+
         define_standalone_config_based_training_tasks(
             workspace,
             self.get_face_morpher_trainer,
@@ -301,6 +321,7 @@ class DistillerConfig:
         workspace.create_command_task(
             f"{self.prefix}/all",
             [
+                POSE_DATASET_MMAP_FILE_NAME,
                 f"{self.face_morpher_prefix()}/train_standalone",
                 f"{self.body_morpher_prefix()}/train_standalone",
                 self.character_model_character_png_file_name(),
@@ -0,0 +1,99 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import PIL.Image
+import numpy
+import torch
+from torch.utils.data import default_collate
+
+from tha4.nn.siren.face_morpher.face_mask_cache import load_face_mask_array, load_or_create_face_mask_cache
+from tha4.nn.siren.face_morpher.siren_face_morpher_00_trainer import SirenFaceMorpher00TrainerArgs
+
+
+def check_face_mask_with_getpixel(file_name: str):
+    # The validation DistillerConfig used to do, kept here as the baseline.
+    image = PIL.Image.open(file_name)
+    assert image.width == 512 and image.height == 512
+    assert image.mode == "RGB"
+    for x in range(512):
+        for y in range(512):
+            r, g, b = image.getpixel((x, y))
+            assert (r == 0) or (r == 255)
+            assert (g == 0) or (g == 255)
+            assert (b == 0) or (b == 255)
+    image.close()
+
+
+def create_synthetic_face_mask(file_name: str):
+    mask = numpy.zeros((512, 512, 3), dtype=numpy.uint8)
+    mask[100:140, 200:240, :] = 255
+    mask[100:140, 272:312, :] = 255
+    mask[160:190, 230:282, :] = 255
+    PIL.Image.fromarray(mask, "RGB").save(file_name)
+
+
+def time_call(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_face_mask(face_mask_file_name: str, repeat: int, batch_size: int):
+    work_dir = tempfile.mkdtemp(prefix="face_mask_benchmark_")
+    try:
+        cache_file_name = os.path.join(work_dir, "face_mask_cache.pt")
+
+        def create_args(use_cache: bool):
+            return SirenFaceMorpher00TrainerArgs(
+                character_file_name="",
+                face_mask_file_name=face_mask_file_name,
+                pose_dataset_file_name="",
+                face_mask_cache_file_name=cache_file_name if use_cache else None)
+
+        legacy_args = create_args(False)
+        cached_args = create_args(True)
+        legacy_crop = legacy_args.get_face_mask_image()
+        cached_crop = cached_args.get_face_mask_image()
+        print(f"Max difference between the legacy and cached crops: {(legacy_crop - cached_crop).abs().max().item()}")
+
+        print("Config load (face mask validation):")
+        print(f"  getpixel loop       {time_call(lambda: check_face_mask_with_getpixel(face_mask_file_name), 1) * 1000:9.2f} ms")
+        print(f"  numpy               {time_call(lambda: load_face_mask_array(face_mask_file_name), repeat) * 1000:9.2f} ms")
+        print(f"  numpy + cache hit   "
+              f"{time_call(lambda: load_or_create_face_mask_cache(face_mask_file_name, cache_file_name), repeat) * 1000:9.2f} ms")
+
+        print("Face mask tensor per data loader worker:")
+        print(f"  decode PNG + crop   {time_call(legacy_args.get_face_mask_image, repeat) * 1000:9.2f} ms")
+        print(f"  cached tensor       {time_call(cached_args.get_face_mask_image, repeat) * 1000:9.2f} ms")
+
+        # ImagePosesAndOtherImagesDataset already keeps the mask it loaded, so what is left per step is collating the
+        # batch; it is the same with and without the cache.
+        print(f"Face mask per training step (batch size {batch_size}):")
+        print(f"  collate             {time_call(lambda: default_collate([cached_crop] * batch_size), repeat) * 1000:9.3f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time face mask validation and preprocessing, before and after caching.')
+    parser.add_argument("--face_mask", type=str, default=None,
+                        help="A 512x512 face mask PNG. A synthetic mask is used when it is not given.")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to time each operation.")
+    parser.add_argument("--batch_size", type=int, default=8, help="The training batch size.")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    if args.face_mask is not None:
+        benchmark_face_mask(args.face_mask, args.repeat, args.batch_size)
+    else:
+        mask_dir = tempfile.mkdtemp(prefix="face_mask_")
+        try:
+            mask_file_name = os.path.join(mask_dir, "face_mask.png")
+            create_synthetic_face_mask(mask_file_name)
+            benchmark_face_mask(mask_file_name, args.repeat, args.batch_size)
+        finally:
+            shutil.rmtree(mask_dir, ignore_errors=True)
@@ -0,0 +1,189 @@
+import argparse
+import functools
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import torch
+from torch.nn import Module
+from torch.utils.data import Dataset
+
+from tha4.distiller.cpu_sweep_benchmark import KEY_MODULE, PoseImageSirenFactory, SyntheticPoseImageDataset, \
+    SirenRegressionTrainingProtocol, ConstantLearningRate, get_expected_image, get_predicted_image
+from tha4.shion.base.image_util import convert_pytorch_image_to_zero_to_one_numpy_image, save_numpy_image
+from tha4.shion.base.loss.l2_loss import L2Loss
+from tha4.shion.base.optimizer_factories import AdamOptimizerFactory
+from tha4.shion.core.training.distrib.device_mapper import CpuDeviceMapper
+from tha4.shion.core.training.sample_output_protocol import AbstractSampleOutputProtocol
+from tha4.shion.core.training.swarm.swarm_unit_trainer import SwarmUnitTrainer
+
+
+class TimedTrainingProtocol(SirenRegressionTrainingProtocol):
+    # Records when each training iteration starts, so that the time between two starts covers everything the trainer
+    # did after the first iteration, including saving sample outputs.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.iteration_starts = []
+
+    def run_training_iteration(self, batch: Any, examples_seen_so_far: int, *args, **kwargs):
+        self.iteration_starts.append((examples_seen_so_far, time.perf_counter()))
+        super().run_training_iteration(batch, examples_seen_so_far, *args, **kwargs)
+
+
+class PoseImageSampleOutputProtocol(AbstractSampleOutputProtocol):
+    # Renders a few poses of the validation dataset and saves them as a PNG grid next to the expected images, like the
+    # SIREN morpher protocols do.
+    def __init__(self, examples_per_sample_output: int, random_seed: int, num_images: int, images_per_row: int):
+        super().__init__(examples_per_sample_output, random_seed)
+        self.images_per_row = images_per_row
+        self.num_images = num_images
+
+    def get_sample_output_data(self, validation_dataset: Dataset, device: torch.device) -> dict:
+        example_indices = torch.randint(0, len(validation_dataset), (self.num_images,)).tolist()
+        examples = [validation_dataset[index] for index in example_indices]
+        return {
+            'poses': torch.stack([example[0] for example in examples]).to(device),
+            'images': torch.stack([example[1] for example in examples]).to(device),
+        }
+
+    def save_sample_output_data(self,
+                                modules: Dict[str, Module],
+                                accumulated_modules: Dict[str, Module],
+                                sample_output_data: Any,
+                                prefix: str,
+                                examples_seen_so_far: int,
+                                device: torch.device):
+        module = modules[KEY_MODULE]
+        module.train(False)
+        with torch.no_grad():
+            predicted_images = module(sample_output_data['poses']).clamp(-1.0, 1.0).cpu()
+        expected_images = sample_output_data['images'].cpu()
+
+        num_rows = (self.num_images + self.images_per_row - 1) // self.images_per_row
+        image_size = expected_images.shape[2]
+        grid = torch.zeros(4, num_rows * image_size, 2 * self.images_per_row * image_size)
+        for i in range(self.num_images):
+            row = i // self.images_per_row
+            col = 2 * (i % self.images_per_row)
+            top = row * image_size
+            left = col * image_size
+            grid[:, top:top + image_size, left:left + image_size] = expected_images[i]
+            grid[:, top:top + image_size, left + image_size:left + 2 * image_size] = predicted_images[i]
+        file_name = "%s/sample_output_%010d.png" % (prefix, examples_seen_so_far)
+        save_numpy_image(
+            convert_pytorch_image_to_zero_to_one_numpy_image(grid),
+            file_name,
+            save_straight_alpha=False,
+            perform_linear_to_srgb=False)
+
+
+def create_sample_output_protocol(examples_per_sample_output: int, num_images: int) -> PoseImageSampleOutputProtocol:
+    return PoseImageSampleOutputProtocol(
+        examples_per_sample_output=examples_per_sample_output,
+        random_seed=3522651501,
+        num_images=num_images,
+        images_per_row=4)
+
+
+def create_trainer(prefix: str,
+                   background: bool,
+                   num_examples: int,
+                   examples_per_sample_output: int,
+                   num_sample_images: int,
+                   image_size: int,
+                   intermediate_channels: int,
+                   batch_size: int = 8,
+                   pose_size: int = 8) -> SwarmUnitTrainer:
+    sample_output_protocol_func = functools.partial(
+        create_sample_output_protocol, examples_per_sample_output, num_sample_images)
+    return SwarmUnitTrainer(
+        prefix=prefix,
+        module_factories={
+            KEY_MODULE: PoseImageSirenFactory(pose_size, image_size, intermediate_channels, num_sine_layers=3),
+        },
+        accumulators={},
+        losses={
+            KEY_MODULE: L2Loss(expected_func=get_expected_image, actual_func=get_predicted_image),
+        },
+        training_dataset=SyntheticPoseImageDataset(1024, pose_size, image_size, seed=1),
+        validation_dataset=SyntheticPoseImageDataset(64, pose_size, image_size, seed=2),
+        training_protocol=TimedTrainingProtocol(
+            check_point_examples=[num_examples],
+            batch_size=batch_size,
+            learning_rate=ConstantLearningRate(1e-4),
+            optimizer_factories={KEY_MODULE: AdamOptimizerFactory(betas=(0.9, 0.999))},
+            random_seed=2965603729),
+        validation_protocol=None,
+        sample_output_protocol=sample_output_protocol_func(),
+        pretrained_module_file_names={},
+        example_per_snapshot=num_examples,
+        num_data_loader_workers=0,
+        sample_output_protocol_func=sample_output_protocol_func if background else None)
+
+
+def get_step_times(iteration_starts: List, batch_size: int, examples_per_sample_output: int):
+    # Splits the times between consecutive iteration starts into ordinary steps and steps that saved a sample output.
+    steady_times = []
+    sample_output_times = []
+    for (examples, start), (_, next_start) in zip(iteration_starts, iteration_starts[1:]):
+        if (examples + batch_size) // examples_per_sample_output > examples // examples_per_sample_output:
+            sample_output_times.append(next_start - start)
+        else:
+            steady_times.append(next_start - start)
+    return steady_times, sample_output_times
+
+
+def run(label: str, background: bool, args) -> float:
+    output_dir = tempfile.mkdtemp(prefix="sample_output_benchmark_")
+    try:
+        trainer = create_trainer(
+            output_dir,
+            background,
+            args.num_examples,
+            args.examples_per_sample_output,
+            args.num_sample_images,
+            args.image_size,
+            args.intermediate_channels)
+        start_time = time.time()
+        trainer.train(0, 0, device_mapper=CpuDeviceMapper())
+        elapsed_time = time.time() - start_time
+        num_sample_outputs = len(os.listdir(output_dir + "/sample_outputs"))
+
+        training_protocol = trainer.training_protocol
+        steady_times, sample_output_times = get_step_times(
+            training_protocol.iteration_starts, training_protocol.get_batch_size(), args.examples_per_sample_output)
+        steady_time = statistics.median(steady_times)
+        sample_output_time = statistics.median(sample_output_times) if len(sample_output_times) > 0 else steady_time
+        print(f"[{label}] {elapsed_time:.1f} s, {args.num_examples / elapsed_time:.1f} examples/s, "
+              f"{num_sample_outputs} sample outputs saved")
+        print(f"  iteration: {steady_time * 1000:.1f} ms, at sample output: {sample_output_time * 1000:.1f} ms, "
+              f"stall per sample output: {(sample_output_time - steady_time) * 1000:.1f} ms")
+        worker = trainer.sample_output_worker
+        if worker is not None:
+            print(f"  {worker.num_submitted} submitted, {worker.num_dropped} dropped, "
+                  f"{worker.total_submit_time / max(worker.num_submitted, 1) * 1000:.1f} ms per submit")
+        return elapsed_time
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Train a small SIREN on a synthetic dataset with sample outputs saved in the training loop and in '
+                    'a background worker, and report how long training stalls for each sample output.')
+    parser.add_argument("--num_examples", type=int, default=8192, help="The number of training examples.")
+    parser.add_argument("--examples_per_sample_output", type=int, default=512,
+                        help="The number of training examples between sample outputs.")
+    parser.add_argument("--num_sample_images", type=int, default=16, help="The number of images in a sample output.")
+    parser.add_argument("--image_size", type=int, default=64, help="The width and height of the images.")
+    parser.add_argument("--intermediate_channels", type=int, default=64, help="The width of the SIREN.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    inline_time = run("inline", False, args)
+    background_time = run("background worker", True, args)
+    print(f"Speedup: {inline_time / background_time:.2f}x")
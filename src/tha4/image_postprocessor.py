@@ -0,0 +1,94 @@
+from typing import Optional, Sequence
+
+import numpy
+import torch
+from torch import Tensor
+
+from tha4.shion.base.image_util import torch_linear_to_srgb
+
+
+# Turns a poser output (a linear RGBA image with values in [min_pixel_value, max_pixel_value], in the CHW layout) into a
+# display-ready HWC uint8 sRGB image. Range mapping, linear-to-sRGB conversion, background compositing and packing all
+# run on the render device, and only the final uint8 image is copied to the host.
+#
+# The linear-to-sRGB curve is evaluated with a lookup table and linear interpolation, which is within 0.05 of a uint8
+# level of the exact curve for the default table size.
+#
+# The returned array is a view of a buffer that is reused by the next call to process(). Copy it if it has to outlive
+# the next frame.
+class DisplayImagePostprocessor:
+    def __init__(self,
+                 device: torch.device,
+                 min_pixel_value: float = -1.0,
+                 max_pixel_value: float = 1.0,
+                 lut_size: int = 4096,
+                 use_pinned_memory: bool = True):
+        assert lut_size >= 2
+        self.device = device
+        self.min_pixel_value = min_pixel_value
+        self.max_pixel_value = max_pixel_value
+        self.lut_size = lut_size
+        self.use_pinned_memory = use_pinned_memory \
+                                 and device.type == "cuda" \
+                                 and torch.cuda.is_available()
+
+        self.lut = (torch_linear_to_srgb(torch.linspace(0.0, 1.0, lut_size + 1, dtype=torch.float64)) * 255.0) \
+            .float().to(device)
+        self.device_buffer = None
+        self.host_buffer = None
+
+    def get_buffers(self, height: int, width: int):
+        if self.host_buffer is None or self.host_buffer.shape[0] != height or self.host_buffer.shape[1] != width:
+            if self.device.type == "cpu":
+                self.device_buffer = None
+            else:
+                self.device_buffer = torch.empty(height, width, 4, dtype=torch.uint8, device=self.device)
+            self.host_buffer = torch.empty(height, width, 4, dtype=torch.uint8, pin_memory=self.use_pinned_memory)
+        return self.device_buffer, self.host_buffer
+
+    def linear_to_srgb_255(self, x: Tensor) -> Tensor:
+        scaled = x * self.lut_size
+        index = torch.clamp(scaled.floor(), 0, self.lut_size - 1)
+        fraction = scaled - index
+        index = index.long()
+        return torch.lerp(self.lut[index], self.lut[index + 1], fraction)
+
+    def process(self, image: Tensor, background: Optional[Sequence[float]] = None) -> numpy.ndarray:
+        """
+        :param image: a CHW image with 3 or 4 channels
+        :param background: an sRGB color with components in [0, 1] to composite the image onto, or None to keep the
+            alpha channel
+        :return: an HWC uint8 RGBA image
+        """
+        if image.dim() == 4:
+            assert image.shape[0] == 1
+            image = image[0]
+        assert image.shape[0] == 3 or image.shape[0] == 4
+        image = image.to(self.device)
+        _, height, width = image.shape
+        device_buffer, host_buffer = self.get_buffers(height, width)
+
+        with torch.no_grad():
+            image = (image.float() - self.min_pixel_value) / (self.max_pixel_value - self.min_pixel_value)
+            image = torch.clamp(image, 0.0, 1.0)
+            rgb = self.linear_to_srgb_255(image[0:3])
+            if image.shape[0] == 4:
+                alpha = image[3:4]
+            else:
+                alpha = torch.ones_like(image[0:1])
+            if background is not None:
+                background_rgb = torch.tensor(background, dtype=torch.float, device=self.device).view(3, 1, 1) * 255.0
+                rgb = rgb * alpha + background_rgb * (1.0 - alpha)
+                alpha = torch.ones_like(alpha)
+            rgba = torch.cat([rgb, alpha * 255.0], dim=0)
+            rgba = torch.round(rgba).permute(1, 2, 0)
+
+            if device_buffer is None:
+                host_buffer.copy_(rgba)
+            else:
+                device_buffer.copy_(rgba)
+                host_buffer.copy_(device_buffer, non_blocking=self.use_pinned_memory)
+                if self.use_pinned_memory:
+                    torch.cuda.current_stream(self.device).synchronize()
+
+        return host_buffer.numpy()
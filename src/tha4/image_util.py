@@ -3,7 +3,6 @@ import math
 import PIL.Image
 import numpy
 import torch
-from matplotlib import cm
 from tha4.shion.base.image_util import numpy_linear_to_srgb, pytorch_rgba_to_numpy_image, pytorch_rgb_to_numpy_image, \
     torch_linear_to_srgb
 
@@ -12,6 +11,7 @@ def grid_change_to_numpy_image(torch_image, num_channels=3):
     height = torch_image.shape[1]
     width = torch_image.shape[2]
     size_image = (torch_image[0, :, :] ** 2 + torch_image[1, :, :] ** 2).sqrt().view(height, width, 1).numpy()
+    from matplotlib import cm
     hsv = cm.get_cmap('hsv')
     angle_image = hsv(((torch.atan2(
         torch_image[0, :, :].view(height * width),
@@ -56,3 +56,21 @@ def convert_output_image_from_torch_to_numpy(output_image):
 def convert_linear_to_srgb(image: torch.Tensor) -> torch.Tensor:
     rgb_image = torch_linear_to_srgb(image[0:3, :, :])
     return torch.cat([rgb_image, image[3:4, :, :]], dim=0)
+
+
+def compute_image_difference_metrics(expected_image: torch.Tensor, actual_image: torch.Tensor,
+                                     min_pixel_value: float = -1.0, max_pixel_value: float = 1.0):
+    assert expected_image.shape == actual_image.shape
+    pixel_range = max_pixel_value - min_pixel_value
+    diff = ((actual_image.float() - expected_image.float()) / pixel_range).abs()
+    mse = (diff ** 2).mean().item()
+    if len(diff.shape) == 4:
+        per_pixel_diff = diff.max(dim=1)[0]
+    else:
+        per_pixel_diff = diff.max(dim=0)[0]
+    return {
+        "max_abs_error": diff.max().item(),
+        "mean_abs_error": diff.mean().item(),
+        "psnr": float("inf") if mse == 0.0 else 10.0 * math.log10(1.0 / mse),
+        "changed_pixel_fraction": (per_pixel_diff > 1.0 / 255.0).float().mean().item(),
+    }
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+REPOSITORY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SOURCE_DIR = os.path.join(REPOSITORY_DIR, "src")
+APP_DIR = os.path.join(SOURCE_DIR, "tha4", "app")
+
+# Modules that the entry points must not import at start-up by themselves. They may still be pulled in by a
+# third-party package (for example, mediapipe imports matplotlib), which is reported but not counted as a failure.
+DEFAULT_FORBIDDEN_MODULES = ["matplotlib", "scipy"]
+OWN_PACKAGES = ["tha4", "src", "backend"]
+
+
+class ImportRecord:
+    def __init__(self, module_name: str, self_us: int, cumulative_us: int, depth: int):
+        self.module_name = module_name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+        self.parent: Optional['ImportRecord'] = None
+
+
+def get_entry_points() -> List[str]:
+    entry_points = []
+    for file_name in sorted(os.listdir(APP_DIR)):
+        if not file_name.endswith(".py") or file_name == "__init__.py":
+            continue
+        entry_points.append("tha4.app." + file_name[:-3])
+    entry_points.append("backend.main")
+    return entry_points
+
+
+def parse_import_time_output(output: str) -> List[ImportRecord]:
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        name_field = fields[2].rstrip()
+        module_name = name_field.lstrip()
+        depth = (len(name_field) - len(module_name) - 1) // 2
+        records.append(ImportRecord(module_name, int(fields[0]), int(fields[1]), depth))
+
+    # -X importtime prints a module after everything it imports, one indentation level deeper than its importer.
+    pending_by_depth: Dict[int, List[ImportRecord]] = {}
+    for record in records:
+        for child in pending_by_depth.pop(record.depth + 1, []):
+            child.parent = record
+        pending_by_depth.setdefault(record.depth, []).append(record)
+    return records
+
+
+def is_own_module(module_name: str) -> bool:
+    return module_name.split(".")[0] in OWN_PACKAGES
+
+
+def is_module_in(module_name: str, packages: List[str]) -> bool:
+    return any(module_name == package or module_name.startswith(package + ".") for package in packages)
+
+
+def measure_import_time(module_name: str) -> Tuple[float, List[ImportRecord], str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([SOURCE_DIR, REPOSITORY_DIR, env.get("PYTHONPATH", "")])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=REPOSITORY_DIR,
+        env=env,
+        capture_output=True,
+        text=True)
+    records = parse_import_time_output(result.stderr)
+    total_ms = sum(record.self_us for record in records) / 1000.0
+    error = ""
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+    return total_ms, records, error
+
+
+def find_forbidden_imports(records: List[ImportRecord], forbidden_modules: List[str]) -> Tuple[List[str], List[str]]:
+    direct = []
+    indirect = []
+    for record in records:
+        if not is_module_in(record.module_name, forbidden_modules):
+            continue
+        if record.parent is None or is_module_in(record.parent.module_name, forbidden_modules):
+            continue
+        description = f"{record.module_name} <- {record.parent.module_name}"
+        if is_own_module(record.parent.module_name):
+            direct.append(description)
+        else:
+            indirect.append(description)
+    return direct, indirect
+
+
+def run_benchmark(entry_points: List[str],
+                  repeat: int,
+                  forbidden_modules: List[str],
+                  baseline: Dict[str, float],
+                  tolerance: float,
+                  budget_ms: Optional[float],
+                  num_top_modules: int) -> Tuple[Dict[str, float], bool]:
+    measured = {}
+    ok = True
+    for entry_point in entry_points:
+        best_ms = None
+        best_records = []
+        error = ""
+        for _ in range(repeat):
+            total_ms, records, error = measure_import_time(entry_point)
+            if error != "":
+                break
+            if best_ms is None or total_ms < best_ms:
+                best_ms = total_ms
+                best_records = records
+        if error != "":
+            print(f"{entry_point}: SKIPPED ({error})")
+            continue
+        measured[entry_point] = best_ms
+
+        message = f"{entry_point}: {best_ms:.1f} ms"
+        limit_ms = budget_ms
+        if entry_point in baseline:
+            baseline_limit_ms = baseline[entry_point] * (1.0 + tolerance)
+            limit_ms = baseline_limit_ms if limit_ms is None else min(limit_ms, baseline_limit_ms)
+        if limit_ms is not None:
+            message += f" (budget {limit_ms:.1f} ms)"
+            if best_ms > limit_ms:
+                message += " OVER BUDGET"
+                ok = False
+        print(message)
+
+        direct, indirect = find_forbidden_imports(best_records, forbidden_modules)
+        for description in direct:
+            print(f"    FORBIDDEN IMPORT: {description}")
+            ok = False
+        for description in indirect:
+            print(f"    third-party import: {description}")
+        top_records = sorted(best_records, key=lambda r: r.self_us, reverse=True)[:num_top_modules]
+        for record in top_records:
+            print(f"    {record.self_us / 1000.0:8.1f} ms  {record.module_name}")
+    return measured, ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Measure the import time of the app entry points and the backend with python -X importtime.')
+    parser.add_argument("--entry_point", type=str, action="append",
+                        help="A module to measure. Can be repeated. Defaults to every tha4.app module and backend.main.")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of runs per entry point. The fastest counts.")
+    parser.add_argument("--forbid", type=str, action="append",
+                        help="A package the entry points must not import by themselves. "
+                             f"Defaults to {', '.join(DEFAULT_FORBIDDEN_MODULES)}.")
+    parser.add_argument("--baseline", type=str, help="A JSON file with the import time of each entry point in ms.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="How much slower than the baseline an entry point is allowed to get.")
+    parser.add_argument("--budget_ms", type=float, help="An absolute import time budget for every entry point.")
+    parser.add_argument("--save_baseline", type=str, help="Write the measured times to this JSON file.")
+    parser.add_argument("--top", type=int, default=5, help="The number of slowest modules to list per entry point.")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, "rt") as fin:
+            baseline = json.load(fin)
+    entry_points = args.entry_point if args.entry_point is not None else get_entry_points()
+    forbidden_modules = args.forbid if args.forbid is not None else DEFAULT_FORBIDDEN_MODULES
+
+    measured, ok = run_benchmark(
+        entry_points, args.repeat, forbidden_modules, baseline, args.tolerance, args.budget_ms, args.top)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "wt") as fout:
+            json.dump(measured, fout, indent=2, sort_keys=True)
+    sys.exit(0 if ok else 1)
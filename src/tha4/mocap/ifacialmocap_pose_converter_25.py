@@ -4,7 +4,6 @@ from enum import Enum
 from typing import Optional, Dict, List, Callable
 
 import numpy
-import scipy.optimize
 import wx
 
 from tha4.mocap.ifacialmocap_constants import MOUTH_SMILE_LEFT, MOUTH_SHRUG_UPPER, MOUTH_SMILE_RIGHT, \
@@ -575,6 +574,7 @@ class IFacialMocapPoseConverter25(IFacialMocapPoseConverter):
                     return numpy.linalg.norm(numpy.matmul(decomp, M) - mouth_point) \
                         + 0.01 * numpy.linalg.norm(decomp, ord=1)
 
+                import scipy.optimize
                 opt_result = scipy.optimize.minimize(
                     loss, decomp, bounds=[(0.0, 1.0), (0.0, 1.0), (0.0, 1.0), (0.0, 1.0)])
                 decomp = opt_result["x"]
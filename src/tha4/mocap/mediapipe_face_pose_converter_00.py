@@ -4,9 +4,7 @@ from enum import Enum
 from typing import Optional, List, Callable
 
 import numpy
-import scipy.optimize
 import wx
-from scipy.spatial.transform import Rotation
 
 from tha4.poser.modes.pose_parameters import get_pose_parameters
 from tha4.mocap.mediapipe_constants import MOUTH_SMILE_LEFT, MOUTH_SHRUG_UPPER, MOUTH_SMILE_RIGHT, \
@@ -374,6 +372,7 @@ class MediaPoseFacePoseConverter00(MediaPipeFacePoseConverter):
 
     def extract_euler_angles(self, mediapipe_face_pose: MediaPipeFacePose):
         M = mediapipe_face_pose.xform_matrix[0:3, 0:3]
+        from scipy.spatial.transform import Rotation
         rot = Rotation.from_matrix(M)
         return rot.as_euler('xyz', degrees=False)
 
@@ -628,6 +627,7 @@ class MediaPoseFacePoseConverter00(MediaPipeFacePoseConverter):
                     return numpy.linalg.norm(numpy.matmul(decomp, M) - mouth_point) \
                         + 0.01 * numpy.linalg.norm(decomp, ord=1)
 
+                import scipy.optimize
                 opt_result = scipy.optimize.minimize(
                     loss, decomp, bounds=[(0.0, 1.0), (0.0, 1.0), (0.0, 1.0), (0.0, 1.0)])
                 decomp = opt_result["x"]
@@ -0,0 +1,298 @@
+import threading
+import time
+from typing import Optional, Tuple, List, Any
+
+import cv2
+import mediapipe
+import numpy
+
+from tha4.mocap.mediapipe_face_pose import MediaPipeFacePose
+
+
+# A queue of capacity one where a put replaces the value that has not been taken yet. Stages that fall behind always
+# get the newest value, and the replaced values are counted as dropped.
+class LatestValueQueue:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.value = None
+        self.has_value = False
+        self.closed = False
+        self.num_dropped = 0
+
+    def put(self, value: Any):
+        with self.condition:
+            if self.has_value:
+                self.num_dropped += 1
+            self.value = value
+            self.has_value = True
+            self.condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        # Blocks until a value is available. Returns None on timeout or once the queue is closed.
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.has_value or self.closed, timeout):
+                return None
+            return self.take_locked()
+
+    def get_nowait(self) -> Optional[Any]:
+        with self.condition:
+            return self.take_locked()
+
+    def take_locked(self) -> Optional[Any]:
+        if not self.has_value:
+            return None
+        value = self.value
+        self.value = None
+        self.has_value = False
+        return value
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class CameraVideoSource:
+    def __init__(self, camera_index: int = 0):
+        self.video_capture = cv2.VideoCapture(camera_index)
+
+    def read(self) -> Tuple[bool, Optional[numpy.ndarray], int]:
+        there_is_frame, frame = self.video_capture.read()
+        return there_is_frame, frame, int(time.time() * 1000)
+
+    def is_finished(self) -> bool:
+        return False
+
+    def release(self):
+        self.video_capture.release()
+
+
+# Reads frames from a video file. The timestamps come from the frame index and the file's frame rate, so the detector
+# sees the same sequence on every run. With realtime=True, read() waits until each frame is due, like a camera.
+class FileVideoSource:
+    def __init__(self, file_name: str, realtime: bool = True, loop: bool = False):
+        self.file_name = file_name
+        self.realtime = realtime
+        self.loop = loop
+        self.video_capture = cv2.VideoCapture(file_name)
+        if not self.video_capture.isOpened():
+            raise RuntimeError(f"Cannot open video file {file_name}")
+        fps = self.video_capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.0
+        self.frame_index = 0
+        self.start_time = None
+        self.finished = False
+
+    def read(self) -> Tuple[bool, Optional[numpy.ndarray], int]:
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        if self.realtime:
+            due_time = self.start_time + self.frame_index / self.fps
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        there_is_frame, frame = self.video_capture.read()
+        if not there_is_frame and self.loop and self.frame_index > 0:
+            self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            there_is_frame, frame = self.video_capture.read()
+        if not there_is_frame:
+            self.finished = True
+            return False, None, 0
+        timestamp_ms = int(self.frame_index * 1000 / self.fps)
+        self.frame_index += 1
+        return True, frame, timestamp_ms
+
+    def is_finished(self) -> bool:
+        return self.finished
+
+    def release(self):
+        self.video_capture.release()
+
+
+class CapturedFrame:
+    def __init__(self, frame_index: int, rgb_frame: numpy.ndarray, timestamp_ms: int, capture_time: float):
+        self.frame_index = frame_index
+        self.rgb_frame = rgb_frame
+        self.timestamp_ms = timestamp_ms
+        self.capture_time = capture_time
+
+
+class FaceDetection:
+    def __init__(self,
+                 frame: CapturedFrame,
+                 face_pose: Optional[MediaPipeFacePose],
+                 euler_angles: Optional[numpy.ndarray],
+                 detection_time: float,
+                 scale: float):
+        self.frame = frame
+        self.face_pose = face_pose
+        self.euler_angles = euler_angles
+        self.detection_time = detection_time
+        self.scale = scale
+
+
+# Picks the factor by which frames are downscaled before detection so that detection stays within a latency budget.
+# The detection time is tracked with an exponential moving average; the scale shrinks while the average is over the
+# budget and grows back once it is comfortably under it.
+class AdaptiveScaleController:
+    def __init__(self,
+                 latency_budget_ms: float,
+                 min_scale: float = 0.25,
+                 max_scale: float = 1.0,
+                 step: float = 0.1,
+                 smoothing: float = 0.2,
+                 headroom: float = 0.7):
+        assert 0 < min_scale <= max_scale
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.step = step
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.scale = max_scale
+        self.average_time = None
+
+    def add_detection_time(self, detection_time: float) -> float:
+        if self.average_time is None:
+            self.average_time = detection_time
+        else:
+            self.average_time += self.smoothing * (detection_time - self.average_time)
+        if self.average_time > self.latency_budget:
+            self.scale = max(self.min_scale, self.scale - self.step)
+        elif self.average_time < self.latency_budget * self.headroom:
+            self.scale = min(self.max_scale, self.scale + self.step)
+        return self.scale
+
+
+def convert_detection_result(detection_result) -> Tuple[Optional[MediaPipeFacePose], Optional[numpy.ndarray]]:
+    if len(detection_result.facial_transformation_matrixes) == 0:
+        return None, None
+    xform_matrix = detection_result.facial_transformation_matrixes[0]
+    blendshape_params = {}
+    for item in detection_result.face_blendshapes[0]:
+        blendshape_params[item.category_name] = item.score
+    from scipy.spatial.transform import Rotation
+    euler_angles = Rotation.from_matrix(xform_matrix[0:3, 0:3]).as_euler('xyz', degrees=True)
+    return MediaPipeFacePose(blendshape_params, xform_matrix), euler_angles
+
+
+class PipelineStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_captured = 0
+        self.num_detected = 0
+        self.num_consumed = 0
+        self.detection_times: List[float] = []
+        self.latencies: List[float] = []
+        self.scales: List[float] = []
+
+    def add_detection(self, detection_time: float, scale: float):
+        with self.lock:
+            self.num_detected += 1
+            self.detection_times.append(detection_time)
+            self.scales.append(scale)
+
+    def add_consumed(self, latency: float):
+        with self.lock:
+            self.num_consumed += 1
+            self.latencies.append(latency)
+
+
+# Capture and face detection for the MediaPipe puppeteer, each on its own thread and connected by latest-wins queues:
+#
+#   video source -> capture thread -> [frame queue] -> detection thread -> [detection queue] -> consumer
+#
+# The capture thread flips and converts frames to RGB. The detection thread runs FaceLandmarker.detect_for_video on
+# the newest frame, downscaled by the AdaptiveScaleController's current factor, and publishes a FaceDetection. The
+# consumer (the puppeteer's timer) takes the newest detection with poll(), so neither a slow camera nor a slow
+# detection ever blocks it, and frames that a stage could not keep up with are dropped rather than queued.
+class MediaPipeCaptureDetectPipeline:
+    def __init__(self,
+                 video_source,
+                 face_landmarker,
+                 latency_budget_ms: float = 20.0,
+                 min_scale: float = 0.25):
+        self.video_source = video_source
+        self.face_landmarker = face_landmarker
+        self.scale_controller = AdaptiveScaleController(latency_budget_ms, min_scale=min_scale)
+        self.frame_queue = LatestValueQueue()
+        self.detection_queue = LatestValueQueue()
+        self.latest_frame = None
+        self.stats = PipelineStats()
+        self.running = False
+        self.threads = []
+        self.finished = threading.Event()
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.run_capture, daemon=True),
+            threading.Thread(target=self.run_detection, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.frame_queue.close()
+        self.detection_queue.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def run_capture(self):
+        frame_index = 0
+        while self.running:
+            there_is_frame, frame, timestamp_ms = self.video_source.read()
+            if not there_is_frame:
+                if self.video_source.is_finished():
+                    break
+                time.sleep(0.005)
+                continue
+            rgb_frame = cv2.flip(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), 1)
+            captured_frame = CapturedFrame(frame_index, rgb_frame, timestamp_ms, time.perf_counter())
+            self.latest_frame = captured_frame
+            self.frame_queue.put(captured_frame)
+            frame_index += 1
+            with self.stats.lock:
+                self.stats.num_captured += 1
+        self.frame_queue.close()
+
+    def run_detection(self):
+        last_timestamp_ms = -1
+        while self.running:
+            captured_frame = self.frame_queue.get()
+            if captured_frame is None:
+                break
+            # detect_for_video requires strictly increasing timestamps.
+            timestamp_ms = max(captured_frame.timestamp_ms, last_timestamp_ms + 1)
+            last_timestamp_ms = timestamp_ms
+
+            start_time = time.perf_counter()
+            scale = self.scale_controller.scale
+            rgb_frame = captured_frame.rgb_frame
+            if scale < 1.0:
+                height, width = rgb_frame.shape[0:2]
+                rgb_frame = cv2.resize(
+                    rgb_frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+            mediapipe_image = mediapipe.Image(
+                image_format=mediapipe.ImageFormat.SRGB, data=numpy.ascontiguousarray(rgb_frame))
+            detection_result = self.face_landmarker.detect_for_video(mediapipe_image, timestamp_ms)
+            face_pose, euler_angles = convert_detection_result(detection_result)
+            detection_time = time.perf_counter() - start_time
+
+            self.scale_controller.add_detection_time(detection_time)
+            self.stats.add_detection(detection_time, scale)
+            self.detection_queue.put(FaceDetection(captured_frame, face_pose, euler_angles, detection_time, scale))
+        self.finished.set()
+
+    def poll(self) -> Optional[FaceDetection]:
+        # Returns the newest detection not returned before, or None. Never blocks.
+        detection = self.detection_queue.get_nowait()
+        if detection is not None:
+            self.stats.add_consumed(time.perf_counter() - detection.frame.capture_time)
+        return detection
+
+    def get_num_dropped_frames(self) -> Tuple[int, int]:
+        # (frames replaced before detection, detections replaced before being consumed)
+        return self.frame_queue.num_dropped, self.detection_queue.num_dropped
@@ -0,0 +1,155 @@
+import argparse
+import time
+from typing import List
+
+import cv2
+import mediapipe
+import numpy
+
+from tha4.mocap.mediapipe_pipeline import FileVideoSource, MediaPipeCaptureDetectPipeline, FaceDetection, \
+    convert_detection_result
+
+FACE_LANDMARKER_MODEL_FILE_NAME = 'data/thirdparty/mediapipe/face_landmarker_v2_with_blendshapes.task'
+
+
+def create_face_landmarker(model_file_name: str):
+    face_landmarker_base_options = mediapipe.tasks.BaseOptions(model_asset_path=model_file_name)
+    options = mediapipe.tasks.vision.FaceLandmarkerOptions(
+        base_options=face_landmarker_base_options,
+        running_mode=mediapipe.tasks.vision.RunningMode.VIDEO,
+        output_face_blendshapes=True,
+        output_facial_transformation_matrixes=True,
+        num_faces=1)
+    return mediapipe.tasks.vision.FaceLandmarker.create_from_options(options)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def print_latencies(label: str, latencies: List[float]):
+    print(f"{label:28s}{percentile(latencies, 0.5) * 1000:9.1f}{percentile(latencies, 0.95) * 1000:9.1f}"
+          f"{percentile(latencies, 0.99) * 1000:9.1f} ms")
+
+
+class InlineRunStats:
+    def __init__(self):
+        self.latencies = []
+        self.backlogs = []
+        self.num_frames = 0
+        self.num_late_frames = 0
+
+
+def run_inline(video_file_name: str, model_file_name: str, consumer_fps: float, render_ms: float) -> InlineRunStats:
+    # The puppeteer's original loop: read, detect and render one after another on the timer.
+    #
+    # The file source hands out every frame in order, so when the loop falls behind it keeps reading frames that a live
+    # camera would already have replaced. Latency is therefore measured from the time each frame was due (when a camera
+    # would have delivered it), and a frame read more than one frame period after that counts as late; the pipeline
+    # would have dropped it instead.
+    face_landmarker = create_face_landmarker(model_file_name)
+    video_source = FileVideoSource(video_file_name, realtime=True)
+    stats = InlineRunStats()
+    frame_time = 1.0 / consumer_fps
+    next_tick = time.perf_counter()
+    while True:
+        now = time.perf_counter()
+        if now < next_tick:
+            time.sleep(next_tick - now)
+        next_tick = max(next_tick + frame_time, time.perf_counter())
+        there_is_frame, frame, timestamp_ms = video_source.read()
+        if not there_is_frame:
+            break
+        due_time = video_source.start_time + (video_source.frame_index - 1) / video_source.fps
+        backlog = (time.perf_counter() - due_time) * video_source.fps
+        stats.backlogs.append(backlog)
+        if backlog > 1.0:
+            stats.num_late_frames += 1
+        rgb_frame = cv2.flip(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), 1)
+        mediapipe_image = mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=rgb_frame)
+        convert_detection_result(face_landmarker.detect_for_video(mediapipe_image, timestamp_ms))
+        stats.latencies.append(time.perf_counter() - due_time)
+        stats.num_frames += 1
+        if render_ms > 0:
+            time.sleep(render_ms / 1000.0)
+    video_source.release()
+    face_landmarker.close()
+    return stats
+
+
+def run_pipeline(video_file_name: str,
+                 model_file_name: str,
+                 consumer_fps: float,
+                 render_ms: float,
+                 latency_budget_ms: float,
+                 min_scale: float) -> MediaPipeCaptureDetectPipeline:
+    face_landmarker = create_face_landmarker(model_file_name)
+    video_source = FileVideoSource(video_file_name, realtime=True)
+    pipeline = MediaPipeCaptureDetectPipeline(video_source, face_landmarker, latency_budget_ms, min_scale)
+    pipeline.start()
+    frame_time = 1.0 / consumer_fps
+    next_tick = time.perf_counter()
+    while True:
+        now = time.perf_counter()
+        if now < next_tick:
+            time.sleep(next_tick - now)
+        next_tick += frame_time
+        detection: FaceDetection = pipeline.poll()
+        if detection is not None and render_ms > 0:
+            time.sleep(render_ms / 1000.0)
+        if detection is None and pipeline.finished.is_set():
+            break
+    pipeline.stop()
+    video_source.release()
+    face_landmarker.close()
+    return pipeline
+
+
+def benchmark_mediapipe_pipeline(video_file_name: str,
+                                 model_file_name: str,
+                                 consumer_fps: float,
+                                 render_ms: float,
+                                 latency_budget_ms: float,
+                                 min_scale: float):
+    print(f"{video_file_name}: consumer at {consumer_fps} fps, {render_ms} ms render per frame")
+    print(f"{'':28s}{'p50':>9s}{'p95':>9s}{'p99':>12s}")
+
+    inline_stats = run_inline(video_file_name, model_file_name, consumer_fps, render_ms)
+    print_latencies("inline (due -> pose)", inline_stats.latencies)
+    print(f"  {inline_stats.num_frames} frames detected, {inline_stats.num_late_frames} read more than a frame late")
+    if len(inline_stats.backlogs) > 0:
+        print(f"  backlog: max {max(inline_stats.backlogs):.1f} frames, "
+              f"at the end {inline_stats.backlogs[-1]:.1f} frames")
+
+    pipeline = run_pipeline(
+        video_file_name, model_file_name, consumer_fps, render_ms, latency_budget_ms, min_scale)
+    stats = pipeline.stats
+    print_latencies("pipeline (capture -> poll)", stats.latencies)
+    print_latencies("  detection", stats.detection_times)
+    num_frame_drops, num_detection_drops = pipeline.get_num_dropped_frames()
+    print(f"  {stats.num_captured} captured, {stats.num_detected} detected, {stats.num_consumed} consumed")
+    print(f"  dropped before detection: {num_frame_drops}, dropped before the consumer: {num_detection_drops}")
+    if len(stats.scales) > 0:
+        print(f"  input scale: mean {numpy.mean(stats.scales):.2f}, min {numpy.min(stats.scales):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Replay a recorded clip through the inline MediaPipe loop and the threaded capture-and-detect '
+                    'pipeline, and report end-to-end latency and dropped frames.')
+    parser.add_argument("video_file", type=str, help="A recorded webcam clip.")
+    parser.add_argument("--model", type=str, default=FACE_LANDMARKER_MODEL_FILE_NAME,
+                        help="The FaceLandmarker model file.")
+    parser.add_argument("--consumer_fps", type=float, default=1000.0 / 30,
+                        help="How often the consumer polls, like the puppeteer's 30 ms timer.")
+    parser.add_argument("--render_ms", type=float, default=0.0,
+                        help="Simulated rendering time the consumer spends after each new pose.")
+    parser.add_argument("--latency_budget_ms", type=float, default=20.0,
+                        help="The detection time above which frames are downscaled before detection.")
+    parser.add_argument("--min_scale", type=float, default=0.25, help="The smallest input scale.")
+    args = parser.parse_args()
+    benchmark_mediapipe_pipeline(
+        args.video_file, args.model, args.consumer_fps, args.render_ms, args.latency_budget_ms, args.min_scale)
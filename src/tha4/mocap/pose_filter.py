@@ -0,0 +1,249 @@
+import math
+from typing import Dict, List, Optional, Union
+
+import numpy
+
+ArrayOrFloat = Union[numpy.ndarray, float]
+
+
+# One-Euro filters (Casiez et al., CHI 2012) for a whole vector of channels at once, with short-horizon linear
+# prediction from the filtered derivative.
+#
+# Each channel is low-pass filtered with a cutoff that rises with its speed: min_cutoff (Hz) sets how much a still
+# channel is smoothed, and beta how quickly the cutoff opens up when it moves, so slow drift is steady and fast motion
+# lags little. Channels can be masked out of an update (a tracker packet without that value); they keep their state
+# and start filtering from the next value they get.
+class OneEuroFilterBank:
+    def __init__(self,
+                 num_channels: int,
+                 min_cutoff: ArrayOrFloat = 1.0,
+                 beta: ArrayOrFloat = 0.0,
+                 derivative_cutoff: ArrayOrFloat = 1.0,
+                 lower_bound: Optional[ArrayOrFloat] = None,
+                 upper_bound: Optional[ArrayOrFloat] = None,
+                 max_prediction_time: float = 0.1):
+        self.num_channels = 0
+        self.min_cutoff = numpy.zeros(0)
+        self.beta = numpy.zeros(0)
+        self.derivative_cutoff = numpy.zeros(0)
+        self.lower_bound = numpy.zeros(0)
+        self.upper_bound = numpy.zeros(0)
+        self.value = numpy.zeros(0)
+        self.derivative = numpy.zeros(0)
+        self.initialized = numpy.zeros(0, dtype=bool)
+        self.last_timestamp = numpy.zeros(0)
+        self.max_prediction_time = max_prediction_time
+        self.add_channels(num_channels, min_cutoff, beta, derivative_cutoff, lower_bound, upper_bound)
+
+    def add_channels(self,
+                     num_channels: int,
+                     min_cutoff: ArrayOrFloat = 1.0,
+                     beta: ArrayOrFloat = 0.0,
+                     derivative_cutoff: ArrayOrFloat = 1.0,
+                     lower_bound: Optional[ArrayOrFloat] = None,
+                     upper_bound: Optional[ArrayOrFloat] = None):
+        def expand(value, default):
+            if value is None:
+                value = default
+            return numpy.broadcast_to(numpy.asarray(value, dtype=numpy.float64), (num_channels,))
+
+        self.min_cutoff = numpy.concatenate([self.min_cutoff, expand(min_cutoff, 1.0)])
+        self.beta = numpy.concatenate([self.beta, expand(beta, 0.0)])
+        self.derivative_cutoff = numpy.concatenate([self.derivative_cutoff, expand(derivative_cutoff, 1.0)])
+        self.lower_bound = numpy.concatenate([self.lower_bound, expand(lower_bound, -numpy.inf)])
+        self.upper_bound = numpy.concatenate([self.upper_bound, expand(upper_bound, numpy.inf)])
+        self.value = numpy.concatenate([self.value, numpy.zeros(num_channels)])
+        self.derivative = numpy.concatenate([self.derivative, numpy.zeros(num_channels)])
+        self.initialized = numpy.concatenate([self.initialized, numpy.zeros(num_channels, dtype=bool)])
+        self.last_timestamp = numpy.concatenate([self.last_timestamp, numpy.zeros(num_channels)])
+        self.num_channels += num_channels
+
+    def reset(self):
+        self.value[:] = 0.0
+        self.derivative[:] = 0.0
+        self.initialized[:] = False
+
+    @staticmethod
+    def smoothing_factor(elapsed_time: numpy.ndarray, cutoff: numpy.ndarray) -> numpy.ndarray:
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / elapsed_time)
+
+    def filter(self, values: numpy.ndarray, timestamp: float, mask: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        # Filters a new sample taken at timestamp (seconds) and returns the filtered vector.
+        values = numpy.asarray(values, dtype=numpy.float64)
+        assert values.shape == (self.num_channels,)
+        update = numpy.ones(self.num_channels, dtype=bool) if mask is None else numpy.asarray(mask, dtype=bool)
+
+        first = update & ~self.initialized
+        self.value[first] = values[first]
+        self.derivative[first] = 0.0
+        self.last_timestamp[first] = timestamp
+        self.initialized |= first
+
+        # A sample that is not newer than a channel's last one is ignored for that channel.
+        elapsed_time = timestamp - self.last_timestamp
+        step = update & ~first & (elapsed_time > 0)
+        if numpy.any(step):
+            elapsed_time = elapsed_time[step]
+            raw_derivative = (values[step] - self.value[step]) / elapsed_time
+            derivative_alpha = self.smoothing_factor(elapsed_time, self.derivative_cutoff[step])
+            derivative = self.derivative[step] + derivative_alpha * (raw_derivative - self.derivative[step])
+            cutoff = self.min_cutoff[step] + self.beta[step] * numpy.abs(derivative)
+            alpha = self.smoothing_factor(elapsed_time, cutoff)
+            self.value[step] += alpha * (values[step] - self.value[step])
+            self.derivative[step] = derivative
+            self.last_timestamp[step] = timestamp
+
+        return self.value.copy()
+
+    def predict(self, timestamp: float) -> numpy.ndarray:
+        # Extrapolates the filtered values linearly to timestamp, at most max_prediction_time ahead of each channel's
+        # last sample, and clamps them to the channel bounds. Use the time the pose will be shown to make up for the
+        # latency between the tracker and the screen.
+        horizon = numpy.clip(timestamp - self.last_timestamp, 0.0, self.max_prediction_time)
+        predicted = self.value + numpy.where(self.initialized, self.derivative * horizon, 0.0)
+        return numpy.clip(predicted, self.lower_bound, self.upper_bound)
+
+
+# A OneEuroFilterBank over named values, such as the dictionaries the iFacialMocap receiver produces. A channel is
+# added the first time its name shows up.
+class NamedOneEuroFilter:
+    def __init__(self,
+                 min_cutoff: float = 1.0,
+                 beta: float = 0.0,
+                 derivative_cutoff: float = 1.0,
+                 lower_bound: Optional[float] = None,
+                 upper_bound: Optional[float] = None,
+                 max_prediction_time: float = 0.1,
+                 channel_settings: Optional[Dict[str, Dict[str, Optional[float]]]] = None):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.channel_settings = channel_settings if channel_settings is not None else {}
+        self.names: List[str] = []
+        self.indices: Dict[str, int] = {}
+        self.bank = OneEuroFilterBank(0, max_prediction_time=max_prediction_time)
+
+    def get_channel_setting(self, name: str, key: str, default: Optional[float]) -> Optional[float]:
+        return self.channel_settings.get(name, {}).get(key, default)
+
+    def add_name(self, name: str):
+        self.indices[name] = len(self.names)
+        self.names.append(name)
+        self.bank.add_channels(
+            1,
+            min_cutoff=self.get_channel_setting(name, 'min_cutoff', self.min_cutoff),
+            beta=self.get_channel_setting(name, 'beta', self.beta),
+            derivative_cutoff=self.get_channel_setting(name, 'derivative_cutoff', self.derivative_cutoff),
+            lower_bound=self.get_channel_setting(name, 'lower_bound', self.lower_bound),
+            upper_bound=self.get_channel_setting(name, 'upper_bound', self.upper_bound))
+
+    def filter(self, data: Dict[str, float], timestamp: float) -> Dict[str, float]:
+        for name in data:
+            if name not in self.indices:
+                self.add_name(name)
+        values = numpy.zeros(len(self.names))
+        mask = numpy.zeros(len(self.names), dtype=bool)
+        for name, value in data.items():
+            values[self.indices[name]] = value
+            mask[self.indices[name]] = True
+        return self.to_dict(self.bank.filter(values, timestamp, mask))
+
+    def predict(self, timestamp: float) -> Dict[str, float]:
+        return self.to_dict(self.bank.predict(timestamp))
+
+    def to_dict(self, values: numpy.ndarray) -> Dict[str, float]:
+        return {name: float(values[index]) for index, name in enumerate(self.names) if self.bank.initialized[index]}
+
+
+# A pose filter for render loops that convert the latest tracker sample on every timer tick. The tracked channels are
+# filtered with the time the sample was taken, once per sample, and predicted to the display time. Everything else the
+# converter produces between samples shows up at once: untracked channels (breathing, which the converters generate
+# from the clock) are passed through, and a change in a tracked channel that did not come from a new sample (a panel
+# setting) is added on top of the prediction.
+class TrackedPoseFilter:
+    def __init__(self, bank: OneEuroFilterBank, tracked: numpy.ndarray):
+        assert tracked.shape == (bank.num_channels,)
+        self.bank = bank
+        self.tracked = tracked
+        self.sample_pose = None
+        self.sample_time = None
+
+    def reset(self):
+        self.bank.reset()
+        self.sample_pose = None
+        self.sample_time = None
+
+    def update(self, pose: List[float], sample_time: Optional[float], display_time: float) -> List[float]:
+        pose = numpy.asarray(pose, dtype=numpy.float64)
+        if sample_time is not None and sample_time != self.sample_time:
+            self.bank.filter(pose, sample_time, mask=self.tracked)
+            self.sample_pose = pose
+            self.sample_time = sample_time
+        if self.sample_pose is None:
+            return pose.tolist()
+        tracked_pose = self.bank.predict(display_time) + (pose - self.sample_pose)
+        result = numpy.where(self.tracked, tracked_pose, pose)
+        return numpy.clip(result, self.bank.lower_bound, self.bank.upper_bound).tolist()
+
+
+# Cutoffs for the pose vector of get_pose_parameters(), by parameter category. Head and body rotations and iris
+# rotation are smoothed the most because their jitter is the most visible. Eyes and mouth must follow blinks and speech
+# closely, so they get a higher minimum cutoff. Breathing is generated by the pose converters, not tracked, and passes
+# through almost unfiltered; TrackedPoseFilter does not filter it at all.
+POSE_FILTER_SETTINGS = {
+    'EYEBROW': (2.0, 0.5),
+    'EYE': (4.0, 1.0),
+    'IRIS_MORPH': (2.0, 0.5),
+    'MOUTH': (4.0, 1.0),
+    'IRIS_ROTATION': (1.5, 0.7),
+    'FACE_ROTATION': (1.0, 0.7),
+    'BODY_ROTATION': (1.0, 0.7),
+    'BREATHING': (30.0, 0.0),
+}
+
+
+def create_pose_filter_bank(min_cutoff_scale: float = 1.0,
+                            beta_scale: float = 1.0,
+                            derivative_cutoff: float = 1.0,
+                            max_prediction_time: float = 0.1) -> OneEuroFilterBank:
+    # A filter bank for the full pose vector (45 parameters), with the cutoffs above and the parameters' ranges as
+    # bounds. min_cutoff_scale and beta_scale adjust all channels together.
+    from tha4.poser.modes.pose_parameters import get_pose_parameters
+
+    min_cutoff = []
+    beta = []
+    lower_bound = []
+    upper_bound = []
+    for group in get_pose_parameters().get_pose_parameter_groups():
+        group_min_cutoff, group_beta = POSE_FILTER_SETTINGS[group.get_category().name]
+        low, high = group.get_range()
+        for _ in range(group.get_arity()):
+            min_cutoff.append(group_min_cutoff * min_cutoff_scale)
+            beta.append(group_beta * beta_scale)
+            lower_bound.append(low)
+            upper_bound.append(high)
+    return OneEuroFilterBank(
+        len(min_cutoff),
+        min_cutoff=numpy.array(min_cutoff),
+        beta=numpy.array(beta),
+        derivative_cutoff=derivative_cutoff,
+        lower_bound=numpy.array(lower_bound),
+        upper_bound=numpy.array(upper_bound),
+        max_prediction_time=max_prediction_time)
+
+
+def create_pose_filter(min_cutoff_scale: float = 1.0,
+                       beta_scale: float = 1.0,
+                       derivative_cutoff: float = 1.0,
+                       max_prediction_time: float = 0.1) -> TrackedPoseFilter:
+    # A TrackedPoseFilter over the bank above that treats every channel except breathing as tracked.
+    from tha4.poser.modes.pose_parameters import get_pose_parameters
+
+    tracked = []
+    for group in get_pose_parameters().get_pose_parameter_groups():
+        tracked += [group.get_category().name != 'BREATHING'] * group.get_arity()
+    bank = create_pose_filter_bank(min_cutoff_scale, beta_scale, derivative_cutoff, max_prediction_time)
+    return TrackedPoseFilter(bank, numpy.array(tracked, dtype=bool))
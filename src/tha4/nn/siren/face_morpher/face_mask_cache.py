@@ -0,0 +1,100 @@
+import os
+from typing import Optional, Tuple
+
+import PIL.Image
+import numpy
+import torch
+
+from tha4.shion.core.load_save import torch_load, torch_save
+
+FACE_MASK_IMAGE_SIZE = 512
+FACE_MASK_CROP_CENTER_X = 256
+FACE_MASK_CROP_CENTER_Y = 128 + 16
+FACE_MASK_CROP_SIZE = 128
+
+
+def load_face_mask_array(file_name: str) -> numpy.ndarray:
+    # Loads the face mask as an HxWx3 uint8 array and checks that it is a 512x512 RGB image whose channels are all
+    # either 0 or 255.
+    with PIL.Image.open(file_name) as image:
+        assert image.width == FACE_MASK_IMAGE_SIZE and image.height == FACE_MASK_IMAGE_SIZE, \
+            "The face mask image must be 512x512."
+        assert image.mode == "RGB", "The face mask image must be an RGB image."
+        mask = numpy.asarray(image)
+    is_binary = (mask == 0) | (mask == 255)
+    assert is_binary[:, :, 0].all(), "The R channel of the face mask image must be 0 or 255"
+    assert is_binary[:, :, 1].all(), "The G channel of the face mask image must be 0 or 255"
+    assert is_binary[:, :, 2].all(), "The B channel of the face mask image must be 0 or 255"
+    return mask
+
+
+def compute_face_mask_bounding_box(mask: numpy.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    # Returns (left, top, right, bottom), exclusive on the right and bottom, of the pixels set in the R channel.
+    ys, xs = numpy.nonzero(mask[:, :, 0])
+    if len(xs) == 0:
+        return None
+    return int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+
+
+def crop_face_mask(mask: numpy.ndarray) -> torch.Tensor:
+    # The same 4x128x128 tensor that SirenFaceMorpher00TrainerArgs used to compute by loading the PNG with
+    # extract_pytorch_image_from_filelike and copying the R channel of the face crop into every channel. The mask is
+    # binary and has no alpha, so the sRGB-to-linear conversion and alpha premultiplication leave it unchanged.
+    half = FACE_MASK_CROP_SIZE // 2
+    crop = mask[
+           FACE_MASK_CROP_CENTER_Y - half:FACE_MASK_CROP_CENTER_Y + half,
+           FACE_MASK_CROP_CENTER_X - half:FACE_MASK_CROP_CENTER_X + half,
+           0]
+    crop = torch.from_numpy((crop == 255).astype(numpy.float32))
+    return crop.unsqueeze(0).repeat(4, 1, 1)
+
+
+def get_file_signature(file_name: str) -> Tuple[str, int, int]:
+    stat = os.stat(file_name)
+    return os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns
+
+
+class FaceMaskCache:
+    def __init__(self,
+                 source_signature: Tuple[str, int, int],
+                 bounding_box: Optional[Tuple[int, int, int, int]],
+                 crop: torch.Tensor):
+        self.source_signature = source_signature
+        self.bounding_box = bounding_box
+        self.crop = crop
+
+    @staticmethod
+    def create(mask_file_name: str) -> 'FaceMaskCache':
+        mask = load_face_mask_array(mask_file_name)
+        return FaceMaskCache(get_file_signature(mask_file_name), compute_face_mask_bounding_box(mask),
+                             crop_face_mask(mask))
+
+    def is_valid_for(self, mask_file_name: str) -> bool:
+        return os.path.isfile(mask_file_name) and tuple(self.source_signature) == get_file_signature(mask_file_name)
+
+    def save(self, file_name: str):
+        torch_save({
+            "source_signature": list(self.source_signature),
+            "bounding_box": None if self.bounding_box is None else list(self.bounding_box),
+            "crop": self.crop,
+        }, file_name)
+
+    @staticmethod
+    def load(file_name: str) -> 'FaceMaskCache':
+        data = torch_load(file_name)
+        bounding_box = None if data["bounding_box"] is None else tuple(data["bounding_box"])
+        return FaceMaskCache(tuple(data["source_signature"]), bounding_box, data["crop"])
+
+
+def load_or_create_face_mask_cache(mask_file_name: str, cache_file_name: str) -> FaceMaskCache:
+    # The cache is keyed by the mask's path, size and modification time, so editing the mask invalidates it.
+    if os.path.isfile(cache_file_name):
+        try:
+            cache = FaceMaskCache.load(cache_file_name)
+            if cache.is_valid_for(mask_file_name):
+                return cache
+        except Exception:
+            pass
+    cache = FaceMaskCache.create(mask_file_name)
+    cache.save(cache_file_name)
+    return cache
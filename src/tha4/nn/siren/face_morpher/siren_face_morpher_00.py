@@ -6,6 +6,7 @@ from torch.nn import Module
 from torch.nn.functional import affine_grid
 
 from tha4.shion.core.module_factory import ModuleFactory
+from tha4.nn.siren.vanilla.fused_siren import enable_fused_siren_execution
 from tha4.nn.siren.vanilla.siren import SirenArgs, Siren
 
 
@@ -52,8 +53,13 @@ class SirenFaceMorpher00(Module):
 
 
 class SirenFaceMorpher00Factory(ModuleFactory):
-    def __init__(self, args: SirenFaceMorpher00Args):
+    def __init__(self, args: SirenFaceMorpher00Args, use_fused_siren: bool = False, compile_siren: bool = False):
+        self.compile_siren = compile_siren
+        self.use_fused_siren = use_fused_siren
         self.args = args
 
     def create(self) -> Module:
-        return SirenFaceMorpher00(self.args)
+        module = SirenFaceMorpher00(self.args)
+        if self.use_fused_siren:
+            enable_fused_siren_execution(module, fold_omega=False, compile=self.compile_siren)
+        return module
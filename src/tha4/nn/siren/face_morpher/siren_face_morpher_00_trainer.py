@@ -8,6 +8,7 @@ from tha4.shion.base.loss.sum_loss import SumLoss
 from tha4.shion.base.optimizer_factories import AdamOptimizerFactory
 from tha4.shion.core.training.distrib.distributed_trainer import DistributedTrainer
 from tha4.dataset.image_poses_and_aother_images_dataset import ImagePosesAndOtherImagesDataset
+from tha4.nn.siren.face_morpher.face_mask_cache import load_or_create_face_mask_cache
 from tha4.nn.siren.face_morpher.siren_face_morpher_00 import SirenFaceMorpher00Factory, SirenFaceMorpher00Args
 from tha4.nn.siren.face_morpher.siren_face_morpher_protocols_00 import SirenFaceMorpherComputationProtocol00, \
     SirenFaceMorpherSampleOutputProtocol00
@@ -41,7 +42,11 @@ class SirenFaceMorpher00TrainerArgs:
                  sample_output_random_seed: int = 3522651501,
                  total_worker: int = 16,
                  poser_func: Optional[Callable[[], Poser]] = None,
-                 base_learning_rate: float = 1e-4):
+                 base_learning_rate: float = 1e-4,
+                 use_fused_siren: bool = False,
+                 compile_siren: bool = False,
+                 face_mask_cache_file_name: Optional[str] = None,
+                 render_sample_outputs_in_background: bool = False):
         assert num_training_total_examples % num_training_examples_per_checkpoint == 0
 
         if num_training_examples_lr_boundaries is None:
@@ -57,7 +62,11 @@ class SirenFaceMorpher00TrainerArgs:
         if poser_func is None:
             poser_func = get_poser
 
+        self.render_sample_outputs_in_background = render_sample_outputs_in_background
+        self.compile_siren = compile_siren
+        self.use_fused_siren = use_fused_siren
         self.face_mask_file_name = face_mask_file_name
+        self.face_mask_cache_file_name = face_mask_cache_file_name
         self.base_learning_rate = base_learning_rate
         self.poser_func = poser_func
         self.total_worker = total_worker
@@ -81,6 +90,8 @@ class SirenFaceMorpher00TrainerArgs:
             perform_srgb_to_linear=True)
 
     def get_face_mask_image(self):
+        if self.face_mask_cache_file_name is not None:
+            return load_or_create_face_mask_cache(self.face_mask_file_name, self.face_mask_cache_file_name).crop
         loaded_image = extract_pytorch_image_from_filelike(
             self.face_mask_file_name,
             scale=1.0,
@@ -110,7 +121,9 @@ class SirenFaceMorpher00TrainerArgs:
                     in_channels=39 + 2,
                     out_channels=4,
                     intermediate_channels=128,
-                    num_sine_layers=8)))
+                    num_sine_layers=8)),
+            use_fused_siren=self.use_fused_siren,
+            compile_siren=self.compile_siren)
 
     def transform_pose_to_module_input(self, pose: Tensor):
         return pose[:, 0:39]
@@ -202,6 +215,12 @@ class SirenFaceMorpher00TrainerArgs:
             ),
         ])
 
+    def get_sample_output_protocol_func(self):
+        # The bound method is pickled into the sample output worker together with these args.
+        if self.num_training_examples_per_sample_output is None or not self.render_sample_outputs_in_background:
+            return None
+        return self.get_sample_output_protocol
+
     def create_trainer(self, prefix: str, world_size: int, distrib_backend: str = 'gloo'):
         if self.num_training_examples_per_sample_output is not None:
             sample_output_protocol = self.get_sample_output_protocol()
@@ -225,4 +244,5 @@ class SirenFaceMorpher00TrainerArgs:
             pretrained_module_file_names={},
             example_per_snapshot=self.num_training_examples_per_snapshot,
             num_data_loader_workers=max(1, self.total_worker // world_size),
-            distrib_backend=distrib_backend)
+            distrib_backend=distrib_backend,
+            sample_output_protocol_func=self.get_sample_output_protocol_func())
@@ -8,6 +8,7 @@ from torch.nn.functional import affine_grid, interpolate
 from tha4.shion.core.module_factory import ModuleFactory
 from tha4.shion.nn00.initialization_funcs import HeInitialization
 from tha4.nn.image_processing_util import GridChangeApplier
+from tha4.nn.siren.vanilla.fused_siren import FusedSineChain, enable_fused_siren_execution
 from tha4.nn.siren.vanilla.siren import SineLinearLayer
 
 
@@ -88,6 +89,53 @@ class SirenMorpher03(Module):
             bias=True))
 
         self.grid_change_applier = GridChangeApplier()
+        self.fused_levels = None
+        self.last_level_image_size = None
+        self.skip_last_level = False
+
+    # Lets inference trade detail for speed. The last evaluated level runs at last_level_image_size (earlier levels
+    # are clamped to it), or the last level is skipped altogether and the output of the level before it is fed to the
+    # last linear layer. The SIREN output is then upsampled to the size of the input image before the grid change is
+    # applied, so the warp still samples the full-resolution character image.
+    def set_render_resolution(self, last_level_image_size: Optional[int] = None, skip_last_level: bool = False):
+        assert last_level_image_size is None or last_level_image_size >= 1
+        self.last_level_image_size = last_level_image_size
+        self.skip_last_level = skip_last_level
+
+    def get_level_image_sizes(self) -> List[int]:
+        level_args = self.args.level_args
+        if self.skip_last_level:
+            level_args = level_args[:-1]
+        sizes = [args.image_size for args in level_args]
+        if self.last_level_image_size is not None:
+            sizes = [min(size, self.last_level_image_size) for size in sizes[:-1]] + [self.last_level_image_size]
+        return sizes
+
+    def set_fused_execution(self, enabled: bool, fold_omega: bool = True, compile: bool = False):
+        if enabled:
+            num_levels = len(self.args.level_args)
+            self.fused_levels = ModuleList([
+                FusedSineChain(
+                    list(self.siren_layers[i]),
+                    last_linear=self.last_linear if i == num_levels - 1 else None,
+                    fold_omega=fold_omega,
+                    compile=compile)
+                for i in range(num_levels)
+            ])
+        else:
+            self.fused_levels = None
+
+    def run_level(self, level_index: int, x: Tensor, is_last_level: bool) -> Tensor:
+        if self.fused_levels is not None:
+            # Only the fused chain of the final level includes the last linear layer.
+            x = self.fused_levels[level_index].forward(x)
+            if is_last_level and level_index < len(self.args.level_args) - 1:
+                x = self.last_linear(x)
+            return x
+        x = self.siren_layers[level_index].forward(x)
+        if is_last_level:
+            x = self.last_linear(x)
+        return x
 
     def get_position_grid(self, n: int, image_size: int, device: torch.device):
         h, w = image_size, image_size
@@ -108,21 +156,26 @@ class SirenMorpher03(Module):
         n = pose.shape[0]
         device = pose.device
 
+        level_image_sizes = self.get_level_image_sizes()
+        num_levels = len(level_image_sizes)
         x = None
-        for i in range(len(self.args.level_args)):
-            args = self.args.level_args[i]
+        for i in range(num_levels):
+            image_size = level_image_sizes[i]
             position_and_pose = torch.cat([
-                self.get_position_grid(n, args.image_size, device),
-                self.get_pose_image(pose, args.image_size)
+                self.get_position_grid(n, image_size, device),
+                self.get_pose_image(pose, image_size)
             ], dim=1)
             if i == 0:
-                x = self.siren_layers[i].forward(position_and_pose)
+                x = self.run_level(i, position_and_pose, i == num_levels - 1)
             else:
-                x = interpolate(x, size=(args.image_size, args.image_size), mode='bilinear')
+                if x.shape[2] != image_size or x.shape[3] != image_size:
+                    x = interpolate(x, size=(image_size, image_size), mode='bilinear')
                 x = torch.cat([x, position_and_pose], dim=1)
-                x = self.siren_layers[i].forward(x)
+                x = self.run_level(i, x, i == num_levels - 1)
 
-        siren_output = self.last_linear(x)
+        siren_output = x
+        if siren_output.shape[2] != image.shape[2] or siren_output.shape[3] != image.shape[3]:
+            siren_output = interpolate(siren_output, size=(image.shape[2], image.shape[3]), mode='bilinear')
 
         grid_change = siren_output[:, 0:2, :, :]
         alpha = siren_output[:, 2:3, :, :]
@@ -146,8 +199,13 @@ class SirenMorpher03(Module):
 
 
 class SirenMorpher03Factory(ModuleFactory):
-    def __init__(self, args: SirenMorpher03Args):
+    def __init__(self, args: SirenMorpher03Args, use_fused_siren: bool = False, compile_siren: bool = False):
+        self.compile_siren = compile_siren
+        self.use_fused_siren = use_fused_siren
         self.args = args
 
     def create(self):
-        return SirenMorpher03(self.args)
+        module = SirenMorpher03(self.args)
+        if self.use_fused_siren:
+            enable_fused_siren_execution(module, fold_omega=False, compile=self.compile_siren)
+        return module
@@ -136,13 +136,19 @@ class SirenMorpher03TrainerArgs:
                  total_worker: int = 8,
                  poser_func: Optional[Callable[[], Poser]] = None,
                  sample_output_batch_size: Optional[int] = None,
-                 pretrained_module_file_name: Optional[str] = None):
+                 pretrained_module_file_name: Optional[str] = None,
+                 use_fused_siren: bool = False,
+                 compile_siren: bool = False,
+                 render_sample_outputs_in_background: bool = False):
         for phase in training_phases.phases:
             assert phase.num_examples_upper_bound % num_training_examples_per_checkpoint == 0
 
         if poser_func is None:
             poser_func = get_poser
 
+        self.render_sample_outputs_in_background = render_sample_outputs_in_background
+        self.compile_siren = compile_siren
+        self.use_fused_siren = use_fused_siren
         self.training_phases = training_phases
         self.pretrained_module_file_name = pretrained_module_file_name
         self.sample_output_batch_size = sample_output_batch_size
@@ -190,7 +196,9 @@ class SirenMorpher03TrainerArgs:
                         image_size=512,
                         intermediate_channels=90,
                         num_sine_layers=3),
-                ]))
+                ]),
+            use_fused_siren=self.use_fused_siren,
+            compile_siren=self.compile_siren)
 
     def get_training_computation_protocol(self):
         return SirenMorpherComputationProtocol03(
@@ -246,6 +254,12 @@ class SirenMorpher03TrainerArgs:
             losses.append((term.name, loss))
         return SumLoss(losses)
 
+    def get_sample_output_protocol_func(self):
+        # The bound method is pickled into the sample output worker together with these args.
+        if self.num_training_examples_per_sample_output is None or not self.render_sample_outputs_in_background:
+            return None
+        return self.get_sample_output_protocol
+
     def create_trainer(self, prefix: str, world_size: int, distrib_backend: str = 'gloo'):
         if self.num_training_examples_per_sample_output is not None:
             sample_output_protocol = self.get_sample_output_protocol()
@@ -273,4 +287,5 @@ class SirenMorpher03TrainerArgs:
             pretrained_module_file_names=pretrained_module_file_names,
             example_per_snapshot=self.num_training_examples_per_snapshot,
             num_data_loader_workers=max(1, self.total_worker // world_size),
-            distrib_backend=distrib_backend)
+            distrib_backend=distrib_backend,
+            sample_output_protocol_func=self.get_sample_output_protocol_func())
@@ -0,0 +1,205 @@
+import argparse
+import logging
+import time
+from typing import Callable, List, Optional
+
+import torch
+from torch import Tensor
+from torch.nn import Module, Conv2d
+
+
+def can_compile() -> bool:
+    return hasattr(torch, "compile")
+
+
+class CompiledWithFallback:
+    def __init__(self, func: Callable, **compile_kwargs):
+        self.func = func
+        self.compile_kwargs = compile_kwargs
+        self.compiled_func = None
+        self.failed = not can_compile()
+
+    def __call__(self, *args):
+        if not self.failed:
+            try:
+                if self.compiled_func is None:
+                    self.compiled_func = torch.compile(self.func, **self.compile_kwargs)
+                return self.compiled_func(*args)
+            except Exception as e:
+                logging.warning(f"torch.compile failed ({e}). Falling back to eager execution.")
+                self.failed = True
+                self.compiled_func = None
+        return self.func(*args)
+
+
+def to_rows(x: Tensor) -> Tensor:
+    n, c, h, w = x.shape
+    return x.permute(0, 2, 3, 1).reshape(n * h * w, c)
+
+
+def from_rows(x: Tensor, n: int, h: int, w: int) -> Tensor:
+    return x.view(n, h, w, x.shape[1]).permute(0, 3, 1, 2)
+
+
+# Runs a chain of SineLinearLayers (plus an optional last 1x1 convolution) on the (N*H*W, C) layout, so that each
+# layer is a single addmm followed by an in-place sine instead of a conv, a scaling and a sine that each allocate a
+# full-resolution tensor.
+#
+# With fold_omega=True, omega_0 is folded into copies of the weights when the chain is created. This is meant for
+# inference, and the chain must be rebuilt if the source weights change. With fold_omega=False, the chain reads the
+# source layers' parameters on every call, so it can be used for training.
+class FusedSineChain(Module):
+    def __init__(self,
+                 sine_layers: List[Module],
+                 last_linear: Optional[Conv2d] = None,
+                 use_tanh: bool = False,
+                 fold_omega: bool = True,
+                 compile: bool = False):
+        super().__init__()
+        self.use_tanh = use_tanh
+        self.fold_omega = fold_omega
+        self.num_sine_layers = len(sine_layers)
+        self.has_last_linear = last_linear is not None
+
+        if fold_omega:
+            with torch.no_grad():
+                for i, layer in enumerate(sine_layers):
+                    weight = layer.linear.weight.view(layer.out_channels, layer.in_channels) * layer.omega_0
+                    bias = layer.linear.bias * layer.omega_0
+                    self.register_buffer(f"weight_{i}", weight.t().contiguous(), persistent=False)
+                    self.register_buffer(f"bias_{i}", bias.clone(), persistent=False)
+                if last_linear is not None:
+                    weight = last_linear.weight.view(last_linear.out_channels, last_linear.in_channels)
+                    self.register_buffer("last_weight", weight.t().contiguous(), persistent=False)
+                    self.register_buffer("last_bias", last_linear.bias.clone(), persistent=False)
+            self.source_layers = None
+            self.source_last_linear = None
+        else:
+            # Stored in a tuple so that the layers are not registered twice as submodules.
+            self.source_layers = tuple(sine_layers)
+            self.source_last_linear = (last_linear,)
+
+        if compile:
+            self.run_rows = CompiledWithFallback(self.forward_rows)
+        else:
+            self.run_rows = self.forward_rows
+
+    def get_weights(self):
+        weights = []
+        if self.fold_omega:
+            for i in range(self.num_sine_layers):
+                weights.append((getattr(self, f"weight_{i}"), getattr(self, f"bias_{i}")))
+            if self.has_last_linear:
+                last = (self.last_weight, self.last_bias)
+            else:
+                last = None
+        else:
+            for layer in self.source_layers:
+                weight = layer.linear.weight.view(layer.out_channels, layer.in_channels) * layer.omega_0
+                weights.append((weight.t(), layer.linear.bias * layer.omega_0))
+            if self.has_last_linear:
+                last_linear = self.source_last_linear[0]
+                last = (
+                    last_linear.weight.view(last_linear.out_channels, last_linear.in_channels).t(),
+                    last_linear.bias)
+            else:
+                last = None
+        return weights, last
+
+    def forward_rows(self, x: Tensor) -> Tensor:
+        weights, last = self.get_weights()
+        for weight, bias in weights:
+            x = torch.addmm(bias, x, weight)
+            if torch.is_grad_enabled():
+                x = torch.sin(x)
+            else:
+                x = x.sin_()
+        if last is not None:
+            x = torch.addmm(last[1], x, last[0])
+            if self.use_tanh:
+                x = torch.tanh(x)
+        return x
+
+    def forward(self, x: Tensor) -> Tensor:
+        n, c, h, w = x.shape
+        return from_rows(self.run_rows(to_rows(x)), n, h, w)
+
+
+def enable_fused_siren_execution(module: Module, fold_omega: bool = True, compile: bool = False) -> Module:
+    for submodule in list(module.modules()):
+        if hasattr(submodule, "set_fused_execution"):
+            submodule.set_fused_execution(True, fold_omega=fold_omega, compile=compile)
+    return module
+
+
+def disable_fused_siren_execution(module: Module) -> Module:
+    for submodule in list(module.modules()):
+        if hasattr(submodule, "set_fused_execution"):
+            submodule.set_fused_execution(False)
+    return module
+
+
+def benchmark_sine_layers(
+        configs: List[tuple],
+        device: torch.device,
+        num_iterations: int = 10,
+        compile: bool = False):
+    from tha4.nn.siren.vanilla.siren import SineLinearLayer
+
+    def synchronize():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    def time_func(func, x):
+        with torch.no_grad():
+            func(x)
+            synchronize()
+            start = time.perf_counter()
+            for _ in range(num_iterations):
+                func(x)
+            synchronize()
+        return (time.perf_counter() - start) / num_iterations * 1000.0
+
+    for in_channels, out_channels, image_size, is_first in configs:
+        layer = SineLinearLayer(in_channels, out_channels, is_first=is_first).to(device)
+        layer.train(False)
+        x = torch.rand(1, in_channels, image_size, image_size, device=device) * 2.0 - 1.0
+        eager_ms = time_func(layer.forward, x)
+        fused = FusedSineChain([layer], fold_omega=True).to(device)
+        fused_ms = time_func(fused.forward, x)
+        with torch.no_grad():
+            max_diff = (layer.forward(x) - fused.forward(x)).abs().max().item()
+        message = f"SineLinearLayer({in_channels} -> {out_channels}) @ {image_size}x{image_size}: " \
+                  f"eager = {eager_ms:.3f} ms, fused = {fused_ms:.3f} ms"
+        if compile:
+            compiled = FusedSineChain([layer], fold_omega=True, compile=True).to(device)
+            compiled_ms = time_func(compiled.forward, x)
+            message += f", fused+compile = {compiled_ms:.3f} ms"
+        message += f", max abs diff = {max_diff:.2e}"
+        print(message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-layer benchmark of the fused SIREN execution path.')
+    parser.add_argument("--device", type=str, default="cpu", help="The device to run the benchmark on.")
+    parser.add_argument("--num_iterations", type=int, default=10, help="The number of timed iterations per layer.")
+    parser.add_argument("--compile", action="store_true", help="Also time the torch.compile'd chain.")
+    args = parser.parse_args()
+
+    # The layer shapes of the mode_14 face morpher and body morpher.
+    benchmark_sine_layers(
+        [
+            (39 + 2, 128, 128, True),
+            (128, 128, 128, False),
+            (45 + 2, 360, 128, True),
+            (360, 360, 128, False),
+            (360, 180, 128, False),
+            (180 + 45 + 2, 180, 256, False),
+            (180, 180, 256, False),
+            (180, 90, 256, False),
+            (90 + 45 + 2, 90, 512, False),
+            (90, 90, 512, False),
+        ],
+        torch.device(args.device),
+        args.num_iterations,
+        args.compile)
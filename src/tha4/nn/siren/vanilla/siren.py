@@ -5,6 +5,7 @@ import torch
 from torch import Tensor
 from torch.nn import Module, Conv2d, ModuleList
 
+from tha4.nn.siren.vanilla.fused_siren import FusedSineChain
 from tha4.shion.core.module_factory import ModuleFactory
 from tha4.shion.nn00.initialization_funcs import HeInitialization
 
@@ -80,8 +81,22 @@ class Siren(Module):
             stride=1,
             padding=0,
             bias=True))
+        self.fused_chain = None
+
+    def set_fused_execution(self, enabled: bool, fold_omega: bool = True, compile: bool = False):
+        if enabled:
+            self.fused_chain = FusedSineChain(
+                list(self.sine_layers),
+                last_linear=self.last_linear,
+                use_tanh=self.args.use_tanh,
+                fold_omega=fold_omega,
+                compile=compile)
+        else:
+            self.fused_chain = None
 
     def forward(self, x: Tensor) -> Tensor:
+        if self.fused_chain is not None:
+            return self.fused_chain.forward(x)
         for i in range(self.args.num_sine_layers):
             x = self.sine_layers[i].forward(x)
         x = self.last_linear(x)
@@ -0,0 +1,383 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+from torch.nn import Module, Conv2d
+from torch.nn.functional import interpolate
+
+from tha4.charmodel.character_model import CharacterModel
+from tha4.nn.image_processing_util import GridChangeApplier
+from tha4.nn.siren.face_morpher.siren_face_morpher_00 import SirenFaceMorpher00
+from tha4.nn.siren.morpher.siren_morpher_03 import SirenMorpher03
+from tha4.poser.modes.mode_14 import load_face_morpher, load_body_morpher
+
+FACE_CENTER_X = 256
+FACE_CENTER_Y = 128 + 16
+FACE_HALF_SIZE = 64
+FACE_MORPHER_POSE_SIZE = 39
+
+
+def get_position_rows(image_size: int, device: torch.device) -> Tensor:
+    # The (H*W, 2) positions that SirenFaceMorpher00 and SirenMorpher03 feed to their first layers, in row layout.
+    position = torch.stack(torch.meshgrid(
+        (torch.arange(image_size, device=device, dtype=torch.float32) * 2 + 1) / image_size - 1,
+        (torch.arange(image_size, device=device, dtype=torch.float32) * 2 + 1) / image_size - 1,
+        indexing='ij'), dim=2)
+    # affine_grid puts x before y.
+    return position.flip(2).reshape(image_size * image_size, 2)
+
+
+def get_position_and_pose_rows(pose: Tensor, position_rows: Tensor) -> Tensor:
+    # pose: (M, N, P) -> (M, N*H*W, 2 + P), the SIREN input with the pose broadcast to every position.
+    m, n, p = pose.shape
+    num_positions = position_rows.shape[0]
+    position = position_rows.view(1, 1, num_positions, 2).expand(m, n, num_positions, 2)
+    pose = pose.view(m, n, 1, p).expand(m, n, num_positions, p)
+    return torch.cat([position, pose], dim=3).view(m, n * num_positions, 2 + p)
+
+
+def rows_to_images(x: Tensor, n: int, image_size: int) -> Tensor:
+    # (M, N*H*W, C) -> (M*N, C, H, W)
+    m, _, c = x.shape
+    return x.view(m * n, image_size, image_size, c).permute(0, 3, 1, 2)
+
+
+def images_to_rows(x: Tensor, m: int) -> Tensor:
+    # (M*N, C, H, W) -> (M, N*H*W, C)
+    mn, c, h, w = x.shape
+    return x.permute(0, 2, 3, 1).reshape(m, (mn // m) * h * w, c)
+
+
+def extract_chain(sine_layers: List[Module], last_linear: Optional[Conv2d]) -> List[Tuple[Tensor, Tensor, bool]]:
+    # Turns a chain of SineLinearLayers (and an optional last 1x1 convolution) into (weight, bias, apply_sine) triples
+    # for x @ weight + bias on the row layout, with omega_0 folded into the sine layers.
+    layers = []
+    with torch.no_grad():
+        for layer in sine_layers:
+            weight = layer.linear.weight.view(layer.out_channels, layer.in_channels) * layer.omega_0
+            layers.append((weight.t().contiguous(), layer.linear.bias * layer.omega_0, True))
+        if last_linear is not None:
+            weight = last_linear.weight.view(last_linear.out_channels, last_linear.in_channels)
+            layers.append((weight.t().contiguous(), last_linear.bias.clone(), False))
+    return layers
+
+
+# The same pointwise SIREN chain for several characters, each with its own weights. The weights are stacked along a
+# leading character dimension so that the chain runs for all characters with one batched matrix multiply per layer:
+# the input is (M, rows, channels), where the rows of character m are the pixels of all its requests.
+class StackedSineChain:
+    def __init__(self, chains: List[List[Tuple[Tensor, Tensor, bool]]]):
+        assert len(chains) >= 1
+        self.layers = []
+        for layer_index in range(len(chains[0])):
+            weight = torch.stack([chain[layer_index][0] for chain in chains], dim=0)
+            bias = torch.stack([chain[layer_index][1] for chain in chains], dim=0).unsqueeze(1)
+            self.layers.append((weight, bias, chains[0][layer_index][2]))
+
+    def forward(self, x: Tensor, character_indices: Optional[Tensor] = None) -> Tensor:
+        for weight, bias, apply_sine in self.layers:
+            if character_indices is not None:
+                weight = weight.index_select(0, character_indices)
+                bias = bias.index_select(0, character_indices)
+            x = torch.baddbmm(bias, x, weight)
+            if apply_sine:
+                x = torch.sin_(x)
+        return x
+
+
+def get_architecture(face_morpher: SirenFaceMorpher00, body_morpher: SirenMorpher03, character_image: Tensor) -> Tuple:
+    # Characters can only be stacked if all their weights and image sizes agree, so this is the key they are grouped
+    # by.
+    return (
+        face_morpher.args.image_size,
+        tuple((name, tuple(value.shape)) for name, value in face_morpher.state_dict().items()),
+        tuple(level_args.image_size for level_args in body_morpher.args.level_args),
+        tuple((name, tuple(value.shape)) for name, value in body_morpher.state_dict().items()),
+        tuple(character_image.shape),
+    )
+
+
+class HostedCharacter:
+    def __init__(self, face_morpher: SirenFaceMorpher00, body_morpher: SirenMorpher03, character_image: Tensor):
+        self.face_morpher = face_morpher
+        self.body_morpher = body_morpher
+        self.character_image = character_image
+        self.architecture = get_architecture(face_morpher, body_morpher, character_image)
+
+
+class CharacterStack:
+    # The stacked chains of the hosted characters that share one architecture, with their positions in the stack.
+    def __init__(self, character_ids: List[str], face_chain: StackedSineChain, body_chains: List[StackedSineChain]):
+        self.character_ids = character_ids
+        self.character_indices = {name: index for index, name in enumerate(character_ids)}
+        self.face_chain = face_chain
+        self.body_chains = body_chains
+
+
+def render_with_modules(character: HostedCharacter, pose: Tensor) -> Tensor:
+    # What mode_14's TwoStepPoserComputationProtocol computes for a batch of poses of one character; returns the
+    # blended images (N, 4, 512, 512).
+    n = pose.shape[0]
+    with torch.no_grad():
+        face_morpher_output = character.face_morpher.forward(pose[:, 0:FACE_MORPHER_POSE_SIZE])
+        image = character.character_image.unsqueeze(0).repeat(n, 1, 1, 1)
+        image[:, :,
+        FACE_CENTER_Y - FACE_HALF_SIZE:FACE_CENTER_Y + FACE_HALF_SIZE,
+        FACE_CENTER_X - FACE_HALF_SIZE:FACE_CENTER_X + FACE_HALF_SIZE] = face_morpher_output
+        return character.body_morpher.forward(image, pose)[SirenMorpher03.INDEX_BLENDED_IMAGE]
+
+
+class RenderRequest:
+    def __init__(self, character_id: str, pose: Tensor):
+        self.character_id = character_id
+        self.pose = pose
+        self.future = Future()
+        self.submit_time = time.perf_counter()
+
+
+class BatchedRenderServiceStats:
+    def __init__(self):
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_stacked_batches = 0
+        self.num_padded_requests = 0
+        self.total_batch_time = 0.0
+
+    def get_average_batch_size(self) -> float:
+        if self.num_batches == 0:
+            return 0.0
+        return self.num_requests / self.num_batches
+
+
+# Hosts several mode_14 characters and renders pose requests from several clients on one worker thread. The worker
+# waits up to window_ms after the first pending request to collect more, then renders up to max_batch_size requests:
+# requests for the same character go through its modules as one batch, and when several characters are involved
+# (and stack_characters is set), their face and body morpher inputs are stacked along a character dimension and run
+# through StackedSineChains, so that the whole batch is one pass per layer. Characters with fewer requests than the
+# largest group are padded by repeating their last pose. Only characters with the same architecture (image sizes and
+# weight shapes) are stacked together; a character that shares its architecture with no other character in the batch
+# is rendered with its own modules.
+#
+# submit() returns a Future of the blended image (4, 512, 512), the default output of a mode_14 poser.
+class BatchedRenderService:
+    def __init__(self,
+                 device: torch.device,
+                 window_ms: float = 4.0,
+                 max_batch_size: int = 8,
+                 stack_characters: bool = True):
+        assert max_batch_size >= 1
+        self.device = device
+        self.window_sec = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.stack_characters = stack_characters
+
+        self.characters: Dict[str, HostedCharacter] = {}
+        self.stacks: Dict[Tuple, CharacterStack] = {}
+        self.position_rows = {}
+        self.grid_change_applier = GridChangeApplier()
+
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.running = False
+        self.thread = None
+        self.stats = BatchedRenderServiceStats()
+
+    def add_character(self,
+                      character_id: str,
+                      face_morpher: SirenFaceMorpher00,
+                      body_morpher: SirenMorpher03,
+                      character_image: Tensor):
+        face_morpher = face_morpher.to(self.device).eval()
+        body_morpher = body_morpher.to(self.device).eval()
+        with self.condition:
+            self.characters[character_id] = HostedCharacter(
+                face_morpher, body_morpher, character_image.to(self.device))
+            self.stacks = {}
+
+    def add_character_model(self, character_id: str, character_model: CharacterModel):
+        self.add_character(
+            character_id,
+            load_face_morpher(character_model.face_morpher_file_name),
+            load_body_morpher(character_model.body_morpher_file_name),
+            character_model.get_character_image(self.device))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run_worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        while len(self.pending) > 0:
+            self.pending.popleft().future.cancel()
+
+    def submit(self, character_id: str, pose: Tensor) -> Future:
+        assert character_id in self.characters, f"Unknown character: {character_id}"
+        request = RenderRequest(character_id, pose.view(-1))
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        return request.future
+
+    def render(self, character_id: str, pose: Tensor) -> Tensor:
+        return self.submit(character_id, pose).result()
+
+    def take_batch(self) -> List[RenderRequest]:
+        with self.condition:
+            while self.running and len(self.pending) == 0:
+                self.condition.wait()
+            if not self.running:
+                return []
+            deadline = self.pending[0].submit_time + self.window_sec
+            while self.running and len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = []
+            while len(self.pending) > 0 and len(batch) < self.max_batch_size:
+                batch.append(self.pending.popleft())
+            return batch
+
+    def run_worker(self):
+        while True:
+            batch = self.take_batch()
+            if len(batch) == 0:
+                return
+            start_time = time.perf_counter()
+            try:
+                outputs = self.render_batch(batch)
+                for request, output in zip(batch, outputs):
+                    request.future.set_result(output)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            self.stats.num_batches += 1
+            self.stats.num_requests += len(batch)
+            self.stats.total_batch_time += time.perf_counter() - start_time
+
+    def render_batch(self, batch: List[RenderRequest]) -> List[Tensor]:
+        groups: Dict[str, List[int]] = {}
+        for index, request in enumerate(batch):
+            groups.setdefault(request.character_id, []).append(index)
+        outputs: List[Optional[Tensor]] = [None] * len(batch)
+
+        if self.stack_characters:
+            character_ids_by_architecture: Dict[Tuple, List[str]] = {}
+            for character_id in groups.keys():
+                architecture = self.characters[character_id].architecture
+                character_ids_by_architecture.setdefault(architecture, []).append(character_id)
+            stackable = [character_ids for character_ids in character_ids_by_architecture.values()
+                         if len(character_ids) > 1]
+        else:
+            stackable = []
+
+        for character_ids in stackable:
+            request_indices_by_character = {character_id: groups.pop(character_id) for character_id in character_ids}
+            n = max(len(request_indices) for request_indices in request_indices_by_character.values())
+            poses = []
+            for character_id in character_ids:
+                group_poses = [batch[i].pose for i in request_indices_by_character[character_id]]
+                self.stats.num_padded_requests += n - len(group_poses)
+                poses.append(torch.stack(group_poses + [group_poses[-1]] * (n - len(group_poses))))
+            pose = torch.stack(poses).to(self.device)
+            images = self.render_stacked(character_ids, pose)
+            for m, character_id in enumerate(character_ids):
+                for j, i in enumerate(request_indices_by_character[character_id]):
+                    outputs[i] = images[m, j]
+        if len(stackable) > 0:
+            self.stats.num_stacked_batches += 1
+
+        for character_id, request_indices in groups.items():
+            pose = torch.stack([batch[i].pose for i in request_indices]).to(self.device)
+            images = render_with_modules(self.characters[character_id], pose)
+            for i, image in zip(request_indices, images):
+                outputs[i] = image
+        return outputs
+
+    def get_position_rows(self, image_size: int) -> Tensor:
+        if image_size not in self.position_rows:
+            self.position_rows[image_size] = get_position_rows(image_size, self.device)
+        return self.position_rows[image_size]
+
+    def build_stack(self, architecture: Tuple) -> CharacterStack:
+        character_ids = [name for name, c in self.characters.items() if c.architecture == architecture]
+        characters = [self.characters[name] for name in character_ids]
+        face_chain = StackedSineChain([
+            extract_chain(list(c.face_morpher.siren.sine_layers), c.face_morpher.siren.last_linear)
+            for c in characters
+        ])
+        num_levels = len(characters[0].body_morpher.args.level_args)
+        body_chains = [
+            StackedSineChain([
+                extract_chain(
+                    list(c.body_morpher.siren_layers[level]),
+                    c.body_morpher.last_linear if level == num_levels - 1 else None)
+                for c in characters
+            ])
+            for level in range(num_levels)
+        ]
+        return CharacterStack(character_ids, face_chain, body_chains)
+
+    def render_stacked(self, character_ids: List[str], pose: Tensor) -> Tensor:
+        # pose: (M, N, 45) -> blended images (M, N, 4, 512, 512). The characters must share one architecture.
+        first = self.characters[character_ids[0]]
+        with self.condition:
+            stack = self.stacks.get(first.architecture)
+            if stack is None:
+                stack = self.build_stack(first.architecture)
+                self.stacks[first.architecture] = stack
+        face_chain = stack.face_chain
+        body_chains = stack.body_chains
+        m, n, _ = pose.shape
+        indices = torch.tensor([stack.character_indices[c] for c in character_ids], device=self.device)
+        if m == len(stack.character_ids) and bool((indices == torch.arange(m, device=self.device)).all()):
+            indices = None
+
+        with torch.no_grad():
+            face_size = first.face_morpher.args.image_size
+            face_rows = face_chain.forward(
+                get_position_and_pose_rows(pose[:, :, 0:FACE_MORPHER_POSE_SIZE], self.get_position_rows(face_size)),
+                indices)
+            face_images = rows_to_images(face_rows, n, face_size)
+
+            character_images = torch.stack([self.characters[c].character_image for c in character_ids])
+            image = character_images.unsqueeze(1).repeat(1, n, 1, 1, 1).view(m * n, *character_images.shape[1:])
+            image[:, :,
+            FACE_CENTER_Y - FACE_HALF_SIZE:FACE_CENTER_Y + FACE_HALF_SIZE,
+            FACE_CENTER_X - FACE_HALF_SIZE:FACE_CENTER_X + FACE_HALF_SIZE] = face_images
+
+            x = None
+            level_sizes = [level_args.image_size for level_args in first.body_morpher.args.level_args]
+            for level, image_size in enumerate(level_sizes):
+                position_and_pose = get_position_and_pose_rows(pose, self.get_position_rows(image_size))
+                if x is not None:
+                    previous_size = level_sizes[level - 1]
+                    if previous_size != image_size:
+                        x = interpolate(rows_to_images(x, n, previous_size), size=(image_size, image_size),
+                                        mode='bilinear')
+                        x = images_to_rows(x, m)
+                    x = torch.cat([x, position_and_pose], dim=2)
+                else:
+                    x = position_and_pose
+                x = body_chains[level].forward(x, indices)
+
+            siren_output = rows_to_images(x, n, level_sizes[-1])
+            if siren_output.shape[2] != image.shape[2] or siren_output.shape[3] != image.shape[3]:
+                siren_output = interpolate(siren_output, size=(image.shape[2], image.shape[3]), mode='bilinear')
+            grid_change = siren_output[:, 0:2, :, :].contiguous()
+            alpha = siren_output[:, 2:3, :, :]
+            color_change = siren_output[:, 3:, :, :]
+            warped_image = self.grid_change_applier.apply(grid_change, image, align_corners=False)
+            blended_image = (1 - alpha) * warped_image + alpha * color_change
+        return blended_image.view(m, n, *blended_image.shape[1:])
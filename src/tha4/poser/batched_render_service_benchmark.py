@@ -0,0 +1,165 @@
+import argparse
+import random
+import threading
+import time
+from typing import Callable, List
+
+import torch
+from torch import Tensor
+
+from tha4.charmodel.character_model import CharacterModel
+from tha4.poser.batched_render_service import BatchedRenderService, HostedCharacter, render_with_modules
+from tha4.poser.modes.mode_14 import load_face_morpher, load_body_morpher
+from tha4.poser.modes.pose_parameters import get_pose_parameters
+
+
+class PoseRandomWalk:
+    # A pose that drifts smoothly within each parameter's range, like a tracked face.
+    def __init__(self, seed: int, step: float = 0.05):
+        self.random = random.Random(seed)
+        self.step = step
+        self.ranges = []
+        for group in get_pose_parameters().get_pose_parameter_groups():
+            for _ in range(group.get_arity()):
+                self.ranges.append(group.get_range())
+        self.pose = [(low + high) / 2 for low, high in self.ranges]
+
+    def next(self) -> Tensor:
+        for i, (low, high) in enumerate(self.ranges):
+            value = self.pose[i] + self.random.uniform(-self.step, self.step) * (high - low)
+            self.pose[i] = min(high, max(low, value))
+        return torch.tensor(self.pose, dtype=torch.float32)
+
+
+class AvatarClientStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.num_skipped_frames = 0
+
+
+def run_avatar_client(render_func: Callable[[Tensor], Tensor],
+                      seed: int,
+                      fps: float,
+                      duration: float,
+                      start_time: float,
+                      stats: AvatarClientStats):
+    # Requests one frame per 1/fps seconds. A frame whose slot has passed before the previous one came back is skipped,
+    # as a puppeteer does when rendering falls behind.
+    pose_walk = PoseRandomWalk(seed)
+    frame_time = 1.0 / fps
+    frame_index = 0
+    while True:
+        scheduled_time = start_time + frame_index * frame_time
+        now = time.perf_counter()
+        if scheduled_time - start_time >= duration:
+            break
+        if now < scheduled_time:
+            time.sleep(scheduled_time - now)
+        request_time = time.perf_counter()
+        render_func(pose_walk.next())
+        stats.latencies.append(time.perf_counter() - request_time)
+        next_index = int((time.perf_counter() - start_time) / frame_time) + 1
+        stats.num_skipped_frames += max(0, next_index - frame_index - 1)
+        frame_index = max(frame_index + 1, next_index)
+
+
+def run_clients(render_funcs: List[Callable[[Tensor], Tensor]], fps: float, duration: float) -> List[AvatarClientStats]:
+    stats = [AvatarClientStats() for _ in render_funcs]
+    start_time = time.perf_counter() + 0.1
+    threads = [
+        threading.Thread(target=run_avatar_client, args=(render_func, index, fps, duration, start_time, stats[index]))
+        for index, render_func in enumerate(render_funcs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def percentile(values: List[float], q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def print_report(label: str, stats: List[AvatarClientStats], duration: float):
+    latencies = [latency for s in stats for latency in s.latencies]
+    num_frames = len(latencies)
+    num_skipped = sum(s.num_skipped_frames for s in stats)
+    print(f"{label:24s}{num_frames / duration:9.1f} fps"
+          f"{percentile(latencies, 0.5) * 1000:9.1f}{percentile(latencies, 0.95) * 1000:9.1f}"
+          f"{percentile(latencies, 0.99) * 1000:9.1f} ms{num_skipped:9d}")
+
+
+def create_characters(character_model_file_names: List[str], num_avatars: int, device: torch.device) \
+        -> List[HostedCharacter]:
+    characters = []
+    for index in range(num_avatars):
+        if len(character_model_file_names) > 0:
+            character_model = CharacterModel.load(character_model_file_names[index % len(character_model_file_names)])
+            face_morpher = load_face_morpher(character_model.face_morpher_file_name)
+            body_morpher = load_body_morpher(character_model.body_morpher_file_name)
+            character_image = character_model.get_character_image(device)
+        else:
+            # Randomly initialized modules have the same cost as trained ones.
+            face_morpher = load_face_morpher()
+            body_morpher = load_body_morpher()
+            character_image = torch.rand(4, 512, 512) * 2 - 1
+        characters.append(HostedCharacter(
+            face_morpher.to(device).eval(), body_morpher.to(device).eval(), character_image.to(device)))
+    return characters
+
+
+def benchmark_batched_render_service(
+        character_model_file_names: List[str],
+        num_avatars: int,
+        fps: float,
+        duration: float,
+        window_ms: float,
+        max_batch_size: int):
+    device = torch.device('cpu')
+    characters = create_characters(character_model_file_names, num_avatars, device)
+    print(f"{num_avatars} avatars at {fps} fps for {duration} s, {torch.get_num_threads()} torch threads")
+    print(f"{'':24s}{'throughput':>13s}{'p50':>9s}{'p95':>9s}{'p99':>12s}{'skipped':>9s}")
+
+    independent_funcs = [
+        (lambda c: lambda pose: render_with_modules(c, pose.unsqueeze(0))[0])(character)
+        for character in characters
+    ]
+    print_report("independent posers", run_clients(independent_funcs, fps, duration), duration)
+
+    for stack_characters in [False, True]:
+        service = BatchedRenderService(device, window_ms, max_batch_size, stack_characters)
+        for index, character in enumerate(characters):
+            service.add_character(str(index), character.face_morpher, character.body_morpher,
+                                  character.character_image)
+        service.start()
+        service_funcs = [
+            (lambda character_id: lambda pose: service.render(character_id, pose))(str(index))
+            for index in range(num_avatars)
+        ]
+        stats = run_clients(service_funcs, fps, duration)
+        service.stop()
+        label = "service (stacked)" if stack_characters else "service (per character)"
+        print_report(label, stats, duration)
+        print(f"{'':24s}average batch size {service.stats.get_average_batch_size():.2f}, "
+              f"{service.stats.num_padded_requests} padded requests")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Simulate avatars rendering at a fixed frame rate on the CPU, with one poser each and with the '
+                    'batched render service.')
+    parser.add_argument("--character_model", type=str, nargs="*", default=[],
+                        help="Character model YAML files, assigned to the avatars in turn. Randomly initialized "
+                             "modules are used when none is given.")
+    parser.add_argument("--num_avatars", type=int, default=4, help="The number of simulated avatars.")
+    parser.add_argument("--fps", type=float, default=30.0, help="The frame rate of each avatar.")
+    parser.add_argument("--duration", type=float, default=10.0, help="How long to run each configuration, in seconds.")
+    parser.add_argument("--window_ms", type=float, default=4.0, help="The batching window of the service.")
+    parser.add_argument("--max_batch_size", type=int, default=8, help="The largest batch the service renders.")
+    args = parser.parse_args()
+    benchmark_batched_render_service(
+        args.character_model, args.num_avatars, args.fps, args.duration, args.window_ms, args.max_batch_size)
@@ -1,8 +1,11 @@
+import time
 from typing import List, Optional, Tuple, Dict, Callable
 
 import torch
 from tha4.shion.core.cached_computation import ComputationState
+from tha4.shion.core.latency_profiler import LatencyProfiler
 from tha4.poser.poser import PoseParameterGroup, Poser
+from tha4.poser.render_quality import RenderQuality, AdaptiveRenderQualityController, RENDER_QUALITY_FULL
 from torch import Tensor
 from torch.nn import Module
 
@@ -35,11 +38,25 @@ class GeneralPoser02(Poser):
 
         self.output_length = output_length
 
+        self.render_quality = RENDER_QUALITY_FULL
+        self.applied_render_quality = None
+        self.render_quality_controller = None
+
+        self.latency_profiler = None
+
     def get_image_size(self) -> int:
         return self.image_size
 
+    def reset_output_list_func(self):
+        # Output functions that keep state between frames (such as the incremental mode_14 protocol) expose a reset
+        # attribute; it is called whenever the modules or their render resolution change.
+        reset = getattr(self.output_list_func, "reset", None)
+        if reset is not None:
+            reset()
+
     def get_modules(self):
         if self.modules is None:
+            self.reset_output_list_func()
             self.modules = {}
             for key in self.module_loaders:
                 module = self.module_loaders[key]()
@@ -48,6 +65,47 @@ class GeneralPoser02(Poser):
                 module.train(False)
         return self.modules
 
+    def set_render_quality(self, render_quality: RenderQuality):
+        self.render_quality_controller = None
+        self.render_quality = render_quality
+
+    def set_target_frame_time(self, target_frame_time: Optional[float]):
+        if target_frame_time is None:
+            self.render_quality_controller = None
+            self.render_quality = RENDER_QUALITY_FULL
+        else:
+            self.render_quality_controller = AdaptiveRenderQualityController(target_frame_time)
+
+    def get_render_quality(self) -> RenderQuality:
+        if self.render_quality_controller is not None:
+            return self.render_quality_controller.get_quality()
+        else:
+            return self.render_quality
+
+    def apply_render_quality(self, modules: Dict[str, Module]):
+        render_quality = self.get_render_quality()
+        if render_quality is self.applied_render_quality:
+            return
+        self.reset_output_list_func()
+        for key in modules:
+            for submodule in modules[key].modules():
+                if hasattr(submodule, "set_render_resolution"):
+                    submodule.set_render_resolution(
+                        render_quality.last_level_image_size,
+                        render_quality.skip_last_level)
+        self.applied_render_quality = render_quality
+
+    def enable_latency_profiling(self, capacity: int = 256) -> LatencyProfiler:
+        if self.latency_profiler is None:
+            self.latency_profiler = LatencyProfiler(self.device, capacity)
+        return self.latency_profiler
+
+    def disable_latency_profiling(self):
+        self.latency_profiler = None
+
+    def get_latency_profiler(self) -> Optional[LatencyProfiler]:
+        return self.latency_profiler
+
     def get_pose_parameter_groups(self) -> List[PoseParameterGroup]:
         return self.pose_parameters
 
@@ -75,14 +133,34 @@ class GeneralPoser02(Poser):
             modules=modules,
             accumulated_modules={},
             batch=batch,
-            outputs={})
-        return self.output_list_func(state)
+            outputs={},
+            profiler=self.latency_profiler)
+        self.apply_render_quality(modules)
+        if self.render_quality_controller is None:
+            return self.compute_posing_outputs(state)
+
+        start_time = time.perf_counter()
+        outputs = self.compute_posing_outputs(state)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self.render_quality_controller.add_frame_time(time.perf_counter() - start_time)
+        return outputs
+
+    def compute_posing_outputs(self, state: ComputationState) -> List[Tensor]:
+        if self.latency_profiler is None:
+            return self.output_list_func(state)
+        with self.latency_profiler.profile("pose"):
+            outputs = self.output_list_func(state)
+        self.latency_profiler.collect()
+        return outputs
 
     def get_output_length(self) -> int:
         return self.output_length
 
     def free(self):
         self.modules = None
+        self.applied_render_quality = None
+        self.reset_output_list_func()
 
     def get_dtype(self) -> torch.dtype:
         return self.dtype
@@ -92,6 +170,8 @@ class GeneralPoser02(Poser):
             return self
         modules = self.get_modules()
         self.device = device
+        if self.latency_profiler is not None:
+            self.latency_profiler = LatencyProfiler(device, self.latency_profiler.capacity)
         for key in modules:
             module = modules[key]
             module.to(self.device)
@@ -1,15 +1,19 @@
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple
 
 import torch
 from tha4.shion.core.cached_computation import CachedComputationProtocol, ComputationState
 from tha4.shion.core.load_save import torch_load
 from tha4.nn.siren.face_morpher.siren_face_morpher_00 import SirenFaceMorpher00Args, SirenFaceMorpher00
 from tha4.nn.siren.morpher.siren_morpher_03 import SirenMorpher03, SirenMorpher03Args, SirenMorpherLevelArgs
+from tha4.nn.siren.vanilla.fused_siren import enable_fused_siren_execution
 from tha4.nn.siren.vanilla.siren import SirenArgs
 from tha4.poser.general_poser_02 import GeneralPoser02
 from tha4.poser.modes.pose_parameters import get_pose_parameters
+from tha4.poser.pose_render_cache import DEFAULT_QUANTIZATION_STEPS
+from tha4.poser.poser import PoseParameterCategory, PoseParameters
 from torch import Tensor
+from torch.nn.functional import affine_grid, grid_sample
 
 KEY_FACE_MORPHER = "face_morpher"
 KEY_BODY_MORPHER = "body_morpher"
@@ -90,7 +94,197 @@ class TwoStepPoserComputationProtocol(CachedComputationProtocol):
             raise RuntimeError("Unsupported key: " + key)
 
 
-def load_face_morpher(file_name: Optional[str] = None):
+FACE_MORPHER_CATEGORIES = {
+    PoseParameterCategory.EYEBROW,
+    PoseParameterCategory.EYE,
+    PoseParameterCategory.IRIS_MORPH,
+    PoseParameterCategory.IRIS_ROTATION,
+    PoseParameterCategory.MOUTH,
+}
+
+
+# How far a head rotation, body rotation or breathing parameter may drift from the reference pose before a full render
+# is needed. The puppeteers render the representative poses of PoseRenderCache bins, so these allow a move to the
+# neighboring bin (with some room for rounding) but not two bins.
+DEFAULT_OTHER_CHANGE_THRESHOLDS = {
+    category: 1.5 * step for category, step in DEFAULT_QUANTIZATION_STEPS.items()
+    if category not in FACE_MORPHER_CATEGORIES
+}
+
+
+class IncrementalRenderingStats:
+    def __init__(self):
+        self.num_full_renders = 0
+        self.num_face_only_renders = 0
+
+    def get_face_only_fraction(self) -> float:
+        total = self.num_full_renders + self.num_face_only_renders
+        if total == 0:
+            return 0.0
+        else:
+            return self.num_face_only_renders / total
+
+    def get_stats_string(self) -> str:
+        return "Face-only renders = %0.1f%% of %d" % (
+            self.get_face_only_fraction() * 100.0,
+            self.num_full_renders + self.num_face_only_renders)
+
+
+# A frame-to-frame incremental version of TwoStepPoserComputationProtocol.
+#
+# The protocol remembers the body morpher output of the last full render (the reference frame). When a new pose
+# differs from the reference pose by no more than face_change_threshold in the parameters that the face morpher
+# handles, and by no more than other_change_thresholds (per category) in the rest, it reruns just the face morpher,
+# pastes its output into the character image, and warps only the output region whose sampling grid reads from the face
+# crop, reusing the reference frame's grid change, alpha and color change. A larger change in any parameter or a new
+# character image triggers a full render. The tolerance for head rotation, body rotation and breathing keeps tracker
+# jitter and the slow breathing cycle from forcing a full render on every frame of a live loop; pass zero thresholds
+# to render every such change. Because changes are measured against the reference pose rather than the previous
+# frame, the approximation error does not accumulate over time.
+#
+# The reference frame is dropped when GeneralPoser02 loads or frees its modules or changes the render quality (through
+# the reset attribute of the function returned by compute_func()), so it is never reused across resolutions. Outputs
+# of face-only renders are copies, so callers may modify them in place.
+class IncrementalTwoStepPoserComputationProtocol(TwoStepPoserComputationProtocol):
+    FACE_CENTER_X = 256
+    FACE_CENTER_Y = 128 + 16
+    FACE_HALF_SIZE = 64
+
+    def __init__(self,
+                 pose_parameters: PoseParameters,
+                 face_change_threshold: float = 0.1,
+                 keys: Optional[Keys] = None,
+                 indices: Optional[Indices] = None,
+                 other_change_thresholds: Optional[Dict[PoseParameterCategory, float]] = None):
+        super().__init__(keys, indices)
+        self.face_change_threshold = face_change_threshold
+        self.other_change_thresholds = dict(DEFAULT_OTHER_CHANGE_THRESHOLDS)
+        if other_change_thresholds is not None:
+            self.other_change_thresholds.update(other_change_thresholds)
+        self.pose_parameters = pose_parameters
+
+        self.category_parameter_indices = {}
+        for group in pose_parameters.get_pose_parameter_groups():
+            category = group.get_category()
+            if category not in self.category_parameter_indices:
+                self.category_parameter_indices[category] = []
+            start = group.get_parameter_index()
+            self.category_parameter_indices[category] += list(range(start, start + group.get_arity()))
+        self.face_parameter_indices = []
+        self.other_parameter_thresholds = []
+        for category, parameter_indices in self.category_parameter_indices.items():
+            if category in FACE_MORPHER_CATEGORIES:
+                self.face_parameter_indices += parameter_indices
+            else:
+                self.other_parameter_thresholds.append(
+                    (parameter_indices, self.other_change_thresholds.get(category, 0.0)))
+
+        self.stats = IncrementalRenderingStats()
+        self.reset()
+
+    def reset(self):
+        self.reference_image = None
+        self.reference_pose = None
+        self.reference_body_morpher_output = None
+        self.reference_sampling_grid = None
+        self.reference_face_region = None
+
+    def get_changed_categories(self, pose: Tensor, other_pose: Tensor, threshold: float = 0.0) \
+            -> Set[PoseParameterCategory]:
+        diff = (pose - other_pose).abs()
+        changed = set()
+        for category, parameter_indices in self.category_parameter_indices.items():
+            if diff[:, parameter_indices].max().item() > threshold:
+                changed.add(category)
+        return changed
+
+    def needs_full_render(self, image: Tensor, pose: Tensor) -> bool:
+        if self.reference_pose is None:
+            return True
+        if image.shape != self.reference_image.shape or pose.shape != self.reference_pose.shape:
+            return True
+        if image.device != self.reference_image.device or pose.device != self.reference_pose.device:
+            return True
+        diff = (pose - self.reference_pose).abs()
+        for parameter_indices, threshold in self.other_parameter_thresholds:
+            if diff[:, parameter_indices].max().item() > threshold:
+                return True
+        if diff[:, self.face_parameter_indices].max().item() > self.face_change_threshold:
+            return True
+        return not torch.equal(image, self.reference_image)
+
+    def compute_func(self):
+        def func(state: ComputationState) -> List[Tensor]:
+            image = state.batch[self.indices.original_image]
+            pose = state.batch[self.indices.original_pose]
+            if self.needs_full_render(image, pose):
+                output = self.get_output(self.keys.all_outputs, state)
+                self.set_reference(image, pose, state.outputs[self.keys.body_morpher_output])
+                self.stats.num_full_renders += 1
+            else:
+                state.outputs[self.keys.body_morpher_output] = self.recomposite_body_morpher_output(state)
+                output = self.get_output(self.keys.all_outputs, state)
+                self.stats.num_face_only_renders += 1
+            return output
+
+        func.reset = self.reset
+        return func
+
+    def set_reference(self, image: Tensor, pose: Tensor, body_morpher_output: List[Tensor]):
+        grid_change = body_morpher_output[SirenMorpher03.INDEX_GRID_CHANGE]
+        n, _, h, w = grid_change.shape
+        with torch.no_grad():
+            identity = torch.tensor(
+                [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
+                dtype=grid_change.dtype,
+                device=grid_change.device).unsqueeze(0).repeat(n, 1, 1)
+            base_grid = affine_grid(identity, [n, 1, h, w], align_corners=False)
+            sampling_grid = base_grid + grid_change.permute(0, 2, 3, 1)
+        self.reference_image = image.clone()
+        self.reference_pose = pose.clone()
+        self.reference_body_morpher_output = body_morpher_output
+        self.reference_sampling_grid = sampling_grid
+        self.reference_face_region = self.compute_face_region(sampling_grid, image.shape[2], image.shape[3])
+
+    def compute_face_region(self, sampling_grid: Tensor, image_height: int, image_width: int) \
+            -> Optional[Tuple[int, int, int, int]]:
+        # The face crop in normalized coordinates, grown by one pixel because bilinear sampling reads the neighbors.
+        x0 = 2.0 * (self.FACE_CENTER_X - self.FACE_HALF_SIZE - 1) / image_width - 1.0
+        x1 = 2.0 * (self.FACE_CENTER_X + self.FACE_HALF_SIZE + 1) / image_width - 1.0
+        y0 = 2.0 * (self.FACE_CENTER_Y - self.FACE_HALF_SIZE - 1) / image_height - 1.0
+        y1 = 2.0 * (self.FACE_CENTER_Y + self.FACE_HALF_SIZE + 1) / image_height - 1.0
+        x = sampling_grid[:, :, :, 0]
+        y = sampling_grid[:, :, :, 1]
+        mask = ((x > x0) & (x < x1) & (y > y0) & (y < y1)).any(dim=0)
+        rows = torch.nonzero(mask.any(dim=1)).view(-1)
+        cols = torch.nonzero(mask.any(dim=0)).view(-1)
+        if rows.shape[0] == 0:
+            return None
+        return rows[0].item(), rows[-1].item() + 1, cols[0].item(), cols[-1].item() + 1
+
+    def recomposite_body_morpher_output(self, state: ComputationState) -> List[Tensor]:
+        blended_image, alpha, color_change, warped_image, grid_change = self.reference_body_morpher_output
+        if self.reference_face_region is None:
+            return [output.clone() for output in self.reference_body_morpher_output]
+        image = self.get_output(self.keys.body_morpher_input_image, state)
+        y0, y1, x0, x1 = self.reference_face_region
+        with torch.no_grad():
+            warped_patch = grid_sample(
+                image,
+                self.reference_sampling_grid[:, y0:y1, x0:x1, :],
+                mode='bilinear',
+                padding_mode='border',
+                align_corners=False)
+            alpha_patch = alpha[:, :, y0:y1, x0:x1]
+            blended_patch = (1 - alpha_patch) * warped_patch + alpha_patch * color_change[:, :, y0:y1, x0:x1]
+            new_warped_image = warped_image.clone()
+            new_warped_image[:, :, y0:y1, x0:x1] = warped_patch
+            new_blended_image = blended_image.clone()
+            new_blended_image[:, :, y0:y1, x0:x1] = blended_patch
+        return [new_blended_image, alpha.clone(), color_change.clone(), new_warped_image, grid_change.clone()]
+
+
+def load_face_morpher(file_name: Optional[str] = None, use_fused_siren: bool = False, compile_siren: bool = False):
     module = SirenFaceMorpher00(
         SirenFaceMorpher00Args(
             image_size=128,
@@ -103,10 +297,12 @@ def load_face_morpher(file_name: Optional[str] = None):
                 num_sine_layers=8)))
     if file_name is not None:
         module.load_state_dict(torch_load(file_name))
+    if use_fused_siren:
+        enable_fused_siren_execution(module, fold_omega=True, compile=compile_siren)
     return module
 
 
-def load_body_morpher(file_name: Optional[str] = None):
+def load_body_morpher(file_name: Optional[str] = None, use_fused_siren: bool = False, compile_siren: bool = False):
     module = SirenMorpher03(
         SirenMorpher03Args(
             image_size=512,
@@ -128,13 +324,18 @@ def load_body_morpher(file_name: Optional[str] = None):
             ]))
     if file_name is not None:
         module.load_state_dict(torch_load(file_name))
+    if use_fused_siren:
+        enable_fused_siren_execution(module, fold_omega=True, compile=compile_siren)
     return module
 
 
 def create_poser(
         device: torch.device,
         module_file_names: Optional[Dict[str, str]] = None,
-        default_output_index: int = 0) -> GeneralPoser02:
+        default_output_index: int = 0,
+        use_fused_siren: bool = False,
+        compile_siren: bool = False,
+        computation_protocol: Optional[TwoStepPoserComputationProtocol] = None) -> GeneralPoser02:
     if module_file_names is None:
         module_file_names = {}
     if KEY_FACE_MORPHER not in module_file_names:
@@ -146,16 +347,19 @@ def create_poser(
 
     loaders = {
         KEY_FACE_MORPHER:
-            lambda: load_face_morpher(module_file_names[KEY_FACE_MORPHER]),
+            lambda: load_face_morpher(module_file_names[KEY_FACE_MORPHER], use_fused_siren, compile_siren),
         KEY_BODY_MORPHER:
-            lambda: load_body_morpher(module_file_names[KEY_BODY_MORPHER]),
+            lambda: load_body_morpher(module_file_names[KEY_BODY_MORPHER], use_fused_siren, compile_siren),
     }
 
+    if computation_protocol is None:
+        computation_protocol = TwoStepPoserComputationProtocol()
+
     return GeneralPoser02(
         image_size=512,
         module_loaders=loaders,
         pose_parameters=get_pose_parameters().get_pose_parameter_groups(),
-        output_list_func=TwoStepPoserComputationProtocol().compute_func(),
+        output_list_func=computation_protocol.compute_func(),
         subrect=None,
         device=device,
         output_length=5 + 1,
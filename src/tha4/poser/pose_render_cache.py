@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Hashable, Tuple
+
+import numpy
+
+from tha4.poser.poser import PoseParameterCategory, PoseParameterGroup
+
+# Finer steps for the parameters whose small changes are visible (eyes, irises, head rotation), coarser ones for
+# parameters that move large, soft regions slowly (breathing).
+DEFAULT_QUANTIZATION_STEPS = {
+    PoseParameterCategory.EYEBROW: 0.05,
+    PoseParameterCategory.EYE: 0.02,
+    PoseParameterCategory.IRIS_MORPH: 0.02,
+    PoseParameterCategory.IRIS_ROTATION: 0.02,
+    PoseParameterCategory.MOUTH: 0.04,
+    PoseParameterCategory.FACE_ROTATION: 0.02,
+    PoseParameterCategory.BODY_ROTATION: 0.04,
+    PoseParameterCategory.BREATHING: 0.1,
+}
+
+
+class PoseRenderCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get_lookups(self) -> int:
+        return self.hits + self.misses
+
+    def get_hit_rate(self) -> float:
+        lookups = self.get_lookups()
+        if lookups == 0:
+            return 0.0
+        else:
+            return self.hits / lookups
+
+
+# An LRU cache of rendered frames keyed by the pose quantized per PoseParameterCategory. Poses that fall into the same
+# bins map to the same entry, so sensor jitter and idle or repeated expressions are served from memory. Callers should
+# render the bin's representative pose (see dequantize) rather than the raw pose so that the cached frame does not
+# depend on which pose in the bin happened to be rendered first.
+class PoseRenderCache:
+    def __init__(self,
+                 pose_parameter_groups: List[PoseParameterGroup],
+                 quantization_steps: Optional[Dict[PoseParameterCategory, float]] = None,
+                 max_entries: int = 1024,
+                 max_bytes: Optional[int] = 512 * 1024 * 1024):
+        assert max_entries >= 1
+        self.pose_parameter_groups = pose_parameter_groups
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.quantization_steps = dict(DEFAULT_QUANTIZATION_STEPS)
+        if quantization_steps is not None:
+            self.quantization_steps.update(quantization_steps)
+        self.update_parameter_steps()
+
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.stats = PoseRenderCacheStats()
+
+    def update_parameter_steps(self):
+        steps = []
+        for group in self.pose_parameter_groups:
+            step = self.quantization_steps[group.get_category()]
+            assert step > 0.0
+            steps += [step] * group.get_arity()
+        self.parameter_steps = numpy.array(steps, dtype=numpy.float64)
+        self.parameter_lower_bounds = numpy.array(
+            [group.get_range()[0] for group in self.pose_parameter_groups for _ in range(group.get_arity())])
+        self.parameter_upper_bounds = numpy.array(
+            [group.get_range()[1] for group in self.pose_parameter_groups for _ in range(group.get_arity())])
+
+    def set_quantization_step(self, category: PoseParameterCategory, step: float):
+        self.quantization_steps[category] = step
+        self.update_parameter_steps()
+        self.clear()
+
+    def get_quantization_step(self, category: PoseParameterCategory) -> float:
+        return self.quantization_steps[category]
+
+    def quantize(self, pose: List[float]) -> Tuple[int, ...]:
+        bins = numpy.rint(numpy.asarray(pose, dtype=numpy.float64) / self.parameter_steps)
+        return tuple(bins.astype(numpy.int64).tolist())
+
+    def dequantize(self, quantized_pose: Tuple[int, ...]) -> List[float]:
+        pose = numpy.asarray(quantized_pose, dtype=numpy.float64) * self.parameter_steps
+        return numpy.clip(pose, self.parameter_lower_bounds, self.parameter_upper_bounds).tolist()
+
+    def make_key(self, pose: List[float], extra_key: Hashable = None) -> Tuple:
+        return self.quantize(pose), extra_key
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return self.entries[key]
+        else:
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: Tuple, frame: numpy.ndarray):
+        if key in self.entries:
+            self.num_bytes -= self.entries[key].nbytes
+            del self.entries[key]
+        self.entries[key] = frame
+        self.num_bytes += frame.nbytes
+        while len(self.entries) > self.max_entries \
+                or (self.max_bytes is not None and self.num_bytes > self.max_bytes and len(self.entries) > 1):
+            _, evicted = self.entries.popitem(last=False)
+            self.num_bytes -= evicted.nbytes
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += evicted.nbytes
+
+    def get_or_render(self,
+                      pose: List[float],
+                      render_func: Callable[[List[float]], numpy.ndarray],
+                      extra_key: Hashable = None) -> numpy.ndarray:
+        key = self.make_key(pose, extra_key)
+        frame = self.get(key)
+        if frame is None:
+            frame = render_func(self.dequantize(key[0]))
+            self.put(key, frame)
+        return frame
+
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+    def get_num_entries(self) -> int:
+        return len(self.entries)
+
+    def get_memory_footprint(self) -> int:
+        return self.num_bytes
+
+    def get_stats_string(self) -> str:
+        return "Cache: hit rate = %0.1f%%, %d entries, %0.1f MB, %d evictions" % (
+            self.stats.get_hit_rate() * 100.0,
+            self.get_num_entries(),
+            self.get_memory_footprint() / (1024 * 1024),
+            self.stats.evictions)
@@ -5,6 +5,8 @@ from typing import Tuple, List, Optional
 import torch
 from torch import Tensor
 
+from tha4.shion.core.latency_profiler import LatencyProfiler
+
 
 class PoseParameterCategory(Enum):
     EYEBROW = 1
@@ -157,6 +159,12 @@ class Poser(ABC):
     def get_dtype(self) -> torch.dtype:
         return torch.float
 
+    def enable_latency_profiling(self, capacity: int = 256) -> Optional[LatencyProfiler]:
+        return None
+
+    def get_latency_profiler(self) -> Optional[LatencyProfiler]:
+        return None
+
     @abstractmethod
     def to(self, device: torch.device):
         pass
\ No newline at end of file
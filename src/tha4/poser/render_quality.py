@@ -0,0 +1,85 @@
+from typing import List, Optional
+
+
+class RenderQuality:
+    def __init__(self, name: str, last_level_image_size: Optional[int] = None, skip_last_level: bool = False):
+        self.skip_last_level = skip_last_level
+        self.last_level_image_size = last_level_image_size
+        self.name = name
+
+    def __repr__(self):
+        return f"RenderQuality({self.name})"
+
+
+# Ordered from the best looking to the fastest. For the mode_14 body morpher (levels at 128, 256 and 512), the
+# per-frame cost is roughly 100%, 80%, 67%, 55% and 32% of the full-quality render.
+RENDER_QUALITY_FULL = RenderQuality("full")
+RENDER_QUALITY_HIGH = RenderQuality("high", last_level_image_size=384)
+RENDER_QUALITY_MEDIUM = RenderQuality("medium", last_level_image_size=256)
+RENDER_QUALITY_LOW = RenderQuality("low", skip_last_level=True)
+RENDER_QUALITY_LOWEST = RenderQuality("lowest", last_level_image_size=128)
+
+RENDER_QUALITIES = [
+    RENDER_QUALITY_FULL,
+    RENDER_QUALITY_HIGH,
+    RENDER_QUALITY_MEDIUM,
+    RENDER_QUALITY_LOW,
+    RENDER_QUALITY_LOWEST,
+]
+
+
+def get_render_quality(name: str) -> RenderQuality:
+    for quality in RENDER_QUALITIES:
+        if quality.name == name:
+            return quality
+    raise RuntimeError(f"Unknown render quality: {name}")
+
+
+# Picks a render quality from the measured frame times. The quality drops a step as soon as the smoothed frame time
+# exceeds the target and only goes back up once there is comfortable headroom, with a cool-down in between so that
+# it does not oscillate around the boundary.
+class AdaptiveRenderQualityController:
+    def __init__(self,
+                 target_frame_time: float,
+                 qualities: Optional[List[RenderQuality]] = None,
+                 smoothing: float = 0.8,
+                 upgrade_headroom: float = 0.55,
+                 frames_between_changes: int = 15):
+        if qualities is None:
+            qualities = RENDER_QUALITIES
+        assert len(qualities) >= 1
+        assert target_frame_time > 0.0
+        self.frames_between_changes = frames_between_changes
+        self.upgrade_headroom = upgrade_headroom
+        self.smoothing = smoothing
+        self.qualities = qualities
+        self.target_frame_time = target_frame_time
+
+        self.quality_index = 0
+        self.smoothed_frame_time = None
+        self.frames_since_change = 0
+
+    def get_quality(self) -> RenderQuality:
+        return self.qualities[self.quality_index]
+
+    def add_frame_time(self, frame_time: float):
+        if self.smoothed_frame_time is None:
+            self.smoothed_frame_time = frame_time
+        else:
+            self.smoothed_frame_time = \
+                self.smoothing * self.smoothed_frame_time + (1.0 - self.smoothing) * frame_time
+        self.frames_since_change += 1
+        if self.frames_since_change < self.frames_between_changes:
+            return
+
+        if self.smoothed_frame_time > self.target_frame_time \
+                and self.quality_index < len(self.qualities) - 1:
+            self.change_quality(self.quality_index + 1)
+        elif self.smoothed_frame_time < self.target_frame_time * self.upgrade_headroom \
+                and self.quality_index > 0:
+            self.change_quality(self.quality_index - 1)
+
+    def change_quality(self, quality_index: int):
+        self.quality_index = quality_index
+        self.frames_since_change = 0
+        self.smoothed_frame_time = None
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Set, Tuple
+
+from tha4.pytasuku.task import Task, CommandTask, FileTask, PlaceholderTask
+
+DEFAULT_HASH_DATABASE_FILE_NAME = ".pytasuku_hashes.json"
+
+
+def hash_file_content(file_name: str, chunk_size: int = 1024 * 1024) -> str:
+    hasher = hashlib.sha256()
+    with open(file_name, "rb") as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# A sidecar database that records (1) the content hash of every file the runner has looked at, keyed by the file's
+# size and modification time so that a file is only rehashed after it has been written or touched, and (2) for every
+# file task, the signature of the inputs it was last built from.
+class ContentHashDatabase:
+    def __init__(self, file_name: Optional[str] = None):
+        self.file_name = file_name
+        self.file_hashes: Dict[str, Tuple[int, int, str]] = {}
+        self.task_signatures: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.num_hashed_files = 0
+        if file_name is not None and os.path.isfile(file_name):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.file_name, "rt") as fin:
+                data = json.load(fin)
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable hash database %s: %s" % (self.file_name, e))
+            return
+        self.file_hashes = {name: tuple(value) for name, value in data.get("files", {}).items()}
+        self.task_signatures = dict(data.get("tasks", {}))
+
+    def save(self):
+        if self.file_name is None:
+            return
+        with self.lock:
+            data = {
+                "files": {name: list(value) for name, value in self.file_hashes.items()},
+                "tasks": dict(self.task_signatures),
+            }
+        dir_name = os.path.dirname(self.file_name)
+        if dir_name != "":
+            os.makedirs(dir_name, exist_ok=True)
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "wt") as fout:
+            json.dump(data, fout)
+        os.replace(temp_file_name, self.file_name)
+
+    def get_file_hash(self, file_name: str) -> str:
+        stat = os.stat(file_name)
+        with self.lock:
+            entry = self.file_hashes.get(file_name)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        content_hash = hash_file_content(file_name)
+        with self.lock:
+            self.file_hashes[file_name] = (stat.st_size, stat.st_mtime_ns, content_hash)
+            self.num_hashed_files += 1
+        return content_hash
+
+    def get_task_signature(self, name: str) -> Optional[str]:
+        with self.lock:
+            return self.task_signatures.get(name)
+
+    def set_task_signature(self, name: str, signature: str):
+        with self.lock:
+            self.task_signatures[name] = signature
+
+
+class ParallelRunStats:
+    def __init__(self):
+        self.num_tasks = 0
+        self.num_executed = 0
+        self.num_skipped = 0
+        self.executed_tasks: List[str] = []
+
+
+# Runs the tasks a target depends on in topological order, executing independent tasks concurrently on a bounded
+# thread pool. Threads are used because tasks are arbitrary closures; the speedup comes from tasks that release the GIL
+# (PyTorch, file I/O, subprocesses).
+#
+# Without a hash database, whether a FileTask is up to date is decided by modification times, as Workspace.run does.
+#
+# With a persistent hash database, it is decided by content instead: a task is skipped when its output exists and the
+# signature of its inputs (the task's name and type and the content hashes of the files it depends on) matches the one
+# recorded the last time it was built. A file task without a recorded signature (for example, one built by
+# Workspace.run) falls back to the mtime rule once, and its signature is recorded if it is up to date. The signature
+# does not cover the code or the parameters of the task, so this mode is opt-in: after changing them, delete the
+# task's output (or the database) to rebuild it.
+#
+# CommandTasks always run, and so does every file task that depends on one, as with Workspace.run.
+class ParallelRunner:
+    def __init__(self,
+                 workspace: 'Workspace',
+                 max_workers: Optional[int] = None,
+                 hash_database: Optional[ContentHashDatabase] = None):
+        self.workspace = workspace
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        assert self.max_workers >= 1
+        # An in-memory database would have no recorded signatures, so every file task would fall back to the mtime rule
+        # after hashing its inputs for nothing. Only a persistent database turns the content check on.
+        if hash_database is not None and hash_database.file_name is None:
+            hash_database = None
+        self.hash_database = hash_database
+
+    def collect_tasks(self, names: List[str]) -> List[str]:
+        # Returns the tasks reachable from names, dependencies first.
+        order = []
+        visited: Set[str] = set()
+        for root in names:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self.workspace.get_task(root).dependencies))]
+            while len(stack) > 0:
+                name, dep_iter = stack[-1]
+                dep = next(dep_iter, None)
+                if dep is None:
+                    stack.pop()
+                    order.append(name)
+                elif dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(self.workspace.get_task(dep).dependencies)))
+        return order
+
+    def compute_signature(self, task: Task, ran: Dict[str, bool]) -> Optional[str]:
+        # Returns None when the task must run regardless of content (it depends on a command).
+        hasher = hashlib.sha256()
+        hasher.update(("%s.%s\0%s\0" % (type(task).__module__, type(task).__qualname__, task.name)).encode("utf-8"))
+        for dep in task.dependencies:
+            dep_task = self.workspace.get_task(dep)
+            if isinstance(dep_task, CommandTask):
+                return None
+            if os.path.isfile(dep):
+                hasher.update(("%s\0%s\0" % (dep, self.hash_database.get_file_hash(dep))).encode("utf-8"))
+            elif ran[dep]:
+                return None
+            else:
+                hasher.update(("%s\0-\0" % dep).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def is_up_to_date_by_timestamp(self, task: Task, ran: Dict[str, bool]) -> bool:
+        self_timestamp = os.path.getmtime(task.name)
+        for dep in task.dependencies:
+            if ran[dep] or self.workspace.get_task(dep).timestamp > self_timestamp:
+                return False
+        return True
+
+    def process(self, name: str, ran: Dict[str, bool]) -> bool:
+        # Runs the task if needed. Returns whether it was run. Called once all dependencies have been processed.
+        task = self.workspace.get_task(name)
+        if isinstance(task, PlaceholderTask):
+            if not os.path.isfile(name):
+                task.run()
+            return False
+        if not isinstance(task, FileTask):
+            if task.needs_to_be_run:
+                task.run()
+                return True
+            return False
+
+        if self.hash_database is None:
+            if os.path.isfile(name) and self.is_up_to_date_by_timestamp(task, ran):
+                return False
+            logging.info("Running task %s ..." % name)
+            task.run()
+            return True
+
+        signature = self.compute_signature(task, ran)
+        if os.path.isfile(name) and signature is not None:
+            recorded_signature = self.hash_database.get_task_signature(name)
+            if recorded_signature == signature:
+                return False
+            if recorded_signature is None and self.is_up_to_date_by_timestamp(task, ran):
+                self.hash_database.set_task_signature(name, signature)
+                return False
+
+        logging.info("Running task %s ..." % name)
+        task.run()
+        if signature is not None and os.path.isfile(name):
+            self.hash_database.get_file_hash(name)
+            self.hash_database.set_task_signature(name, signature)
+        return True
+
+    def run(self, names: List[str]) -> ParallelRunStats:
+        for name in names:
+            if not self.workspace.task_exists(name):
+                raise RuntimeError("Task %s does not exists" % name)
+        order = self.collect_tasks(names)
+        position = {name: index for index, name in enumerate(order)}
+        num_pending_deps = {}
+        dependents: Dict[str, List[str]] = {name: [] for name in order}
+        for name in order:
+            deps = set(self.workspace.get_task(name).dependencies)
+            num_pending_deps[name] = len(deps)
+            for dep in deps:
+                dependents[dep].append(name)
+
+        stats = ParallelRunStats()
+        stats.num_tasks = len(order)
+        ran: Dict[str, bool] = {}
+        ready = [name for name in order if num_pending_deps[name] == 0]
+        running: Dict[Future, str] = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pytasuku") as executor:
+            try:
+                while error is None and (len(ready) > 0 or len(running) > 0):
+                    # Submit in the serial runner's order so that a single worker behaves like Workspace.run.
+                    ready.sort(key=lambda n: position[n], reverse=True)
+                    while len(ready) > 0 and len(running) < self.max_workers:
+                        name = ready.pop()
+                        running[executor.submit(self.process, name, ran)] = name
+                    done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        if future.exception() is not None:
+                            error = error or future.exception()
+                            continue
+                        ran[name] = future.result()
+                        if ran[name]:
+                            stats.num_executed += 1
+                            stats.executed_tasks.append(name)
+                        else:
+                            stats.num_skipped += 1
+                        for dependent in dependents[name]:
+                            num_pending_deps[dependent] -= 1
+                            if num_pending_deps[dependent] == 0:
+                                ready.append(dependent)
+            finally:
+                if self.hash_database is not None:
+                    self.hash_database.save()
+        if error is not None:
+            raise error
+        return stats
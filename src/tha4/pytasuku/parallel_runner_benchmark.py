@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, List
+
+from tha4.pytasuku.parallel_runner import ContentHashDatabase
+from tha4.pytasuku.workspace import Workspace
+
+
+# Builds a layered synthetic DAG of file tasks. Every task reads its dependencies and writes a small file whose content
+# only depends on theirs. The per-task work is either nothing, a sleep (standing in for I/O or a subprocess), or
+# hashing a buffer (CPU work that releases the GIL).
+class SyntheticDag:
+    def __init__(self,
+                 root_dir: str,
+                 num_tasks: int,
+                 num_layers: int,
+                 max_dependencies: int,
+                 work: str,
+                 work_amount: float,
+                 seed: int = 0):
+        self.root_dir = root_dir
+        self.max_dependencies = max_dependencies
+        self.work = work
+        self.work_amount = work_amount
+        self.seed = seed
+        self.executions = []
+        self.lock = threading.Lock()
+
+        self.source_files = [os.path.join(root_dir, "source_%03d.txt" % i) for i in range(max(1, num_tasks // 100))]
+        self.layers: List[List[str]] = [self.source_files]
+        tasks_per_layer = max(1, num_tasks // num_layers)
+        for layer_index in range(num_layers):
+            layer = [os.path.join(root_dir, "task_%02d_%05d.txt" % (layer_index, i)) for i in range(tasks_per_layer)]
+            self.layers.append(layer)
+        self.all_file = os.path.join(root_dir, "all")
+
+    def get_task_files(self) -> List[str]:
+        return [name for layer in self.layers[1:] for name in layer]
+
+    def write_sources(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        for index, file_name in enumerate(self.source_files):
+            with open(file_name, "wt") as fout:
+                fout.write("source %d\n" % index)
+
+    def touch_sources(self):
+        # Updates the modification time of the source files without changing their content, as a checkout or a copy
+        # would.
+        now = time.time() + 1.0
+        for file_name in self.source_files:
+            os.utime(file_name, (now, now))
+
+    def do_work(self):
+        if self.work == "sleep":
+            time.sleep(self.work_amount)
+        elif self.work == "hash":
+            hashlib.sha256(b"\0" * int(self.work_amount)).digest()
+
+    def create_task_func(self, file_name: str, dependencies: List[str]) -> Callable[[], None]:
+        def func():
+            with self.lock:
+                self.executions.append(file_name)
+            self.do_work()
+            hasher = hashlib.sha256()
+            for dep in dependencies:
+                with open(dep, "rb") as fin:
+                    hasher.update(fin.read())
+            with open(file_name, "wt") as fout:
+                fout.write(hasher.hexdigest())
+
+        return func
+
+    def define_tasks(self, workspace: Workspace):
+        rng = random.Random(self.seed)
+        for layer_index in range(1, len(self.layers)):
+            previous_layer = self.layers[layer_index - 1]
+            for file_name in self.layers[layer_index]:
+                num_deps = rng.randint(1, min(len(previous_layer), self.max_dependencies))
+                dependencies = rng.sample(previous_layer, num_deps)
+                workspace.create_file_task(file_name, dependencies, self.create_task_func(file_name, dependencies))
+        workspace.create_command_task(self.all_file, self.layers[-1])
+
+
+def clear_outputs(dag: SyntheticDag):
+    for file_name in dag.get_task_files():
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+
+def time_run(dag: SyntheticDag, run_func: Callable[[Workspace], None]):
+    workspace = Workspace()
+    dag.define_tasks(workspace)
+    dag.executions = []
+    start = time.perf_counter()
+    with workspace.session():
+        run_func(workspace)
+    return time.perf_counter() - start, len(dag.executions)
+
+
+def benchmark_parallel_runner(num_tasks: int, num_layers: int, work: str, work_amount: float, max_workers: int):
+    root_dir = tempfile.mkdtemp(prefix="pytasuku_benchmark_")
+    try:
+        dag = SyntheticDag(root_dir, num_tasks, num_layers, 3, work, work_amount)
+        dag.write_sources()
+        database_file_name = os.path.join(root_dir, "hashes.json")
+
+        def run_serial(workspace: Workspace):
+            workspace.run(dag.all_file)
+
+        def run_parallel(workspace: Workspace):
+            workspace.run_parallel(dag.all_file, max_workers, ContentHashDatabase(database_file_name))
+
+        num_task_files = len(dag.get_task_files())
+        print(f"{num_task_files} file tasks in {num_layers} layers, work = {work} ({work_amount}), "
+              f"{max_workers} workers")
+        print(f"{'':24s}{'Workspace.run':>22s}{'ParallelRunner':>22s}")
+
+        results = {}
+        for runner_name, run_func in [("serial", run_serial), ("parallel", run_parallel)]:
+            clear_outputs(dag)
+            if os.path.isfile(database_file_name):
+                os.remove(database_file_name)
+            results[runner_name] = [
+                time_run(dag, run_func),
+                time_run(dag, run_func),
+            ]
+            dag.touch_sources()
+            results[runner_name].append(time_run(dag, run_func))
+
+        for index, label in enumerate(["clean build", "no-op rebuild", "touched sources"]):
+            serial_time, serial_count = results["serial"][index]
+            parallel_time, parallel_count = results["parallel"][index]
+            print(f"{label:24s}{serial_time:9.3f} s {serial_count:6d} runs{parallel_time:9.3f} s {parallel_count:6d} runs")
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare Workspace.run with the parallel content-hashed runner on a synthetic task DAG.')
+    parser.add_argument("--num_tasks", type=int, default=2000, help="The approximate number of file tasks.")
+    parser.add_argument("--num_layers", type=int, default=8, help="The depth of the DAG.")
+    parser.add_argument("--work", type=str, default="sleep", choices=["none", "sleep", "hash"],
+                        help="What each task does besides reading its inputs and writing its output.")
+    parser.add_argument("--work_amount", type=float, default=0.002,
+                        help="Seconds to sleep, or the number of bytes to hash.")
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count() or 1,
+                        help="The number of worker threads of the parallel runner.")
+    args = parser.parse_args()
+    benchmark_parallel_runner(args.num_tasks, args.num_layers, args.work, args.work_amount, args.max_workers)
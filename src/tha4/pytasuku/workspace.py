@@ -1,7 +1,8 @@
 from contextlib import contextmanager
 from enum import Enum
-from typing import List
+from typing import List, Optional, Union
 
+from tha4.pytasuku.parallel_runner import ParallelRunner, ParallelRunStats, ContentHashDatabase
 from tha4.pytasuku.task import Task, CommandTask, FileTask, PlaceholderTask
 
 
@@ -126,6 +127,21 @@ class Workspace:
             raise RuntimeError("Task %s does not exists" % name)
         self.run_helper(name)
 
+    def run_parallel(self,
+                     names: Union[str, List[str]],
+                     max_workers: Optional[int] = None,
+                     hash_database: Optional[ContentHashDatabase] = None) -> ParallelRunStats:
+        """
+        Run the given tasks and their dependencies with ParallelRunner, which executes independent tasks concurrently.
+        File tasks are checked by modification time unless a persistent hash_database is given, in which case they are
+        checked by the content of their inputs (but not by changes to the task's code or parameters).
+        """
+        if not self.in_session:
+            raise RuntimeError("A task can only be run when the workspace is in session.")
+        if isinstance(names, str):
+            names = [names]
+        return ParallelRunner(self, max_workers, hash_database).run(names)
+
     def run_helper(self, name):
         task = self.get_task(name)
         for dep in task.dependencies:
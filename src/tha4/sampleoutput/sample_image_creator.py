@@ -5,7 +5,6 @@ from typing import List
 
 import numpy
 import torch
-from matplotlib import cm
 from torch import Tensor
 from torch.nn.functional import interpolate
 
@@ -58,6 +57,7 @@ def torch_grid_change_to_numpy_image(torch_image, num_channels=3):
     height = torch_image.shape[1]
     width = torch_image.shape[2]
     size_image = (torch_image[0, :, :] ** 2 + torch_image[1, :, :] ** 2).sqrt().view(height, width, 1).numpy()
+    from matplotlib import cm
     hsv = cm.get_cmap('hsv')
     angle_image = hsv(((torch.atan2(
         torch_image[0, :, :].view(height * width),
@@ -1,6 +1,7 @@
 import torch
 from torch.utils.data import Dataset, TensorDataset
 
+from tha4.shion.base.dataset.mmap_tensor_dataset import MmapTensorDataset, is_mmap_tensor_file
 from tha4.shion.core.load_save import torch_load
 
 
@@ -11,6 +12,9 @@ class LazyTensorDataset(Dataset):
 
     def get_dataset(self):
         if self.dataset is None:
+            if is_mmap_tensor_file(self.file_name):
+                self.dataset = MmapTensorDataset(self.file_name)
+                return self.dataset
             data = torch_load(self.file_name)
             if isinstance(data, torch.Tensor):
                 self.dataset = TensorDataset(data)
@@ -0,0 +1,262 @@
+import argparse
+import bisect
+import json
+import os
+import struct
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy
+import torch
+from torch import Tensor
+from torch.utils.data import Dataset
+
+from tha4.shion.core.load_save import torch_load
+
+MMAP_TENSOR_FILE_MAGIC = b"SHIONMMT"
+MMAP_TENSOR_FILE_VERSION = 1
+MMAP_TENSOR_FILE_EXTENSION = ".mmap"
+MMAP_TENSOR_FILE_ALIGNMENT = 64
+
+KIND_DATA = "data"
+KIND_SHARDS = "shards"
+
+# magic (8 bytes) + version (uint32) + header length (uint32)
+_PREAMBLE_FORMAT = "<8sII"
+_PREAMBLE_SIZE = struct.calcsize(_PREAMBLE_FORMAT)
+
+
+def _align(offset: int) -> int:
+    return (offset + MMAP_TENSOR_FILE_ALIGNMENT - 1) // MMAP_TENSOR_FILE_ALIGNMENT * MMAP_TENSOR_FILE_ALIGNMENT
+
+
+def _encode_header(header: dict) -> bytes:
+    return json.dumps(header, sort_keys=True).encode("utf-8")
+
+
+def _write_mmap_file(file_name: str, header: dict, arrays: List[numpy.ndarray]):
+    # The tensor offsets depend on the header length, which in turn depends on the offsets, so we reserve room for
+    # the offsets first and then fill them in. Offsets are padded to the alignment, so their digit count settles
+    # after at most a couple of rounds.
+    tensors = header.get("tensors", [])
+    for entry in tensors:
+        entry["offset"] = 0
+    while True:
+        header_bytes = _encode_header(header)
+        offset = _align(_PREAMBLE_SIZE + len(header_bytes))
+        changed = False
+        for entry, array in zip(tensors, arrays):
+            if entry["offset"] != offset:
+                entry["offset"] = offset
+                changed = True
+            offset = _align(offset + array.nbytes)
+        if not changed:
+            break
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    temp_file_name = file_name + ".tmp"
+    with open(temp_file_name, "wb") as fout:
+        fout.write(struct.pack(_PREAMBLE_FORMAT, MMAP_TENSOR_FILE_MAGIC, MMAP_TENSOR_FILE_VERSION, len(header_bytes)))
+        fout.write(header_bytes)
+        for entry, array in zip(tensors, arrays):
+            fout.write(b"\0" * (entry["offset"] - fout.tell()))
+            fout.write(numpy.ascontiguousarray(array).tobytes(order="C"))
+    os.replace(temp_file_name, file_name)
+
+
+def read_mmap_tensor_file_header(file_name: str) -> dict:
+    with open(file_name, "rb") as fin:
+        preamble = fin.read(_PREAMBLE_SIZE)
+        if len(preamble) < _PREAMBLE_SIZE:
+            raise RuntimeError(f"{file_name} is not a memory-mapped tensor file.")
+        magic, version, header_length = struct.unpack(_PREAMBLE_FORMAT, preamble)
+        if magic != MMAP_TENSOR_FILE_MAGIC:
+            raise RuntimeError(f"{file_name} is not a memory-mapped tensor file.")
+        if version != MMAP_TENSOR_FILE_VERSION:
+            raise RuntimeError(f"Unsupported memory-mapped tensor file version {version} in {file_name}.")
+        return json.loads(fin.read(header_length).decode("utf-8"))
+
+
+def is_mmap_tensor_file(file_name: str) -> bool:
+    if not os.path.isfile(file_name):
+        return False
+    with open(file_name, "rb") as fin:
+        return fin.read(len(MMAP_TENSOR_FILE_MAGIC)) == MMAP_TENSOR_FILE_MAGIC
+
+
+def get_shard_file_name(file_name: str, shard_index: int):
+    base, ext = os.path.splitext(file_name)
+    return f"{base}.{shard_index:05d}{ext}"
+
+
+def save_mmap_tensor_file(
+        tensors: Union[Tensor, Sequence[Tensor]],
+        file_name: str,
+        num_examples_per_shard: Optional[int] = None):
+    if isinstance(tensors, Tensor):
+        tensors = [tensors]
+    assert len(tensors) >= 1
+    num_examples = tensors[0].shape[0]
+    for tensor in tensors:
+        assert tensor.shape[0] == num_examples, "All tensors must have the same number of examples."
+    arrays = [tensor.detach().cpu().contiguous().numpy() for tensor in tensors]
+
+    def write_data_file(shard_file_name: str, start: int, end: int):
+        header = {
+            "kind": KIND_DATA,
+            "num_examples": end - start,
+            "tensors": [
+                {
+                    "dtype": array.dtype.str,
+                    "shape": [end - start] + list(array.shape[1:]),
+                }
+                for array in arrays
+            ],
+        }
+        _write_mmap_file(shard_file_name, header, [array[start:end] for array in arrays])
+
+    if num_examples_per_shard is None or num_examples_per_shard >= num_examples:
+        write_data_file(file_name, 0, num_examples)
+        return
+
+    assert num_examples_per_shard >= 1
+    shards = []
+    for shard_index, start in enumerate(range(0, num_examples, num_examples_per_shard)):
+        end = min(num_examples, start + num_examples_per_shard)
+        shard_file_name = get_shard_file_name(file_name, shard_index)
+        write_data_file(shard_file_name, start, end)
+        shards.append({
+            "file_name": os.path.basename(shard_file_name),
+            "num_examples": end - start,
+        })
+    _write_mmap_file(file_name, {"kind": KIND_SHARDS, "num_examples": num_examples, "shards": shards}, [])
+
+
+def convert_torch_file_to_mmap_tensor_file(
+        source_file_name: str,
+        dest_file_name: str,
+        num_examples_per_shard: Optional[int] = None):
+    data = torch_load(source_file_name)
+    if isinstance(data, Tensor):
+        tensors = [data]
+    elif isinstance(data, tuple) or isinstance(data, list):
+        tensors = list(data)
+    else:
+        raise RuntimeError("Unsupported data type: " + str(type(data)))
+    save_mmap_tensor_file(tensors, dest_file_name, num_examples_per_shard)
+
+
+class _MmapTensorShard:
+    def __init__(self, file_name: str):
+        header = read_mmap_tensor_file_header(file_name)
+        if header["kind"] != KIND_DATA:
+            raise RuntimeError(f"{file_name} is not a data shard.")
+        self.num_examples = header["num_examples"]
+        self.arrays = [
+            numpy.memmap(
+                file_name,
+                dtype=numpy.dtype(entry["dtype"]),
+                mode="r",
+                offset=entry["offset"],
+                shape=tuple(entry["shape"]))
+            for entry in header["tensors"]
+        ]
+
+
+# A read-only TensorDataset backed by a file written by save_mmap_tensor_file. The file is mapped lazily in each
+# process and its pages live in the OS page cache, so DataLoader workers and distributed ranks on the same machine
+# share one copy of the data.
+class MmapTensorDataset(Dataset):
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.shards: Optional[List[_MmapTensorShard]] = None
+        self.shard_starts: Optional[List[int]] = None
+        self.num_examples = None
+
+    def get_shards(self) -> List[_MmapTensorShard]:
+        if self.shards is None:
+            header = read_mmap_tensor_file_header(self.file_name)
+            if header["kind"] == KIND_DATA:
+                shards = [_MmapTensorShard(self.file_name)]
+            elif header["kind"] == KIND_SHARDS:
+                dir = os.path.dirname(self.file_name)
+                shards = [_MmapTensorShard(os.path.join(dir, entry["file_name"])) for entry in header["shards"]]
+            else:
+                raise RuntimeError(f"Unsupported memory-mapped tensor file kind: {header['kind']}")
+            shard_starts = []
+            num_examples = 0
+            for shard in shards:
+                shard_starts.append(num_examples)
+                num_examples += shard.num_examples
+            self.shard_starts = shard_starts
+            self.num_examples = num_examples
+            self.shards = shards
+        return self.shards
+
+    def __getstate__(self):
+        # Memory maps are reopened in the receiving process instead of being pickled page by page.
+        state = self.__dict__.copy()
+        state["shards"] = None
+        state["shard_starts"] = None
+        return state
+
+    def __len__(self):
+        self.get_shards()
+        return self.num_examples
+
+    def get_num_tensors(self) -> int:
+        return len(self.get_shards()[0].arrays)
+
+    def _locate(self, index: int) -> Tuple[_MmapTensorShard, int]:
+        shards = self.get_shards()
+        if index < 0:
+            index += self.num_examples
+        if index < 0 or index >= self.num_examples:
+            raise IndexError(f"Index {index} is out of range for a dataset of size {self.num_examples}.")
+        shard_index = bisect.bisect_right(self.shard_starts, index) - 1
+        return shards[shard_index], index - self.shard_starts[shard_index]
+
+    def __getitem__(self, item):
+        if isinstance(item, int) or isinstance(item, numpy.integer):
+            shard, local_index = self._locate(int(item))
+            return tuple(torch.from_numpy(numpy.array(array[local_index])) for array in shard.arrays)
+        elif isinstance(item, slice):
+            return self.get_batch(range(*item.indices(len(self))))
+        else:
+            return self.get_batch(item)
+
+    def __getitems__(self, indices: Sequence[int]) -> List[Tuple[Tensor, ...]]:
+        batch = self.get_batch(indices)
+        return [tuple(tensor[i] for tensor in batch) for i in range(len(indices))]
+
+    def get_batch(self, indices: Union[Sequence[int], numpy.ndarray, Tensor]) -> Tuple[Tensor, ...]:
+        shards = self.get_shards()
+        if isinstance(indices, Tensor):
+            indices = indices.cpu().numpy()
+        indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1)
+        indices = numpy.where(indices < 0, indices + self.num_examples, indices)
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= self.num_examples):
+            raise IndexError(f"Index out of range for a dataset of size {self.num_examples}.")
+
+        outputs = [
+            numpy.empty((len(indices),) + array.shape[1:], dtype=array.dtype)
+            for array in shards[0].arrays
+        ]
+        shard_indices = numpy.searchsorted(numpy.asarray(self.shard_starts), indices, side="right") - 1
+        for shard_index in numpy.unique(shard_indices):
+            positions = numpy.nonzero(shard_indices == shard_index)[0]
+            local_indices = indices[positions] - self.shard_starts[shard_index]
+            for output, array in zip(outputs, shards[shard_index].arrays):
+                output[positions] = array[local_indices]
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a .pt tensor dataset into a memory-mapped tensor file.')
+    parser.add_argument("--source_file", type=str, required=True,
+                        help="The .pt file containing a tensor or a tuple/list of tensors.")
+    parser.add_argument("--dest_file", type=str, required=True,
+                        help="The name of the memory-mapped file to write.")
+    parser.add_argument("--num_examples_per_shard", type=int, default=None,
+                        help="If given, the data is split into shards with at most this many examples each.")
+    args = parser.parse_args()
+    convert_torch_file_to_mmap_tensor_file(args.source_file, args.dest_file, args.num_examples_per_shard)
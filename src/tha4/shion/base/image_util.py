@@ -3,7 +3,6 @@ import os
 import PIL.Image
 import numpy
 import torch
-from matplotlib import pyplot
 from torch import Tensor
 
 
@@ -20,7 +20,7 @@ class L1Loss(Loss):
         actual = self.actual_func(state)
         loss = self.weight * (expected - actual).abs().mean()
         if log_func is not None:
-            log_func("loss", loss.item())
+            log_func("loss", loss.detach())
         return loss
 
 
@@ -42,7 +42,7 @@ class ListL1Loss(Loss):
             loss += (expected[i] - actual[i]).abs().mean()
         loss = self.weight * loss
         if log_func is not None:
-            log_func("loss", loss.item())
+            log_func("loss", loss.detach())
         return loss
 
 
@@ -63,5 +63,5 @@ class MaskedL1Loss(Loss):
         actual = self.actual_func(state)
         loss = self.weight * ((expected - actual) * mask).abs().mean()
         if log_func is not None:
-            log_func("loss", loss.item())
+            log_func("loss", loss.detach())
         return loss
\ No newline at end of file
@@ -21,5 +21,5 @@ class L2Loss(Loss):
         actual = self.actual_func(state)
         loss = self.weight * ((expected - actual) ** 2).mean()
         if log_func is not None:
-            log_func("loss", loss.item())
+            log_func("loss", loss.detach())
         return loss
@@ -27,6 +27,6 @@ class SumLoss(Loss):
             loss_value = loss_value + loss.compute(state, loss_log_func)
 
         if log_func is not None:
-            log_func("loss", loss_value.item())
+            log_func("loss", loss_value.detach())
 
         return loss_value
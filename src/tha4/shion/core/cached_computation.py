@@ -5,15 +5,19 @@ import torch
 from torch import Tensor
 from torch.nn import Module
 
+from tha4.shion.core.latency_profiler import LatencyProfiler
+
 
 class ComputationState:
     def __init__(self,
                  modules: Dict[str, Module],
                  accumulated_modules: Dict[str, Module],
                  batch: Any,
-                 outputs: Optional[Dict[str, Any]] = None):
+                 outputs: Optional[Dict[str, Any]] = None,
+                 profiler: Optional[LatencyProfiler] = None):
         if outputs is None:
             outputs = {}
+        self.profiler = profiler
         self.outputs = outputs
         self.batch = batch
         self.accumulated_modules = accumulated_modules
@@ -44,7 +48,11 @@ class CachedComputationProtocol(ABC):
         if key in state.outputs:
             return state.outputs[key]
         else:
-            output = self.compute_output(key, state)
+            if state.profiler is not None:
+                with state.profiler.profile(key):
+                    output = self.compute_output(key, state)
+            else:
+                output = self.compute_output(key, state)
             state.outputs[key] = output
             return state.outputs[key]
 
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+import numpy
+import torch
+
+
+class LatencyRecord:
+    def __init__(self, name: str, host_start_time: float, duration: float, thread_id: int):
+        self.name = name
+        self.host_start_time = host_start_time
+        self.duration = duration
+        self.thread_id = thread_id
+
+
+# Measures how long named stages take on any device and keeps the last `capacity` measurements of each stage in a
+# ring buffer.
+#
+# On CUDA, stages are timed with CUDA events so that measuring does not stall the pipeline. The events are only
+# resolved when the timings are queried (or by collect()), so the numbers are the GPU time of the stage. On other
+# devices, the stage is timed with the host clock, after waiting for the device (MPS) to finish its work.
+class LatencyProfiler:
+    def __init__(self, device: torch.device, capacity: int = 256, trace_capacity: int = 4096):
+        assert capacity > 0
+        self.device = device
+        self.capacity = capacity
+        self.trace_capacity = trace_capacity
+        self.enabled = True
+
+        self.durations: Dict[str, deque] = {}
+        self.trace = deque(maxlen=trace_capacity)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+
+    def uses_cuda_events(self) -> bool:
+        return self.device.type == "cuda" and torch.cuda.is_available()
+
+    def synchronize(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elif self.device.type == "mps":
+            torch.mps.synchronize()
+
+    @contextmanager
+    def profile(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        host_start_time = time.perf_counter()
+        if self.uses_cuda_events():
+            start_event = torch.cuda.Event(enable_timing=True)
+            end_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+            yield
+            end_event.record()
+            with self.lock:
+                self.pending.append((name, host_start_time, threading.get_ident(), start_event, end_event))
+        else:
+            yield
+            self.synchronize()
+            self.add(name, host_start_time, time.perf_counter() - host_start_time, threading.get_ident())
+
+    def add(self, name: str, host_start_time: float, duration: float, thread_id: Optional[int] = None):
+        if thread_id is None:
+            thread_id = threading.get_ident()
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = deque(maxlen=self.capacity)
+            self.durations[name].append(duration)
+            self.trace.append(LatencyRecord(name, host_start_time, duration, thread_id))
+
+    def collect(self, block: bool = False):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        not_ready = []
+        for item in pending:
+            name, host_start_time, thread_id, start_event, end_event = item
+            if not block and not end_event.query():
+                not_ready.append(item)
+                continue
+            end_event.synchronize()
+            self.add(name, host_start_time, start_event.elapsed_time(end_event) / 1000.0, thread_id)
+        if len(not_ready) > 0:
+            with self.lock:
+                self.pending = not_ready + self.pending
+
+    def get_names(self) -> List[str]:
+        self.collect(block=True)
+        with self.lock:
+            return list(self.durations.keys())
+
+    def get_durations(self, name: str) -> List[float]:
+        self.collect(block=True)
+        with self.lock:
+            return list(self.durations.get(name, []))
+
+    def get_percentiles(self, name: str, percentiles: Sequence[float] = (50.0, 90.0, 99.0)) -> List[float]:
+        durations = self.get_durations(name)
+        if len(durations) == 0:
+            return [0.0 for _ in percentiles]
+        return numpy.percentile(numpy.array(durations), percentiles).tolist()
+
+    def get_summary(self, percentiles: Sequence[float] = (50.0, 90.0, 99.0)) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for name in self.get_names():
+            durations = self.get_durations(name)
+            if len(durations) == 0:
+                continue
+            values = numpy.percentile(numpy.array(durations), percentiles).tolist()
+            entry = {"count": len(durations), "mean": float(numpy.mean(durations))}
+            for p, value in zip(percentiles, values):
+                entry["p%g" % p] = value
+            summary[name] = entry
+        return summary
+
+    def get_summary_string(self) -> str:
+        lines = []
+        for name, entry in self.get_summary().items():
+            lines.append("%s: p50 = %0.2f ms, p90 = %0.2f ms, p99 = %0.2f ms" % (
+                name, entry["p50"] * 1000.0, entry["p90"] * 1000.0, entry["p99"] * 1000.0))
+        return "\n".join(lines)
+
+    def clear(self):
+        self.collect(block=True)
+        with self.lock:
+            self.durations = {}
+            self.trace.clear()
+
+    def save_chrome_trace(self, file_name: str):
+        """
+        Save the most recent measurements in the Chrome trace event format, which can be opened with
+        chrome://tracing or https://ui.perfetto.dev.
+        """
+        self.collect(block=True)
+        with self.lock:
+            records = list(self.trace)
+        events = []
+        for record in records:
+            events.append({
+                "name": record.name,
+                "ph": "X",
+                "ts": (record.host_start_time - self.start_time) * 1e6,
+                "dur": record.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": record.thread_id,
+                "args": {"device": str(self.device)},
+            })
+        dir_name = os.path.dirname(file_name)
+        if dir_name != "":
+            os.makedirs(dir_name, exist_ok=True)
+        with open(file_name, "wt") as fout:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fout)
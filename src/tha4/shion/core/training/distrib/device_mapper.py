@@ -8,6 +8,11 @@ class SimpleCudaDeviceMapper:
         return torch.device("cuda", local_rank)
 
 
+class CpuDeviceMapper:
+    def __call__(self, rank, local_rank):
+        return torch.device("cpu")
+
+
 class UserSpecifiedLocalRankToDeviceMapper:
     def __init__(self, device_map: Dict[int, torch.device]):
         self.device_map = device_map
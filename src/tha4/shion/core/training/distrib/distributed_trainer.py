@@ -15,11 +15,13 @@ from tha4.shion.core.load_save import torch_save, torch_load
 from tha4.shion.core.loss import Loss
 from tha4.shion.core.module_accumulator import ModuleAccumulator
 from tha4.shion.core.module_factory import ModuleFactory
+from tha4.shion.core.training.metrics_accumulator import MetricsAccumulator, TensorBoardMetricsSink
 from tha4.shion.core.training.distrib.device_mapper import SimpleCudaDeviceMapper
 from tha4.shion.core.training.distrib.distributed_training_states import DistributedTrainingState
 from tha4.shion.core.training.sample_output_protocol import SampleOutputProtocol
+from tha4.shion.core.training.sample_output_worker import SampleOutputWorker
 from tha4.shion.core.training.training_protocol import TrainingProtocol
-from tha4.shion.core.training.util import set_learning_rate, create_log_func, get_least_greater_multiple
+from tha4.shion.core.training.util import set_learning_rate, get_least_greater_multiple
 from tha4.shion.core.training.validation_protocol import ValidationProtocol
 
 KEY_CHECKPOINT = 'checkpoint'
@@ -42,7 +44,15 @@ class DistributedTrainer:
                  pretrained_module_file_names: Dict[str, str],
                  example_per_snapshot: int,
                  num_data_loader_workers: int = 8,
-                 distrib_backend: str = 'gloo'):
+                 distrib_backend: str = 'gloo',
+                 metrics_flush_every_examples: Optional[int] = None,
+                 metrics_flush_every_seconds: Optional[float] = 10.0,
+                 sample_output_protocol_func: Optional[Callable[[], SampleOutputProtocol]] = None):
+        # When sample_output_protocol_func is given, sample outputs are rendered by a SampleOutputWorker with the
+        # protocol it creates, and training continues while they are saved.
+        self.sample_output_protocol_func = sample_output_protocol_func
+        self.metrics_flush_every_seconds = metrics_flush_every_seconds
+        self.metrics_flush_every_examples = metrics_flush_every_examples
         self.distrib_backend = distrib_backend
         self.num_data_loader_workers = num_data_loader_workers
         self.accumulators = accumulators
@@ -75,6 +85,7 @@ class DistributedTrainer:
         self.validation_data_loader_batch_size = None
 
         self.sample_output_data = None
+        self.sample_output_worker = None
         self.summary_writer = None
         self.log_dir = None
         self.training_state = None
@@ -101,6 +112,17 @@ class DistributedTrainer:
             self.save_sample_output_data(rank, device)
             return torch_load(self.get_sample_output_data_file_name())
 
+    def start_sample_output_worker(self, training_state, device: torch.device):
+        if self.sample_output_protocol is None or self.sample_output_protocol_func is None:
+            return
+        self.sample_output_worker = SampleOutputWorker(
+            self.sample_output_protocol_func,
+            self.module_factories,
+            self.get_sample_output_data_file_name(),
+            self.prefix + "/sample_outputs",
+            device)
+        self.sample_output_worker.start(training_state.modules, training_state.accumulated_modules)
+
     def get_snapshot_prefix(self) -> str:
         return self.prefix + "/snapshot"
 
@@ -300,10 +322,17 @@ class DistributedTrainer:
         sample_output_data = self.load_sample_output_data(rank, device)
         training_state = self.load_previous_training_state(
             target_checkpoint_examples, world_size, rank, local_rank, device)
+        if rank == 0:
+            self.start_sample_output_worker(training_state, device)
         summary_writer = self.get_summary_writer(rank)
         if summary_writer is not None:
-            log_func_factory = lambda name, num: create_log_func(summary_writer, name, num)
+            metrics_accumulator = MetricsAccumulator(
+                [TensorBoardMetricsSink(summary_writer)],
+                flush_every_examples=self.metrics_flush_every_examples,
+                flush_every_seconds=self.metrics_flush_every_seconds)
+            log_func_factory = metrics_accumulator.create_log_func
         else:
+            metrics_accumulator = None
             log_func_factory = None
         last_time = time.time()
 
@@ -315,9 +344,8 @@ class DistributedTrainer:
                     continue
                 lr = learning_rate_by_module_name[module_name]
                 set_learning_rate(training_state.optimizers[module_name], lr)
-                if summary_writer is not None:
-                    summary_writer.add_scalar(
-                        module_name + "_learning_rate", lr, training_state.examples_seen_so_far)
+                if metrics_accumulator is not None:
+                    metrics_accumulator.add(module_name + "_learning_rate", lr, training_state.examples_seen_so_far)
 
             # One training iteration
             training_batch = self.get_next_training_batch(training_state.examples_seen_so_far, world_size, device)
@@ -361,18 +389,32 @@ class DistributedTrainer:
             # Save sample output
             if self.sample_output_protocol is not None \
                     and training_state.examples_seen_so_far >= next_num_examples[KEY_SAMPLE_OUTPUT]:
-                if rank == 0:
-                    self.sample_output_protocol.save_sample_output_data(
-                        training_state.modules,
-                        training_state.accumulated_modules,
-                        sample_output_data,
-                        self.prefix + "/sample_outputs",
-                        training_state.examples_seen_so_far,
-                        device)
-                self.barrier(local_rank)
+                if self.sample_output_protocol_func is not None:
+                    # Only rank 0 copies the parameters to the worker, which is short enough for the other ranks not
+                    # to wait for it.
+                    if rank == 0:
+                        self.sample_output_worker.submit(
+                            training_state.modules,
+                            training_state.accumulated_modules,
+                            training_state.examples_seen_so_far)
+                else:
+                    if rank == 0:
+                        self.sample_output_protocol.save_sample_output_data(
+                            training_state.modules,
+                            training_state.accumulated_modules,
+                            sample_output_data,
+                            self.prefix + "/sample_outputs",
+                            training_state.examples_seen_so_far,
+                            device)
+                    self.barrier(local_rank)
+
+            if metrics_accumulator is not None:
+                metrics_accumulator.maybe_flush(training_state.examples_seen_so_far)
 
             # Save checkpoint
             if training_state.examples_seen_so_far >= next_num_examples[KEY_CHECKPOINT]:
+                if metrics_accumulator is not None:
+                    metrics_accumulator.flush(training_state.examples_seen_so_far)
                 checkpoint_index = self.get_checkpoint_index_to_save(training_state.examples_seen_so_far)
                 training_state.save(
                     self.get_checkpoint_prefix(checkpoint_index), rank, lambda: self.barrier(local_rank))
@@ -388,6 +430,11 @@ class DistributedTrainer:
                 logging.info("Showed %d training examples." % training_state.examples_seen_so_far)
                 last_time = now
 
+        if metrics_accumulator is not None:
+            metrics_accumulator.close()
+        if self.sample_output_worker is not None:
+            self.sample_output_worker.stop()
+
     @staticmethod
     def get_default_arg_parser() -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(description='Training script.')
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import torch
+from torch import Tensor
+
+
+class MetricsSink(ABC):
+    @abstractmethod
+    def write(self, tag: str, value: float, step: int):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TensorBoardMetricsSink(MetricsSink):
+    def __init__(self, summary_writer):
+        self.summary_writer = summary_writer
+
+    def write(self, tag: str, value: float, step: int):
+        self.summary_writer.add_scalar(tag, value, step)
+
+    def flush(self):
+        self.summary_writer.flush()
+
+
+class CsvMetricsSink(MetricsSink):
+    def __init__(self, file_name: str):
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        is_new_file = not os.path.exists(file_name)
+        self.file = open(file_name, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if is_new_file:
+            self.writer.writerow(["step", "tag", "value"])
+
+    def write(self, tag: str, value: float, step: int):
+        self.writer.writerow([step, tag, value])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class InMemoryMetricsSink(MetricsSink):
+    def __init__(self):
+        self.values: Dict[str, List[Tuple[int, float]]] = {}
+        self.lock = threading.Lock()
+
+    def write(self, tag: str, value: float, step: int):
+        with self.lock:
+            if tag not in self.values:
+                self.values[tag] = []
+            self.values[tag].append((step, value))
+
+    def get_values(self, tag: str) -> List[Tuple[int, float]]:
+        with self.lock:
+            return list(self.values.get(tag, []))
+
+
+# Accumulates scalar metrics without synchronizing with the device. Tensor values are added to running sums that stay
+# on the tensor's device, and every flush_every_examples examples or flush_every_seconds seconds (whichever comes
+# first) the averages since the last flush are handed to a background thread, which is the only place where the values
+# are copied to the host and written to the sinks.
+#
+# The log functions created by create_log_func have the same signature and tag naming as
+# tha4.shion.core.training.util.create_log_func, so they can be passed to the training and validation protocols as is.
+class MetricsAccumulator:
+    def __init__(self,
+                 sinks: List[MetricsSink],
+                 flush_every_examples: Optional[int] = None,
+                 flush_every_seconds: Optional[float] = 10.0,
+                 background: bool = True):
+        self.sinks = sinks
+        self.flush_every_examples = flush_every_examples
+        self.flush_every_seconds = flush_every_seconds
+
+        self.sums: Dict[str, Union[Tensor, float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.last_step = 0
+        self.last_flush_step = None
+        self.last_flush_time = time.time()
+
+        if background:
+            self.queue = queue.Queue()
+            self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+            self.writer_thread.start()
+        else:
+            self.queue = None
+            self.writer_thread = None
+
+    def add(self, tag: str, value: Union[Tensor, float], step: int):
+        if isinstance(value, Tensor):
+            value = value.detach().reshape(-1)[0].float()
+        if tag in self.sums:
+            self.sums[tag] = self.sums[tag] + value
+            self.counts[tag] += 1
+        else:
+            self.sums[tag] = value
+            self.counts[tag] = 1
+        self.last_step = max(self.last_step, step)
+
+    def create_log_func(self, prefix: str, examples_seen_so_far: int) -> Callable[[str, Union[Tensor, float]], None]:
+        def log_func(tag: str, value: Union[Tensor, float]):
+            self.add(prefix + "_" + tag, value, examples_seen_so_far)
+
+        return log_func
+
+    def should_flush(self, examples_seen_so_far: int) -> bool:
+        if len(self.sums) == 0:
+            return False
+        if self.last_flush_step is None:
+            self.last_flush_step = examples_seen_so_far
+        if self.flush_every_examples is not None \
+                and examples_seen_so_far - self.last_flush_step >= self.flush_every_examples:
+            return True
+        if self.flush_every_seconds is not None \
+                and time.time() - self.last_flush_time >= self.flush_every_seconds:
+            return True
+        return False
+
+    def maybe_flush(self, examples_seen_so_far: int):
+        if self.should_flush(examples_seen_so_far):
+            self.flush(examples_seen_so_far)
+
+    def flush(self, examples_seen_so_far: Optional[int] = None):
+        if examples_seen_so_far is None:
+            examples_seen_so_far = self.last_step
+        self.last_flush_step = examples_seen_so_far
+        self.last_flush_time = time.time()
+        if len(self.sums) == 0:
+            return
+
+        # Averages are computed on the sums' devices. Nothing here waits for the device.
+        averages = []
+        for tag in self.sums:
+            averages.append((tag, self.sums[tag] / self.counts[tag]))
+        self.sums = {}
+        self.counts = {}
+
+        item = (self.last_step, averages)
+        if self.queue is not None:
+            self.queue.put(item)
+        else:
+            self.write(item)
+
+    def write(self, item: Tuple[int, List[Tuple[str, Union[Tensor, float]]]]):
+        step, averages = item
+        for tag, value in averages:
+            if isinstance(value, Tensor):
+                value = value.item()
+            for sink in self.sinks:
+                sink.write(tag, value, step)
+        for sink in self.sinks:
+            sink.flush()
+
+    def run_writer(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(item)
+            except Exception as e:
+                logging.error(f"Failed to write metrics: {e}")
+            finally:
+                self.queue.task_done()
+
+    def wait_until_written(self):
+        # Blocks until everything flushed so far has been written to the sinks.
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        self.flush()
+        if self.writer_thread is not None:
+            self.queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+        for sink in self.sinks:
+            sink.close()
+
+
+def benchmark_metrics_logging(device: torch.device, num_iterations: int, num_loss_terms: int, batch_size: int):
+    def synchronize():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    x = torch.rand(batch_size, 4, 128, 128, device=device)
+    y = torch.rand(batch_size, 4, 128, 128, device=device)
+
+    def run(log_func_factory: Callable[[str, int], Callable[[str, Union[Tensor, float]], None]], after_step=None):
+        synchronize()
+        start = time.perf_counter()
+        for step in range(num_iterations):
+            log_func = log_func_factory("training", step * batch_size)
+            loss_value = torch.zeros(1, device=device)
+            for i in range(num_loss_terms):
+                loss = (x * (i + 1) - y).abs().mean()
+                log_func(f"term_{i}_loss", loss.detach())
+                loss_value = loss_value + loss
+            log_func("loss", loss_value.detach())
+            if after_step is not None:
+                after_step(step * batch_size)
+        synchronize()
+        return (time.perf_counter() - start) / num_iterations * 1000.0
+
+    sink = InMemoryMetricsSink()
+
+    def immediate_log_func_factory(prefix: str, examples_seen_so_far: int):
+        def log_func(tag: str, value: Union[Tensor, float]):
+            if isinstance(value, Tensor):
+                value = value.item()
+            sink.write(prefix + "_" + tag, value, examples_seen_so_far)
+
+        return log_func
+
+    run(immediate_log_func_factory)
+    immediate_ms = run(immediate_log_func_factory)
+
+    accumulator = MetricsAccumulator([InMemoryMetricsSink()], flush_every_examples=100 * batch_size)
+    run(accumulator.create_log_func, accumulator.maybe_flush)
+    accumulated_ms = run(accumulator.create_log_func, accumulator.maybe_flush)
+    accumulator.close()
+
+    print(f"Per-step logging with .item(): {immediate_ms:.3f} ms/step")
+    print(f"MetricsAccumulator: {accumulated_ms:.3f} ms/step")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Step-time overhead of per-step vs. accumulated metrics logging.')
+    parser.add_argument("--device", type=str, default="cuda", help="The device to run the benchmark on.")
+    parser.add_argument("--num_iterations", type=int, default=1000, help="The number of timed steps.")
+    parser.add_argument("--num_loss_terms", type=int, default=4, help="The number of logged loss terms per step.")
+    parser.add_argument("--batch_size", type=int, default=8, help="The batch size of the synthetic loss.")
+    args = parser.parse_args()
+    benchmark_metrics_logging(torch.device(args.device), args.num_iterations, args.num_loss_terms, args.batch_size)
@@ -0,0 +1,236 @@
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.multiprocessing
+from torch import Tensor
+from torch.nn import Module
+from torch.nn.parallel import DistributedDataParallel
+
+from tha4.shion.core.load_save import torch_load
+from tha4.shion.core.module_factory import ModuleFactory
+from tha4.shion.core.training.sample_output_protocol import SampleOutputProtocol
+
+SLOT_FREE = 0
+SLOT_FILLING = 1
+SLOT_QUEUED = 2
+SLOT_LOADING = 3
+
+StateDicts = Dict[str, Dict[str, Tensor]]
+
+
+def get_state_dicts(modules: Dict[str, Module]) -> StateDicts:
+    output = {}
+    for module_name, module in modules.items():
+        if isinstance(module, DistributedDataParallel):
+            module = module.module
+        output[module_name] = module.state_dict()
+    return output
+
+
+def create_shared_state_dicts(state_dicts: StateDicts) -> StateDicts:
+    return {
+        module_name: {key: value.detach().to("cpu", copy=True).share_memory_() for key, value in state_dict.items()}
+        for module_name, state_dict in state_dicts.items()
+    }
+
+
+def copy_state_dicts(source: StateDicts, target: StateDicts):
+    for module_name, state_dict in source.items():
+        for key, value in state_dict.items():
+            target[module_name][key].copy_(value.detach())
+
+
+def run_sample_output_worker(sample_output_protocol_func: Callable[[], SampleOutputProtocol],
+                             module_factories: Dict[str, ModuleFactory],
+                             sample_output_data_file_name: str,
+                             output_prefix: str,
+                             device: torch.device,
+                             module_slots: List[StateDicts],
+                             accumulated_module_slots: List[StateDicts],
+                             slot_states,
+                             slot_request_ids,
+                             lock,
+                             request_queue,
+                             num_threads: Optional[int]):
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    sample_output_protocol = sample_output_protocol_func()
+    sample_output_data = torch_load(sample_output_data_file_name)
+    sample_output_data = move_to_device(sample_output_data, device)
+    modules = {
+        module_name: module_factories[module_name].create().to(device)
+        for module_name in module_slots[0].keys()
+    }
+    accumulated_modules = {
+        module_name: module_factories[module_name].create().to(device)
+        for module_name in accumulated_module_slots[0].keys()
+    }
+
+    while True:
+        request = request_queue.get()
+        if request is None:
+            return
+        slot_index, request_id, examples_seen_so_far = request
+        with lock:
+            # The slot was refilled with a newer request after this one was queued.
+            if slot_states[slot_index] != SLOT_QUEUED or slot_request_ids[slot_index] != request_id:
+                continue
+            slot_states[slot_index] = SLOT_LOADING
+        try:
+            for module_name, module in modules.items():
+                module.load_state_dict(module_slots[slot_index][module_name])
+            for module_name, module in accumulated_modules.items():
+                module.load_state_dict(accumulated_module_slots[slot_index][module_name])
+        finally:
+            with lock:
+                slot_states[slot_index] = SLOT_FREE
+        try:
+            sample_output_protocol.save_sample_output_data(
+                modules,
+                accumulated_modules,
+                sample_output_data,
+                output_prefix,
+                examples_seen_so_far,
+                device)
+        except Exception as e:
+            logging.error(f"Failed to save sample output at {examples_seen_so_far} examples: {e}")
+
+
+def move_to_device(data, device: torch.device):
+    if isinstance(data, Tensor):
+        return data.to(device)
+    elif isinstance(data, dict):
+        return {key: move_to_device(value, device) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [move_to_device(value, device) for value in data]
+    elif isinstance(data, tuple):
+        return tuple(move_to_device(value, device) for value in data)
+    else:
+        return data
+
+
+# Renders and saves sample outputs in a separate process so that training does not wait for the forward passes, the
+# image conversion and the PNG encoding.
+#
+# The module and accumulated module parameters are handed over through num_slots sets of CPU tensors in shared memory.
+# submit() copies the current state dicts into a free slot and queues it; the only work left in the training loop is
+# that copy. The worker frees a slot as soon as it has loaded the parameters, before rendering. If every slot is taken,
+# the oldest request that the worker has not picked up yet is dropped and its slot reused, so the worker always renders
+# the newest state and never falls more than num_slots requests behind.
+#
+# The worker creates its own modules with the module factories and its own protocol with sample_output_protocol_func,
+# which must therefore be picklable (a module level function or a bound method of a picklable object). It reads the
+# sample output data from the file the trainer saved.
+class SampleOutputWorker:
+    def __init__(self,
+                 sample_output_protocol_func: Callable[[], SampleOutputProtocol],
+                 module_factories: Dict[str, ModuleFactory],
+                 sample_output_data_file_name: str,
+                 output_prefix: str,
+                 device: torch.device,
+                 num_slots: int = 2,
+                 num_threads: Optional[int] = None,
+                 start_method: str = "spawn"):
+        assert num_slots >= 1
+        self.sample_output_protocol_func = sample_output_protocol_func
+        self.module_factories = module_factories
+        self.sample_output_data_file_name = sample_output_data_file_name
+        self.output_prefix = output_prefix
+        self.device = device
+        self.num_slots = num_slots
+        self.num_threads = num_threads
+        self.context = torch.multiprocessing.get_context(start_method)
+
+        self.module_slots: List[StateDicts] = []
+        self.accumulated_module_slots: List[StateDicts] = []
+        self.slot_states = None
+        self.slot_request_ids = None
+        self.lock = None
+        self.request_queue = None
+        self.process = None
+        self.next_request_id = 1
+
+        self.num_submitted = 0
+        self.num_dropped = 0
+        self.total_submit_time = 0.0
+
+    def start(self, modules: Dict[str, Module], accumulated_modules: Dict[str, Module]):
+        module_state_dicts = get_state_dicts(modules)
+        accumulated_module_state_dicts = get_state_dicts(accumulated_modules)
+        self.module_slots = [create_shared_state_dicts(module_state_dicts) for _ in range(self.num_slots)]
+        self.accumulated_module_slots = [
+            create_shared_state_dicts(accumulated_module_state_dicts) for _ in range(self.num_slots)
+        ]
+        self.slot_states = self.context.Array('i', [SLOT_FREE] * self.num_slots, lock=False)
+        self.slot_request_ids = self.context.Array('q', [0] * self.num_slots, lock=False)
+        self.lock = self.context.Lock()
+        self.request_queue = self.context.Queue()
+        self.process = self.context.Process(
+            target=run_sample_output_worker,
+            args=(self.sample_output_protocol_func,
+                  self.module_factories,
+                  self.sample_output_data_file_name,
+                  self.output_prefix,
+                  self.device,
+                  self.module_slots,
+                  self.accumulated_module_slots,
+                  self.slot_states,
+                  self.slot_request_ids,
+                  self.lock,
+                  self.request_queue,
+                  self.num_threads),
+            daemon=True)
+        self.process.start()
+
+    def acquire_slot(self) -> Optional[int]:
+        with self.lock:
+            free_slots = [i for i in range(self.num_slots) if self.slot_states[i] == SLOT_FREE]
+            if len(free_slots) > 0:
+                slot_index = free_slots[0]
+            else:
+                queued_slots = [i for i in range(self.num_slots) if self.slot_states[i] == SLOT_QUEUED]
+                if len(queued_slots) == 0:
+                    return None
+                slot_index = min(queued_slots, key=lambda i: self.slot_request_ids[i])
+            if self.slot_states[slot_index] == SLOT_QUEUED:
+                self.num_dropped += 1
+            self.slot_states[slot_index] = SLOT_FILLING
+            return slot_index
+
+    def submit(self,
+               modules: Dict[str, Module],
+               accumulated_modules: Dict[str, Module],
+               examples_seen_so_far: int) -> bool:
+        # Returns False if the request was dropped because the worker is still loading every slot.
+        assert self.process is not None
+        start_time = time.time()
+        self.num_submitted += 1
+        slot_index = self.acquire_slot()
+        if slot_index is None:
+            self.num_dropped += 1
+            return False
+        with torch.no_grad():
+            copy_state_dicts(get_state_dicts(modules), self.module_slots[slot_index])
+            copy_state_dicts(get_state_dicts(accumulated_modules), self.accumulated_module_slots[slot_index])
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        with self.lock:
+            self.slot_request_ids[slot_index] = request_id
+            self.slot_states[slot_index] = SLOT_QUEUED
+        self.request_queue.put((slot_index, request_id, examples_seen_so_far))
+        self.total_submit_time += time.time() - start_time
+        return True
+
+    def stop(self):
+        # Waits for the queued requests to be rendered, so that the last sample output is not lost.
+        if self.process is None:
+            return
+        self.request_queue.put(None)
+        self.process.join()
+        if self.process.exitcode != 0:
+            logging.error(f"The sample output worker exited with code {self.process.exitcode}.")
+        self.process = None
+        logging.info(f"Sample output worker: {self.num_submitted} requests, {self.num_dropped} dropped, "
+                     f"{self.total_submit_time / max(self.num_submitted, 1) * 1000:.1f} ms per submit.")
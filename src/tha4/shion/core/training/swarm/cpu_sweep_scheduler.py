@@ -0,0 +1,212 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from tha4.shion.core.training.distrib.device_mapper import CpuDeviceMapper
+from tha4.shion.core.training.metrics_accumulator import InMemoryMetricsSink
+from tha4.shion.core.training.swarm.swarm_unit_trainer import SwarmUnitTrainer
+
+TRIAL_FINISHED = "finished"
+TRIAL_STOPPED = "stopped"
+TRIAL_FAILED = "failed"
+
+
+class SweepTrial:
+    # trainer_func is called in the trial's own process, so it has to be picklable (a module level function or a
+    # functools.partial of one). num_threads overrides the scheduler's threads_per_trial for this trial.
+    # num_data_loader_workers replaces the trainer's setting; data loader workers take cores away from the other
+    # trials, so the default is to load batches in the training process.
+    def __init__(self,
+                 name: str,
+                 trainer_func: Callable[[], SwarmUnitTrainer],
+                 num_threads: Optional[int] = None,
+                 num_data_loader_workers: Optional[int] = 0):
+        self.num_data_loader_workers = num_data_loader_workers
+        self.num_threads = num_threads
+        self.trainer_func = trainer_func
+        self.name = name
+
+
+class SweepTrialResult:
+    def __init__(self, name: str, num_threads: int):
+        self.name = name
+        self.num_threads = num_threads
+        self.status = None
+        self.error = None
+        self.checkpoint_losses: List[Tuple[int, int, float]] = []
+        self.start_time = None
+        self.end_time = None
+
+    def get_last_loss(self) -> Optional[float]:
+        if len(self.checkpoint_losses) == 0:
+            return None
+        return self.checkpoint_losses[-1][2]
+
+    def get_elapsed_time(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+
+# Stops a trial at a checkpoint if its validation loss is worse than the given quantile of the losses that the other
+# trials reported at the same checkpoint. Nothing is stopped before grace_checkpoints checkpoints or before min_trials
+# other trials have reached the checkpoint.
+class QuantileStoppingRule:
+    def __init__(self, quantile: float = 0.5, min_trials: int = 3, grace_checkpoints: int = 1):
+        assert 0.0 < quantile <= 1.0
+        self.grace_checkpoints = grace_checkpoints
+        self.min_trials = min_trials
+        self.quantile = quantile
+
+    def should_stop(self, checkpoint_index: int, loss: float, other_losses: List[float]) -> bool:
+        if checkpoint_index <= self.grace_checkpoints or len(other_losses) < self.min_trials:
+            return False
+        other_losses = sorted(other_losses)
+        threshold = other_losses[min(len(other_losses) - 1, int(self.quantile * len(other_losses)))]
+        return loss > threshold
+
+
+def run_sweep_trial(trial: SweepTrial,
+                    num_threads: int,
+                    validation_loss_tag: str,
+                    message_queue,
+                    decision_connection):
+    torch.set_num_threads(num_threads)
+    try:
+        trainer = trial.trainer_func()
+        if trial.num_data_loader_workers is not None:
+            trainer.num_data_loader_workers = trial.num_data_loader_workers
+        metrics_sink = InMemoryMetricsSink()
+        last_checkpoint_examples = [0]
+
+        def checkpoint_callback(checkpoint_index: int, examples_seen_so_far: int) -> bool:
+            values = [value for step, value in metrics_sink.get_values(validation_loss_tag)
+                      if last_checkpoint_examples[0] < step <= examples_seen_so_far]
+            last_checkpoint_examples[0] = examples_seen_so_far
+            if len(values) == 0:
+                return True
+            loss = sum(values) / len(values)
+            message_queue.put(("checkpoint", trial.name, checkpoint_index, examples_seen_so_far, loss))
+            return decision_connection.recv()
+
+        trainer.train(0, 0,
+                      device_mapper=CpuDeviceMapper(),
+                      metrics_sinks=[metrics_sink],
+                      checkpoint_callback=checkpoint_callback)
+        message_queue.put(("done", trial.name, None))
+    except Exception as e:
+        message_queue.put(("done", trial.name, repr(e)))
+
+
+# Runs many small trainers (hyperparameter trials) on a CPU-only machine. Each trial runs in its own process with a
+# budget of threads_per_trial torch threads, and as many trials run at once as fit in total_threads. Trials start from
+# a queue in the given order. Whenever a trial saves a checkpoint, it reports the average of its validation_loss_tag
+# metric since the last checkpoint and waits for the scheduler, which stops it if the stopping rule says it is losing
+# to the trials that already reached that checkpoint. The trainers need a validation protocol that logs the tag.
+class CpuSweepScheduler:
+    def __init__(self,
+                 trials: List[SweepTrial],
+                 total_threads: Optional[int] = None,
+                 threads_per_trial: int = 1,
+                 stopping_rule: Optional[QuantileStoppingRule] = None,
+                 validation_loss_tag: str = "validation_loss",
+                 start_method: str = "spawn"):
+        if total_threads is None:
+            total_threads = os.cpu_count()
+        names = [trial.name for trial in trials]
+        assert len(set(names)) == len(names)
+        for trial in trials:
+            assert (trial.num_threads or threads_per_trial) <= total_threads
+
+        self.trials = trials
+        self.total_threads = total_threads
+        self.threads_per_trial = threads_per_trial
+        self.stopping_rule = stopping_rule
+        self.validation_loss_tag = validation_loss_tag
+        self.context = multiprocessing.get_context(start_method)
+        self.losses_by_checkpoint: Dict[int, List[float]] = {}
+
+    def get_num_threads(self, trial: SweepTrial) -> int:
+        return trial.num_threads if trial.num_threads is not None else self.threads_per_trial
+
+    def decide(self, result: SweepTrialResult, checkpoint_index: int, examples_seen_so_far: int, loss: float) -> bool:
+        result.checkpoint_losses.append((checkpoint_index, examples_seen_so_far, loss))
+        other_losses = self.losses_by_checkpoint.setdefault(checkpoint_index, [])
+        stop = self.stopping_rule is not None and self.stopping_rule.should_stop(checkpoint_index, loss, other_losses)
+        other_losses.append(loss)
+        if stop:
+            result.status = TRIAL_STOPPED
+            logging.info(f"Stopping trial {result.name} at checkpoint {checkpoint_index} (loss {loss:.6f}).")
+        return not stop
+
+    def run(self) -> List[SweepTrialResult]:
+        message_queue = self.context.Queue()
+        pending = list(self.trials)
+        running: Dict[str, Tuple[multiprocessing.Process, object, SweepTrialResult]] = {}
+        results: Dict[str, SweepTrialResult] = {}
+        free_threads = self.total_threads
+
+        # The trial processes are not daemonic, so that their trainers can start data loader workers and a sample
+        # output worker. Whatever is still running when the scheduler stops (an exception, a keyboard interrupt) is
+        # terminated here instead.
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and self.get_num_threads(pending[0]) <= free_threads:
+                    trial = pending.pop(0)
+                    num_threads = self.get_num_threads(trial)
+                    parent_connection, child_connection = self.context.Pipe()
+                    process = self.context.Process(
+                        target=run_sweep_trial,
+                        args=(trial, num_threads, self.validation_loss_tag, message_queue, child_connection))
+                    result = SweepTrialResult(trial.name, num_threads)
+                    result.start_time = time.time()
+                    process.start()
+                    running[trial.name] = (process, parent_connection, result)
+                    results[trial.name] = result
+                    free_threads -= num_threads
+                    logging.info(f"Started trial {trial.name} with {num_threads} threads.")
+
+                try:
+                    message = message_queue.get(timeout=1.0)
+                except queue.Empty:
+                    # A process that died without reporting (killed, out of memory) counts as failed.
+                    for name, (process, _, result) in list(running.items()):
+                        if not process.is_alive():
+                            result.status = TRIAL_FAILED
+                            result.error = f"exit code {process.exitcode}"
+                            free_threads += self.finish(running.pop(name))
+                    continue
+
+                kind, name = message[0], message[1]
+                process, connection, result = running[name]
+                if kind == "checkpoint":
+                    _, _, checkpoint_index, examples_seen_so_far, loss = message
+                    connection.send(self.decide(result, checkpoint_index, examples_seen_so_far, loss))
+                elif kind == "done":
+                    error = message[2]
+                    if error is not None:
+                        result.status = TRIAL_FAILED
+                        result.error = error
+                    elif result.status is None:
+                        result.status = TRIAL_FINISHED
+                    free_threads += self.finish(running.pop(name))
+        finally:
+            for process, connection, _ in running.values():
+                process.terminate()
+                process.join()
+                connection.close()
+
+        return [results[trial.name] for trial in self.trials]
+
+    def finish(self, entry) -> int:
+        process, connection, result = entry
+        process.join()
+        connection.close()
+        result.end_time = time.time()
+        logging.info(f"Trial {result.name} {result.status} in {result.get_elapsed_time():.1f} s.")
+        return result.num_threads
@@ -3,7 +3,7 @@ import logging
 import os
 import time
 from datetime import datetime
-from typing import Dict, Optional, Callable
+from typing import Dict, Optional, Callable, List
 import torch.distributed
 
 import torch
@@ -14,12 +14,14 @@ from tha4.shion.core.load_save import torch_save, torch_load
 from tha4.shion.core.loss import Loss
 from tha4.shion.core.module_accumulator import ModuleAccumulator
 from tha4.shion.core.module_factory import ModuleFactory
+from tha4.shion.core.training.metrics_accumulator import MetricsAccumulator, TensorBoardMetricsSink, MetricsSink
 from tha4.shion.core.training.distrib.device_mapper import SimpleCudaDeviceMapper
 from tha4.shion.core.training.sample_output_protocol import SampleOutputProtocol
+from tha4.shion.core.training.sample_output_worker import SampleOutputWorker
 from tha4.shion.core.training.single.training_states import TrainingState
 from tha4.shion.core.training.single.training_tasks import KEY_CHECKPOINT, KEY_SNAPSHOT, KEY_VALIDATION, KEY_SAMPLE_OUTPUT
 from tha4.shion.core.training.training_protocol import TrainingProtocol
-from tha4.shion.core.training.util import get_least_greater_multiple, create_log_func, set_learning_rate
+from tha4.shion.core.training.util import get_least_greater_multiple, set_learning_rate
 from tha4.shion.core.training.validation_protocol import ValidationProtocol
 
 
@@ -36,7 +38,15 @@ class SwarmUnitTrainer:
                  sample_output_protocol: Optional[SampleOutputProtocol],
                  pretrained_module_file_names: Dict[str, str],
                  example_per_snapshot: int,
-                 num_data_loader_workers: int = 8):
+                 num_data_loader_workers: int = 8,
+                 metrics_flush_every_examples: Optional[int] = None,
+                 metrics_flush_every_seconds: Optional[float] = 10.0,
+                 sample_output_protocol_func: Optional[Callable[[], SampleOutputProtocol]] = None):
+        # When sample_output_protocol_func is given, sample outputs are rendered by a SampleOutputWorker with the
+        # protocol it creates, and training continues while they are saved.
+        self.sample_output_protocol_func = sample_output_protocol_func
+        self.metrics_flush_every_seconds = metrics_flush_every_seconds
+        self.metrics_flush_every_examples = metrics_flush_every_examples
         self.num_data_loader_workers = num_data_loader_workers
         self.accumulators = accumulators
         self.sample_output_protocol = sample_output_protocol
@@ -68,6 +78,7 @@ class SwarmUnitTrainer:
         self.validation_data_loader_batch_size = None
 
         self.sample_output_data = None
+        self.sample_output_worker = None
         self.summary_writer = None
         self.log_dir = None
         self.training_state = None
@@ -89,6 +100,17 @@ class SwarmUnitTrainer:
         self.save_sample_output_data(device)
         return torch_load(self.get_sample_output_data_file_name())
 
+    def start_sample_output_worker(self, training_state, device: torch.device):
+        if self.sample_output_protocol is None or self.sample_output_protocol_func is None:
+            return
+        self.sample_output_worker = SampleOutputWorker(
+            self.sample_output_protocol_func,
+            self.module_factories,
+            self.get_sample_output_data_file_name(),
+            self.prefix + "/sample_outputs",
+            device)
+        self.sample_output_worker.start(training_state.modules, training_state.accumulated_modules)
+
     def get_snapshot_prefix(self) -> str:
         return self.prefix + "/snapshot"
 
@@ -213,7 +235,7 @@ class SwarmUnitTrainer:
                 self.validation_dataset,
                 batch_size=self.validation_protocol.get_batch_size(),
                 shuffle=True,
-                num_workers=1,
+                num_workers=min(1, self.num_data_loader_workers),
                 drop_last=True)
         if self.validation_data_loader_iter is None:
             self.validation_data_loader_iter = iter(self.validation_data_loader)
@@ -235,7 +257,12 @@ class SwarmUnitTrainer:
               rank: int,
               local_rank: int,
               target_checkpoint_examples: Optional[int] = None,
-              device_mapper: Optional[Callable[[int, int], torch.device]] = None):
+              device_mapper: Optional[Callable[[int, int], torch.device]] = None,
+              metrics_sinks: Optional[List[MetricsSink]] = None,
+              checkpoint_callback: Optional[Callable[[int, int], bool]] = None):
+        # metrics_sinks receive the metrics in addition to TensorBoard. checkpoint_callback is called with the
+        # checkpoint index and the number of examples seen after each checkpoint is saved, once the metrics up to it
+        # have been written to the sinks. Training stops there if it returns False.
         if target_checkpoint_examples is None:
             target_checkpoint_examples = self.checkpoint_examples[-1]
 
@@ -246,10 +273,16 @@ class SwarmUnitTrainer:
         sample_output_data = self.load_sample_output_data(device)
         training_state = self.load_previous_training_state(
             target_checkpoint_examples, device)
+        self.start_sample_output_worker(training_state, device)
         summary_writer = self.get_summary_writer()
         if summary_writer is not None:
-            log_func_factory = lambda name, num: create_log_func(summary_writer, name, num)
+            metrics_accumulator = MetricsAccumulator(
+                [TensorBoardMetricsSink(summary_writer)] + (metrics_sinks if metrics_sinks is not None else []),
+                flush_every_examples=self.metrics_flush_every_examples,
+                flush_every_seconds=self.metrics_flush_every_seconds)
+            log_func_factory = metrics_accumulator.create_log_func
         else:
+            metrics_accumulator = None
             log_func_factory = None
         last_time = time.time()
 
@@ -261,9 +294,8 @@ class SwarmUnitTrainer:
                     continue
                 lr = learning_rate_by_module_name[module_name]
                 set_learning_rate(training_state.optimizers[module_name], lr)
-                if summary_writer is not None:
-                    summary_writer.add_scalar(
-                        module_name + "_learning_rate", lr, training_state.examples_seen_so_far)
+                if metrics_accumulator is not None:
+                    metrics_accumulator.add(module_name + "_learning_rate", lr, training_state.examples_seen_so_far)
 
             # One training iteration
             training_batch = self.get_next_training_batch(device)
@@ -304,20 +336,37 @@ class SwarmUnitTrainer:
             # Save sample output
             if self.sample_output_protocol is not None \
                     and training_state.examples_seen_so_far >= next_num_examples[KEY_SAMPLE_OUTPUT]:
-                self.sample_output_protocol.save_sample_output_data(
-                    training_state.modules,
-                    training_state.accumulated_modules,
-                    sample_output_data,
-                    self.prefix + "/sample_outputs",
-                    training_state.examples_seen_so_far,
-                    device)
+                if self.sample_output_worker is not None:
+                    self.sample_output_worker.submit(
+                        training_state.modules,
+                        training_state.accumulated_modules,
+                        training_state.examples_seen_so_far)
+                else:
+                    self.sample_output_protocol.save_sample_output_data(
+                        training_state.modules,
+                        training_state.accumulated_modules,
+                        sample_output_data,
+                        self.prefix + "/sample_outputs",
+                        training_state.examples_seen_so_far,
+                        device)
+
+            if metrics_accumulator is not None:
+                metrics_accumulator.maybe_flush(training_state.examples_seen_so_far)
 
             # Save checkpoint
             if training_state.examples_seen_so_far >= next_num_examples[KEY_CHECKPOINT]:
+                if metrics_accumulator is not None:
+                    metrics_accumulator.flush(training_state.examples_seen_so_far)
                 checkpoint_index = self.get_checkpoint_index_to_save(training_state.examples_seen_so_far)
                 training_state.save(self.get_checkpoint_prefix(checkpoint_index))
                 if next_num_examples[KEY_CHECKPOINT] != next_num_examples[KEY_SNAPSHOT]:
                     training_state.save(self.get_snapshot_prefix())
+                if checkpoint_callback is not None:
+                    if metrics_accumulator is not None:
+                        metrics_accumulator.wait_until_written()
+                    if not checkpoint_callback(checkpoint_index, training_state.examples_seen_so_far):
+                        logging.info("[Rank %d] Stopped at checkpoint %d." % (rank, checkpoint_index))
+                        break
 
             # Save snapshot
             if training_state.examples_seen_so_far >= next_num_examples[KEY_SNAPSHOT]:
@@ -328,6 +377,11 @@ class SwarmUnitTrainer:
                 logging.info("[Rank %d] Showed %d training examples." % (rank, training_state.examples_seen_so_far))
                 last_time = now
 
+        if metrics_accumulator is not None:
+            metrics_accumulator.close()
+        if self.sample_output_worker is not None:
+            self.sample_output_worker.stop()
+
     @staticmethod
     def run(trainer_factory: Dict[int, Callable[[], 'SwarmUnitTrainer']],
             backend: str = 'gloo',
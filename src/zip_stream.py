@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+# (ZIP 내부 파일명, 해당 파일의 바이트 청크를 순서대로 돌려주는 함수)
+ZipStreamEntry = Tuple[str, Callable[[], Iterable[bytes]]]
+
+_END = object()
+
+
+class _ZipOutputBuffer:
+	"""ZipFile이 쓰는 바이트를 모아 두었다가 제너레이터가 꺼내 가도록 하는 쓰기 전용 버퍼.
+	- 한글 주석: seek/tell을 제공하지 않으므로 ZipFile은 데이터 디스크립터 방식으로 기록한다
+	"""
+
+	def __init__(self):
+		self._chunks: List[bytes] = []
+
+	def write(self, data) -> int:
+		if data:
+			self._chunks.append(bytes(data))
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def drain(self) -> bytes:
+		data = b"".join(self._chunks)
+		self._chunks = []
+		return data
+
+
+def _put_until_cancelled(out: queue.Queue, item, cancelled: threading.Event) -> bool:
+	"""큐에 item을 넣는다. 넣기 전에 스트림이 취소되면 False를 반환."""
+	while not cancelled.is_set():
+		try:
+			out.put(item, timeout=0.5)
+			return True
+		except queue.Full:
+			continue
+	return False
+
+
+def _prefetch_entry(chunks: Callable[[], Iterable[bytes]], out: queue.Queue, cancelled: threading.Event):
+	# 한글 주석: 큐가 가득 차면 기다리므로, 파일마다 최대 큐 크기만큼의 청크만 메모리에 올라간다
+	# 한글 주석: 종료 표시와 예외도 같은 방식으로 넣어야 클라이언트가 끊겼을 때 스레드가 영원히 막히지 않는다
+	try:
+		for chunk in chunks():
+			if not _put_until_cancelled(out, chunk, cancelled):
+				return
+		_put_until_cancelled(out, _END, cancelled)
+	except BaseException as e:
+		_put_until_cancelled(out, e, cancelled)
+
+
+def iter_stored_zip(
+	entries: List[ZipStreamEntry],
+	max_concurrency: int = 4,
+	max_queued_chunks: int = 8,
+) -> Iterator[bytes]:
+	"""
+	여러 파일을 무압축(ZIP_STORED) ZIP 스트림으로 묶어 바이트 청크를 순서대로 반환.
+	- 파일 내용은 최대 max_concurrency개까지 동시에 미리 받아 두고, ZIP에는 entries 순서대로 기록
+	- 디스크를 쓰지 않으며 메모리 사용량은 대략 max_concurrency * max_queued_chunks * 청크 크기로 제한
+	- 이미 압축된 가중치 파일을 다시 압축하지 않으므로 CPU를 쓰지 않고 첫 바이트가 바로 전송된다
+	"""
+	if max_concurrency < 1:
+		raise ValueError("max_concurrency는 1 이상이어야 합니다")
+
+	cancelled = threading.Event()
+	executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="zip-stream")
+	queues: List[queue.Queue] = []
+	try:
+		for _, chunks in entries:
+			q: queue.Queue = queue.Queue(maxsize=max_queued_chunks)
+			queues.append(q)
+			executor.submit(_prefetch_entry, chunks, q, cancelled)
+
+		buffer = _ZipOutputBuffer()
+		with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zf:
+			for (arcname, _), q in zip(entries, queues):
+				info = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+				info.compress_type = zipfile.ZIP_STORED
+				with zf.open(info, "w", force_zip64=True) as dest:
+					while True:
+						item = q.get()
+						if item is _END:
+							break
+						if isinstance(item, BaseException):
+							raise item
+						dest.write(item)
+						data = buffer.drain()
+						if data:
+							yield data
+				data = buffer.drain()
+				if data:
+					yield data
+		# 한글 주석: 중앙 디렉터리는 ZipFile을 닫을 때 기록된다
+		data = buffer.drain()
+		if data:
+			yield data
+	except GeneratorExit:
+		logging.info("ZIP 스트림 전송이 클라이언트에 의해 중단되었습니다")
+		raise
+	finally:
+		cancelled.set()
+		executor.shutdown(wait=False, cancel_futures=True)